@@ -316,6 +316,107 @@ def get_next_attribute(examples, attributes, info_gain_type, numeric_cols, featu
     return next_attribute[0]
 
 
+def get_random_split(examples, attribute_index, numeric):
+    """
+    Draws a random split of an attribute for extremely randomized trees, without sorting the examples.
+    :param examples: List of examples, each of which is a list of values.
+    :param attribute_index: Index of attribute to extract within examples.
+    :param numeric: True if the attribute is numeric.
+    :return: For numeric attributes, a threshold drawn uniformly between the smallest and largest value. For
+        categorical attributes, a list of value sets partitioning the distinct values into two random groups.
+    """
+    if numeric:
+        low = math.inf
+        high = -math.inf
+        for instance in examples:
+            if instance[attribute_index] < low:
+                low = instance[attribute_index]
+            if instance[attribute_index] > high:
+                high = instance[attribute_index]
+        return random.uniform(low, high)
+
+    values = list(get_attribute_values(examples, attribute_index))
+    if len(values) < 2:
+        return [set(values)]
+    random.shuffle(values)
+    cut = random.randint(1, len(values) - 1)
+    return [set(values[:cut]), set(values[cut:])]
+
+
+def information_gain_split(examples, attribute_index, split, numeric, info_gain_type):
+    """
+    Calculates the gain of one given split of an attribute, as drawn by get_random_split.
+    :param examples: List of examples, each of which is a list of values.
+    :param attribute_index: Index of attribute to extract within examples.
+    :param split: Threshold for numeric attributes, or list of value sets for categorical attributes.
+    :param numeric: True if the attribute is numeric.
+    :param info_gain_type: integer to identify preferred method of gain.
+        1 - Entropy
+        2 - Majority Error
+        3 - Gini Index
+    :return: float
+    """
+    if info_gain_type == 1:
+        purity_func = entropy
+    elif info_gain_type == 2:
+        purity_func = majority_error
+    elif info_gain_type == 3:
+        purity_func = gini_index
+
+    # Count labels on each side of the split in a single pass.
+    below = {}
+    above = {}
+    for instance in examples:
+        if numeric:
+            side = above if instance[attribute_index] > split else below
+        else:
+            side = below if instance[attribute_index] in split[0] else above
+        label = instance[LABEL_INDEX]
+        side[label] = side.get(label, 0) + instance[WEIGHT_INDEX]
+
+    labels = dict(below)
+    for label in above:
+        labels[label] = labels.get(label, 0) + above[label]
+
+    gain = purity_func(labels)
+    total = sum(labels.values())
+    for side in (below, above):
+        if len(side) > 0:
+            gain -= purity_func(side) * sum(side.values()) / total
+
+    return gain
+
+
+def get_next_random_split(examples, attributes, info_gain_type, numeric_cols, feature_size):
+    """
+    Extremely randomized trees version of get_next_attribute. Draws one random split per sampled attribute and
+    scores only that split.
+    :param examples: List of examples, each of which is a list of values.
+    :param attributes: List of all attributes available to split.
+    :param info_gain_type: integer to identify preferred method of gain.
+        1 - Entropy
+        2 - Majority Error
+        3 - Gini Index
+    :param numeric_cols: List of columns which are numeric, must be identified when passing initial dataset.
+    :param feature_size: Number of features to consider when splitting tree.
+    :return: index of attribute with highest gain, and its split.
+    """
+    if 0 < feature_size < len(attributes):
+        attribute_list = list(random.sample(attributes, feature_size))
+    else:
+        attribute_list = list(attributes)
+
+    next_attribute = (-1, -1, None)
+    for attribute in attribute_list:
+        numeric = attribute in numeric_cols
+        split = get_random_split(examples, attribute, numeric)
+        gain = information_gain_split(examples, attribute, split, numeric, info_gain_type)
+
+        if gain > next_attribute[1]:
+            next_attribute = (attribute, gain, split)
+    return next_attribute[0], next_attribute[2]
+
+
 def get_examples_by_value(examples, attribute_index, value):
     """
     Creates a list of examples containing the given value within the given attribute.
@@ -354,7 +455,7 @@ def get_examples_by_value_numeric(examples, attribute_index, value, median):
     return example_subset
 
 
-def id3(examples, attributes, labels, max_depth, info_gain_type, numeric_cols, feature_size):
+def id3(examples, attributes, labels, max_depth, info_gain_type, numeric_cols, feature_size, extra_trees=False):
     """
     Recursive ID3 implementation.
     :param examples: List of examples, each of which is a list of values.
@@ -367,6 +468,7 @@ def id3(examples, attributes, labels, max_depth, info_gain_type, numeric_cols, f
         3 - Gini Index
     :param numeric_cols: List of indices of numeric columns, to be provided with initial data.
     :param feature_size: Number of features to consider when splitting tree.
+    :param extra_trees: If True, split on random thresholds/partitions instead of the best median split.
     :return: node containing either an attribute to split, or a label to assign.
     """
 
@@ -385,12 +487,18 @@ def id3(examples, attributes, labels, max_depth, info_gain_type, numeric_cols, f
     # 1 - entropy
     # 2 - majority error
     # 3 - gini index
-    node[math.inf] = get_next_attribute(examples,attributes, info_gain_type, numeric_cols, feature_size)
+    if extra_trees:
+        node[math.inf], split = get_next_random_split(examples, attributes, info_gain_type, numeric_cols,
+                                                      feature_size)
+    else:
+        node[math.inf] = get_next_attribute(examples,attributes, info_gain_type, numeric_cols, feature_size)
     if node[math.inf] in numeric_cols:
         next_attribute_numeric = True
     node[-math.inf] = get_key_by_max_value(labels) # add most common label in case unknown attribute values found
     new_attributes = list(attributes)
-    new_attributes.remove(node[math.inf])
+    # A random threshold does not use up a numeric attribute, so extremely randomized trees may split on it again.
+    if not (extra_trees and next_attribute_numeric):
+        new_attributes.remove(node[math.inf])
 
     # add most common value to None key for looking up unknown values in test.
     node[None] = get_key_by_max_value(get_attribute_values(examples, node[math.inf]))
@@ -398,21 +506,40 @@ def id3(examples, attributes, labels, max_depth, info_gain_type, numeric_cols, f
     # lazily handling numeric values with separate functions.
     # for numeric values, index 0 contains reference value (median), while -1 is a branch for values less than median,
     # 1 is branch for those greater than median.
+    # Extremely randomized trees store their random threshold in the same place.
     if next_attribute_numeric:
-        node[0] = get_median(examples, node[math.inf])
+        if extra_trees:
+            node[0] = split
+        else:
+            node[0] = get_median(examples, node[math.inf])
         examples_less = get_examples_by_value_numeric(examples, node[math.inf], -1, node[0])
         if len(examples_less) == 0:
             return get_key_by_max_value(labels)
         # Otherwise, recursively add the next subtree
         new_labels = get_attribute_values(examples_less, LABEL_INDEX)
-        node[-1] = id3(examples_less, new_attributes, new_labels, max_depth - 1, info_gain_type, numeric_cols, feature_size)
+        node[-1] = id3(examples_less, new_attributes, new_labels, max_depth - 1, info_gain_type, numeric_cols, feature_size,
+                       extra_trees)
 
         examples_greater = get_examples_by_value_numeric(examples, node[math.inf], 1, node[0])
         if len(examples_greater) == 0:
             return get_key_by_max_value(labels)
         # Otherwise, recursively add the next subtree
         new_labels = get_attribute_values(examples_greater, LABEL_INDEX)
-        node[1] = id3(examples_greater, new_attributes, new_labels, max_depth - 1, info_gain_type, numeric_cols, feature_size)
+        node[1] = id3(examples_greater, new_attributes, new_labels, max_depth - 1, info_gain_type, numeric_cols, feature_size,
+                      extra_trees)
+    elif extra_trees:
+        # Random partition of categorical values: every value in a group points to the same subtree, so get_label
+        # needs no changes.
+        for group in split:
+            examples_v = [instance for instance in examples if instance[node[math.inf]] in group]
+            if len(examples_v) == 0:
+                return get_key_by_max_value(labels)
+
+            new_labels = get_attribute_values(examples_v, LABEL_INDEX)
+            subtree = id3(examples_v, new_attributes, new_labels, max_depth - 1, info_gain_type, numeric_cols,
+                          feature_size, extra_trees)
+            for value in group:
+                node[value] = subtree
     else:
         # Iterate through values v of a (not label, but value of the attribute, like tall or short for height)
         values = get_attribute_values(examples, node[math.inf])
@@ -426,7 +553,8 @@ def id3(examples, attributes, labels, max_depth, info_gain_type, numeric_cols, f
 
             # Otherwise, recursively add the next subtree
             new_labels = get_attribute_values(examples_v, LABEL_INDEX)
-            node[value] = id3(examples_v, new_attributes, new_labels, max_depth - 1, info_gain_type, numeric_cols, feature_size)
+            node[value] = id3(examples_v, new_attributes, new_labels, max_depth - 1, info_gain_type, numeric_cols, feature_size,
+                              extra_trees)
 
     return node
 
@@ -541,7 +669,8 @@ def build_decision_tree(example_param, max_depth, info_gain_type, numeric_cols,
     return id3(examples, list(range(LABEL_INDEX)), labels, max_depth, info_gain_type, numeric_cols, -1)
 
 
-def build_random_tree(example_param, max_depth, info_gain_type, numeric_cols, missing_identifier, feature_size):
+def build_random_tree(example_param, max_depth, info_gain_type, numeric_cols, missing_identifier, feature_size,
+                      extra_trees=False):
     """
     Build a decision tree using ID3
     :param example_param: Data, or file path to data
@@ -553,6 +682,9 @@ def build_random_tree(example_param, max_depth, info_gain_type, numeric_cols, mi
     :param numeric_cols: List of indices indicating which columns are numeric
     :param missing_identifier: Data within examples indicating a missing value.
     :param feature_size: Number of features to sample when splitting tree.
+    :param extra_trees: If True, build an extremely randomized tree. Each sampled feature gets one random threshold
+        (numeric) or random two-way partition of its values (categorical), and only that split is scored, so no
+        sorting is needed.
     :return: DefaultDict root of a decision tree
     """
 
@@ -568,7 +700,8 @@ def build_random_tree(example_param, max_depth, info_gain_type, numeric_cols, mi
 
     labels = get_attribute_values(examples, LABEL_INDEX)
 
-    return id3(examples, list(range(LABEL_INDEX)), labels, max_depth, info_gain_type, numeric_cols, feature_size)
+    return id3(examples, list(range(LABEL_INDEX)), labels, max_depth, info_gain_type, numeric_cols, feature_size,
+               extra_trees)
 
 ########################################################################################################
 ##########                                BEGIN TEST TREE                                     ##########
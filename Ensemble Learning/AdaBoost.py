@@ -8,7 +8,11 @@ This is an implementation of the AdaBoost algorithm for CS6350 at University of
 
 """
 import math
+import random
+import numpy
 import ID3
+import IOUtilities
+import PackedForest
 
 
 LABEL_INDEX = -1
@@ -17,31 +21,98 @@ INFO_GAIN_TYPE = 1
 
 
 def ada_boost(examples, iterations, numeric_cols, missing_identifier):
-    global LABEL_INDEX
-    global WEIGHT_INDEX
-
-    LABEL_INDEX = len(examples[0]) - 2
-    WEIGHT_INDEX = len(examples[0]) - 1
-
-    tree_depth = 1
-
-    trees = []
-    error = -1
-
-    for t in range(iterations):
-        if error == 0:
-            break
-
-        if t == 0:
-            tree = None
-
-        alpha = weight_examples(examples, tree, error, numeric_cols, missing_identifier)
-        tree = ID3.build_decision_tree(examples, tree_depth, INFO_GAIN_TYPE, numeric_cols, missing_identifier)
-        results = ID3.test_tree(tree, examples, numeric_cols, missing_identifier)
-        error = 1 - (results[0] / results[1])
-        trees.append(tuple([tree, alpha, error]))
-
-    return trees
+    ensemble = AdaBoostEnsemble(examples, numeric_cols, missing_identifier)
+    ensemble.continue_training(iterations)
+    return ensemble.hypothesis
+
+
+class AdaBoostEnsemble:
+    """
+    Resumable AdaBoost hypothesis. Keeps the current example weights, the last stump and its error, and the random
+    state, so continue_training can append rounds to an existing hypothesis without repeating earlier work.
+    Running 100 rounds and then continuing for 400 more builds the same hypothesis as running 500 rounds at once.
+    """
+
+    def __init__(self, examples, numeric_cols, missing_identifier, seed=None):
+        """
+        :param examples: data set as a list of examples, each represented by a list of values, a label, and a weight.
+        :param numeric_cols: List of indices indicating which columns are numeric
+        :param missing_identifier: Data within examples indicating a missing value.
+        :param seed: Seed for the random state of this ensemble, or None to draw one from the random module.
+        """
+        global LABEL_INDEX
+        global WEIGHT_INDEX
+
+        LABEL_INDEX = len(examples[0]) - 2
+        WEIGHT_INDEX = len(examples[0]) - 1
+
+        self.examples = examples
+        self.numeric_cols = numeric_cols
+        self.missing_identifier = missing_identifier
+        self.hypothesis = []
+        self.tree = None
+        self.error = -1
+        self.weights = None
+        if seed is None:
+            # Draw from the global random module so random.seed() still makes results reproducible.
+            seed = random.getrandbits(64)
+        self.rng_state = random.Random(seed).getstate()
+
+    def continue_training(self, extra_iterations):
+        """
+        Runs additional rounds of AdaBoost, appending a (tree, alpha, error) tuple to the hypothesis for each.
+        :param extra_iterations: Number of rounds to add.
+        :return: The hypothesis list.
+        """
+        global LABEL_INDEX
+        global WEIGHT_INDEX
+
+        LABEL_INDEX = len(self.examples[0]) - 2
+        WEIGHT_INDEX = len(self.examples[0]) - 1
+
+        # Restore weights in case the examples were modified between calls.
+        if self.weights is not None:
+            for instance, weight in zip(self.examples, self.weights):
+                instance[WEIGHT_INDEX] = weight
+
+        outer_state = random.getstate()
+        random.setstate(self.rng_state)
+        try:
+            for t in range(extra_iterations):
+                if self.error == 0:
+                    break
+
+                alpha = weight_examples(self.examples, self.tree, self.error, self.numeric_cols,
+                                        self.missing_identifier)
+                self.tree = ID3.build_decision_tree(self.examples, 1, INFO_GAIN_TYPE, self.numeric_cols,
+                                                    self.missing_identifier)
+                results = ID3.test_tree(self.tree, self.examples, self.numeric_cols, self.missing_identifier)
+                self.error = 1 - (results[0] / results[1])
+                self.hypothesis.append(tuple([self.tree, alpha, self.error]))
+        finally:
+            self.rng_state = random.getstate()
+            random.setstate(outer_state)
+
+        self.weights = [instance[WEIGHT_INDEX] for instance in self.examples]
+
+        return self.hypothesis
+
+    def save_checkpoint(self, file_path):
+        """
+        Saves this ensemble, including training data, weights and random state, so training can be resumed later.
+        :param file_path: Path of the checkpoint file.
+        :return: None
+        """
+        IOUtilities.save_model(self, file_path)
+
+
+def load_checkpoint(file_path):
+    """
+    Loads an AdaBoostEnsemble saved by save_checkpoint.
+    :param file_path: Path of the checkpoint file.
+    :return: AdaBoostEnsemble ready for continue_training.
+    """
+    return IOUtilities.load_model(file_path)
 
 
 def weight_examples(examples, tree, error, numeric_cols, missing_identifier):
@@ -126,3 +197,191 @@ def test_ada_boost_hypothesis(hypothesis, example_param, numeric_cols, missing_i
         results.append(tuple([matches, total]))
 
     return results
+
+
+########################################################################################################
+##########                           Multi-class SAMME AdaBoost                               ##########
+########################################################################################################
+########################################################################################################
+
+
+class SammeModel:
+    """
+    Multi-class AdaBoost hypothesis learned by samme. The stumps are packed into one PackedForest with a leaf per
+    node, and leaf_scores holds the (nodes x labels) score each leaf adds, so the staged score matrix of any prefix
+    of rounds is a running sum.
+    """
+
+    def __init__(self, labels, vocabulary, numeric_cols, algorithm):
+        self.labels = labels
+        self.vocabulary = vocabulary
+        self.numeric_cols = numeric_cols
+        self.algorithm = algorithm
+        self.stumps = []
+        self.alphas = []
+        self.errors = []
+        self.packed = None
+        self.leaf_scores = None
+
+
+def samme(examples, iterations, numeric_cols, missing_identifier, algorithm="SAMME", tree_depth=1, learning_rate=1.0,
+          epsilon=1e-3):
+    """
+    Multi-class AdaBoost (SAMME, or SAMME.R using leaf class probabilities) over ID3 decision stumps. Example weights
+    are kept in a numpy vector, and the weighted error, alpha and renormalized weights of each round are computed
+    with array operations on the round's prediction vector.
+    :param examples: data set as a list of examples, each represented by a list of values, a label, and a weight.
+        The weight column is used as the initial distribution, and is restored after training.
+    :param iterations: Number of boosting rounds.
+    :param numeric_cols: List of indices indicating which columns are numeric
+    :param missing_identifier: Data within examples indicating a missing value.
+    :param algorithm: "SAMME" for discrete votes, or "SAMME.R" for real-valued votes from leaf probabilities.
+    :param tree_depth: Depth of each weak learner.
+    :param learning_rate: Shrinkage applied to every round's votes and weight update.
+    :param epsilon: Floor on SAMME.R leaf probabilities, which bounds the vote of a label a leaf never saw.
+    :return: SammeModel
+    """
+    if algorithm not in ("SAMME", "SAMME.R"):
+        raise ValueError("algorithm must be 'SAMME' or 'SAMME.R'.")
+
+    label_index = len(examples[0]) - 2
+    weight_index = len(examples[0]) - 1
+    ID3.LABEL_INDEX = label_index
+    ID3.WEIGHT_INDEX = weight_index
+
+    if missing_identifier is not None:
+        ID3.fill_missing_values(examples, missing_identifier)
+
+    labels = sorted(ID3.get_attribute_values(examples, label_index))
+    label_count = len(labels)
+    label_codes = {label: code for code, label in enumerate(labels)}
+    true_labels = numpy.array([label_codes[instance[label_index]] for instance in examples])
+
+    vocabulary = PackedForest.build_vocabulary(examples, numeric_cols, label_index)
+    model = SammeModel(labels, vocabulary, numeric_cols, algorithm)
+    encoder = PackedForest.PackedForest(labels, vocabulary, numeric_cols)
+    encoded = PackedForest.encode_examples(encoder, examples, None, label_index)
+
+    initial_weights = [instance[weight_index] for instance in examples]
+    weights = numpy.array(initial_weights, dtype=numpy.float64)
+    weights /= weights.sum()
+    # SAMME.R codes the true label as 1 and every other label as -1/(K-1).
+    label_coding = numpy.full((len(examples), label_count), -1 / max(label_count - 1, 1))
+    label_coding[numpy.arange(len(examples)), true_labels] = 1
+
+    leaf_scores = []
+    for t in range(iterations):
+        for instance, weight in zip(examples, weights):
+            instance[weight_index] = weight
+
+        stump = ID3.build_decision_tree(examples, tree_depth, INFO_GAIN_TYPE, numeric_cols, None)
+        packed = PackedForest.pack_forest([stump], numeric_cols, labels, vocabulary, unique_leaves=True)
+        leaves = PackedForest.apply_forest(packed, encoded)[:, 0]
+        predictions = packed.value[leaves]
+        incorrect = predictions != true_labels
+        error = weights[incorrect].sum()
+
+        if algorithm == "SAMME":
+            if error >= 1 - 1 / label_count:
+                # No better than chance; stop boosting.
+                break
+            if error > 0:
+                alpha = learning_rate * (math.log((1 - error) / error) + math.log(label_count - 1))
+            else:
+                alpha = learning_rate
+            scores = numpy.zeros((packed.n_nodes, label_count))
+            leaf_nodes = numpy.flatnonzero(packed.feature < 0)
+            scores[leaf_nodes, packed.value[leaf_nodes]] = alpha
+            weights *= numpy.exp(alpha * incorrect)
+        else:
+            alpha = learning_rate
+            # Weighted label distribution of the training examples reaching each leaf.
+            counts = numpy.bincount(leaves * label_count + true_labels, weights=weights,
+                                    minlength=packed.n_nodes * label_count).reshape((packed.n_nodes, label_count))
+            totals = counts.sum(axis=1, keepdims=True)
+            probabilities = numpy.where(totals > 0, counts / numpy.maximum(totals, 1e-300), 1 / label_count)
+            log_probabilities = numpy.log(numpy.clip(probabilities, epsilon, None))
+            scores = alpha * (label_count - 1) * (log_probabilities
+                                                  - log_probabilities.mean(axis=1, keepdims=True))
+            weights *= numpy.exp(-alpha * (label_count - 1) / label_count
+                                 * (label_coding * log_probabilities[leaves]).sum(axis=1))
+
+        weights /= weights.sum()
+        model.stumps.append(stump)
+        model.alphas.append(alpha)
+        model.errors.append(error)
+        leaf_scores.append(scores)
+
+        if error == 0:
+            break
+
+    for instance, weight in zip(examples, initial_weights):
+        instance[weight_index] = weight
+
+    # Packing the stumps together numbers their nodes in the same order, so the per-round tables stack directly.
+    model.packed = PackedForest.pack_forest(model.stumps, numeric_cols, labels, vocabulary, unique_leaves=True)
+    model.leaf_scores = numpy.vstack(leaf_scores) if leaf_scores else numpy.zeros((0, label_count))
+
+    return model
+
+
+def staged_samme_scores(model, encoded):
+    """
+    Yields the accumulated (examples x labels) score matrix after each round.
+    :param model: SammeModel
+    :param encoded: Examples encoded with PackedForest.encode_examples using model.vocabulary.
+    """
+    scores = numpy.zeros((len(encoded), len(model.labels)))
+    if len(model.stumps) == 0:
+        return
+    leaves = PackedForest.apply_forest(model.packed, encoded)
+    for t in range(len(model.stumps)):
+        scores += model.leaf_scores[leaves[:, t]]
+        yield scores.copy()
+
+
+def encode_samme_examples(model, example_param, missing_identifier):
+    if isinstance(example_param, str):
+        examples = ID3.data_parsing(example_param, model.numeric_cols)
+    elif isinstance(example_param, list):
+        examples = example_param
+    else:
+        raise AttributeError("Invalid data type: Please pass either file path or list of examples to build tree.")
+    attribute_count = len(examples[0]) - 2
+    return examples, PackedForest.encode_examples(model.packed, examples, missing_identifier, attribute_count)
+
+
+def get_samme_labels(model, example_param, missing_identifier):
+    """
+    Labels assigned to every example by the full SAMME hypothesis.
+    :return: List of labels.
+    """
+    examples, encoded = encode_samme_examples(model, example_param, missing_identifier)
+    scores = numpy.zeros((len(examples), len(model.labels)))
+    for scores in staged_samme_scores(model, encoded):
+        pass
+    return [model.labels[index] for index in numpy.argmax(scores, axis=1)]
+
+
+def test_samme_hypothesis(model, example_param, missing_identifier):
+    """
+    Tests data against a SAMME hypothesis after every round.
+    :param model: SammeModel
+    :param example_param: Data, or file path to data
+    :param missing_identifier: Data within examples indicating a missing value.
+    :return: List of tuples, where each tuple is of the form (matches_i, total_i) for the first i+1 stumps.
+    """
+    examples, encoded = encode_samme_examples(model, example_param, missing_identifier)
+    label_index = len(examples[0]) - 2
+    weight_index = len(examples[0]) - 1
+
+    label_codes = {label: code for code, label in enumerate(model.labels)}
+    true_labels = numpy.array([label_codes.get(instance[label_index], -1) for instance in examples])
+    weights = numpy.array([instance[weight_index] for instance in examples], dtype=numpy.float64)
+    total = float(weights.sum())
+
+    results = []
+    for scores in staged_samme_scores(model, encoded):
+        matches = float(weights[numpy.argmax(scores, axis=1) == true_labels].sum())
+        results.append(tuple([matches, total]))
+    return results
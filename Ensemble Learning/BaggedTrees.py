@@ -9,6 +9,7 @@ This is an implementation of a bagged trees algorithm for CS6350 at University o
 """
 
 import ID3
+import IOUtilities
 import random
 
 
@@ -18,25 +19,88 @@ INFO_GAIN_TYPE = 1
 
 
 def bagged_trees(examples, iterations, sample_size, numeric_cols, missing_identifier):
-    global LABEL_INDEX
-    global WEIGHT_INDEX
-
-    LABEL_INDEX = len(examples[0]) - 2
-    WEIGHT_INDEX = len(examples[0]) - 1
-
-    tree_depth = -1
-
-    trees = []
-    samples = []
-
-    for t in range(iterations):
-        samples.append(resample(examples, sample_size))
-        tree = ID3.build_decision_tree(samples[t], tree_depth, INFO_GAIN_TYPE, numeric_cols, missing_identifier)
-        results = ID3.test_tree(tree, examples, numeric_cols, missing_identifier)
-        accuracy = results[0] / results[1]
-        trees.append(tuple([tree, accuracy]))
-
-    return trees
+    ensemble = BaggedTreesEnsemble(examples, sample_size, numeric_cols, missing_identifier)
+    ensemble.continue_training(iterations)
+    return ensemble.hypothesis
+
+
+class BaggedTreesEnsemble:
+    """
+    Resumable bagged trees hypothesis. Keeps the random state used for resampling, so continue_training can append
+    trees to an existing hypothesis without repeating earlier work. Building 100 trees and then continuing for 400
+    more builds the same hypothesis as building 500 trees at once.
+    """
+
+    def __init__(self, examples, sample_size, numeric_cols, missing_identifier, seed=None):
+        """
+        :param examples: data set as a list of examples, each represented by a list of values, a label, and a weight.
+        :param sample_size: integer size of bagged sample for each tree construction.
+        :param numeric_cols: List of indices indicating which columns are numeric
+        :param missing_identifier: Data within examples indicating a missing value.
+        :param seed: Seed for the random state of this ensemble, or None to draw one from the random module.
+        """
+        global LABEL_INDEX
+        global WEIGHT_INDEX
+
+        LABEL_INDEX = len(examples[0]) - 2
+        WEIGHT_INDEX = len(examples[0]) - 1
+
+        self.examples = examples
+        self.sample_size = sample_size
+        self.numeric_cols = numeric_cols
+        self.missing_identifier = missing_identifier
+        self.hypothesis = []
+        if seed is None:
+            # Draw from the global random module so random.seed() still makes results reproducible.
+            seed = random.getrandbits(64)
+        self.rng_state = random.Random(seed).getstate()
+
+    def continue_training(self, extra_iterations):
+        """
+        Builds additional trees, appending a (tree, accuracy) tuple to the hypothesis for each.
+        :param extra_iterations: Number of trees to add.
+        :return: The hypothesis list.
+        """
+        global LABEL_INDEX
+        global WEIGHT_INDEX
+
+        LABEL_INDEX = len(self.examples[0]) - 2
+        WEIGHT_INDEX = len(self.examples[0]) - 1
+
+        tree_depth = -1
+
+        outer_state = random.getstate()
+        random.setstate(self.rng_state)
+        try:
+            for t in range(extra_iterations):
+                sample = resample(self.examples, self.sample_size)
+                tree = ID3.build_decision_tree(sample, tree_depth, INFO_GAIN_TYPE, self.numeric_cols,
+                                               self.missing_identifier)
+                results = ID3.test_tree(tree, self.examples, self.numeric_cols, self.missing_identifier)
+                accuracy = results[0] / results[1]
+                self.hypothesis.append(tuple([tree, accuracy]))
+        finally:
+            self.rng_state = random.getstate()
+            random.setstate(outer_state)
+
+        return self.hypothesis
+
+    def save_checkpoint(self, file_path):
+        """
+        Saves this ensemble, including training data and random state, so training can be resumed later.
+        :param file_path: Path of the checkpoint file.
+        :return: None
+        """
+        IOUtilities.save_model(self, file_path)
+
+
+def load_checkpoint(file_path):
+    """
+    Loads a BaggedTreesEnsemble saved by save_checkpoint.
+    :param file_path: Path of the checkpoint file.
+    :return: BaggedTreesEnsemble ready for continue_training.
+    """
+    return IOUtilities.load_model(file_path)
 
 
 def resample(examples, sample_size):
@@ -69,6 +133,46 @@ def get_label(hypothesis, example, numeric_cols, missing_identifier):
     return result
 
 
+def get_final_label(hypothesis, example, numeric_cols, missing_identifier):
+    """
+    Final prediction of the bagged trees for one example. Trees are evaluated in order, stopping as soon as the remaining
+    trees' accuracy weights can no longer change the weighted vote. Returns the same label as the last entry of get_label.
+    :param hypothesis: List of (tree, accuracy) tuples as returned by bagged_trees.
+    :param example: A single example in the form of a list of values.
+    :param numeric_cols: List of indices indicating which columns are numeric
+    :param missing_identifier: Data within examples indicating a missing value.
+    :return: Assigned label, and integer number of trees evaluated.
+    """
+    # Weight of the trees after each position, as suffix sums rather than by repeated subtraction, with a margin for
+    # the round-off of summing the votes in a different order, so a near-tie never stops early on the wrong side.
+    remaining = [0.0] * len(hypothesis)
+    for t in range(len(hypothesis) - 2, -1, -1):
+        remaining[t] = remaining[t + 1] + hypothesis[t + 1][1]
+    epsilon = 1e-9 * (remaining[0] + hypothesis[0][1]) if hypothesis else 0.0
+
+    guess = 0
+    evaluated = 0
+
+    for t, operand in enumerate(hypothesis):
+        label = ID3.get_label(operand[0], example, numeric_cols, missing_identifier)
+
+        if label == "yes":
+            guess += operand[1]
+        else:
+            guess -= operand[1]
+
+        evaluated += 1
+
+        # Ties go to "yes", so "yes" is decided once guess can no longer drop below zero.
+        if guess - remaining[t] > epsilon or guess + remaining[t] < -epsilon:
+            break
+
+    if guess < 0:
+        return "no", evaluated
+    else:
+        return "yes", evaluated
+
+
 def test_bagged_tree_hypothesis(hypothesis, example_param, numeric_cols, missing_identifier):
 
     if isinstance(example_param, str):
@@ -101,3 +205,34 @@ def test_bagged_tree_hypothesis(hypothesis, example_param, numeric_cols, missing
         results.append(tuple([matches, total]))
 
     return results
+
+
+def test_bagged_tree_final(hypothesis, example_param, numeric_cols, missing_identifier):
+    """
+    Tests data against the final prediction of a hypothesis using early-exit voting.
+    :param hypothesis: Hypothesis as returned by bagged_trees.
+    :param example_param: data, or file path to data
+    :param numeric_cols: list of columns which are numeric.
+    :param missing_identifier: Data within examples indicating a missing value.
+    :return: matches, total, and integer number of trees evaluated over all examples.
+    """
+
+    if isinstance(example_param, str):
+        examples = ID3.data_parsing(example_param, numeric_cols)
+    elif isinstance(example_param, list):
+        examples = example_param
+    else:
+        raise AttributeError("Invalid data type: Please pass either file path or list of examples to build tree.")
+
+    matches = 0
+    total = 0
+    trees_evaluated = 0
+
+    for instance in examples:
+        label, evaluated = get_final_label(hypothesis, instance, numeric_cols, missing_identifier)
+        if instance[LABEL_INDEX] == label:
+            matches += instance[WEIGHT_INDEX]
+        total += instance[WEIGHT_INDEX]
+        trees_evaluated += evaluated
+
+    return matches, total, trees_evaluated
@@ -0,0 +1,172 @@
+"""
+Author: John Jacobson (u1201441)
+Created: 2019-04-28
+
+This is a bias/variance decomposition utility for the bagged trees and random forest experiments. Replicate ensembles
+are trained on random subsets of the data in a process pool, every replicate is scored on the evaluation set with the
+packed forest predictor, and bias and variance are computed from the resulting (replicates x examples) +/-1 matrix.
+
+"""
+import concurrent.futures
+import multiprocessing
+import os
+import random
+import numpy
+
+import BaggedTrees
+import ID3
+import PackedForest
+import RandomForest
+
+
+# Training examples for replicate workers, set once per process by init_worker.
+WORKER_EXAMPLES = None
+
+
+def init_worker(examples):
+    global WORKER_EXAMPLES
+    WORKER_EXAMPLES = examples
+    # ID3 reads these globals; spawned workers do not inherit them from the parent process.
+    ID3.LABEL_INDEX = len(examples[0]) - 2
+    ID3.WEIGHT_INDEX = len(examples[0]) - 1
+
+
+def train_replicate(ensemble_type, replicate_size, iterations, sample_size, numeric_cols, missing_identifier,
+                    feature_size, seed):
+    """
+    Trains one replicate ensemble on a random subset of the worker's training examples.
+    :return: Hypothesis list as returned by bagged_trees or random_forest.
+    """
+    rng = random.Random(seed)
+    # Copy the sampled rows; ID3 fills missing values in place.
+    data = [list(instance) for instance in rng.sample(WORKER_EXAMPLES, replicate_size)]
+    if ensemble_type == "bagged":
+        ensemble = BaggedTrees.BaggedTreesEnsemble(data, sample_size, numeric_cols, missing_identifier,
+                                                   seed=rng.getrandbits(64))
+    elif ensemble_type == "forest":
+        ensemble = RandomForest.RandomForestEnsemble(data, sample_size, numeric_cols, missing_identifier,
+                                                     feature_size, seed=rng.getrandbits(64))
+    else:
+        raise ValueError("Unknown ensemble type: " + str(ensemble_type))
+    return ensemble.continue_training(iterations)
+
+
+def train_replicates(ensemble_type, examples, replicates, replicate_size, iterations, sample_size, numeric_cols,
+                     missing_identifier, feature_size=-1, processes=None, seed=None, start_method=None):
+    """
+    Trains independent replicate ensembles in a process pool.
+    :param ensemble_type: "bagged" for bagged trees, or "forest" for a random forest.
+    :param examples: Training data as a list of examples, each with a label and weight.
+    :param replicates: Number of replicate ensembles.
+    :param replicate_size: Number of examples sampled without replacement for each replicate.
+    :param iterations: Number of trees in each replicate.
+    :param sample_size: Bagged sample size for each tree.
+    :param numeric_cols: List of indices indicating which columns are numeric
+    :param missing_identifier: Data within examples indicating a missing value.
+    :param feature_size: Number of features sampled per split, for random forests.
+    :param processes: Number of worker processes; None uses every CPU, 1 trains in this process.
+    :param seed: Seed for the replicate seeds, or None to draw one from the random module.
+    :param start_method: multiprocessing start method for the pool, e.g. "spawn", or None for the default. Results
+        are the same for every start method.
+    :return: List of hypotheses, one per replicate, in replicate order.
+    """
+    rng = random.Random(random.getrandbits(64) if seed is None else seed)
+    seeds = [rng.getrandbits(64) for r in range(replicates)]
+    args = (ensemble_type, replicate_size, iterations, sample_size, numeric_cols, missing_identifier, feature_size)
+
+    if processes is None:
+        processes = os.cpu_count() or 1
+
+    if processes == 1:
+        init_worker(examples)
+        return [train_replicate(*args, replicate_seed) for replicate_seed in seeds]
+
+    context = multiprocessing.get_context(start_method)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=processes, mp_context=context, initializer=init_worker,
+                                                initargs=(examples,)) as executor:
+        futures = [executor.submit(train_replicate, *args, replicate_seed) for replicate_seed in seeds]
+        return [future.result() for future in futures]
+
+
+def ensemble_predictions(hypotheses, examples, numeric_cols, missing_identifier, positive_label="yes",
+                         weighted=False):
+    """
+    Scores every replicate ensemble on every example with batch inference.
+    :param hypotheses: List of hypotheses, e.g. from train_replicates.
+    :param examples: Evaluation examples.
+    :param numeric_cols: List of indices indicating which columns are numeric
+    :param missing_identifier: Data within examples indicating a missing value.
+    :param positive_label: Label mapped to +1; ties in the vote also go to this label, as in get_label.
+    :param weighted: True to weight votes by the accuracy stored with each tree (bagged trees).
+    :return: numpy int8 array of shape (replicates, examples) containing +/-1 predictions.
+    """
+    attribute_count = len(examples[0]) - 2
+    vocabulary = PackedForest.build_vocabulary(examples, numeric_cols, attribute_count)
+    encoded = None
+
+    predictions = numpy.empty((len(hypotheses), len(examples)), dtype=numpy.int8)
+    for r, hypothesis in enumerate(hypotheses):
+        packed = PackedForest.pack_forest(hypothesis, numeric_cols, labels=[positive_label], vocabulary=vocabulary)
+        if encoded is None:
+            encoded = PackedForest.encode_examples(packed, examples, missing_identifier, attribute_count)
+        tree_weights = [operand[1] for operand in hypothesis] if weighted else None
+        votes = PackedForest.predict_votes(packed, encoded, tree_weights)
+        margin = 2 * votes[:, 0] - votes.sum(axis=1)
+        predictions[r] = numpy.where(margin >= 0, 1, -1)
+    return predictions
+
+
+def tree_predictions(trees, examples, numeric_cols, missing_identifier, positive_label="yes"):
+    """
+    Scores single trees on every example with batch inference.
+    :param trees: List of decision trees.
+    :return: numpy int8 array of shape (trees, examples) containing +/-1 predictions.
+    """
+    attribute_count = len(examples[0]) - 2
+    vocabulary = PackedForest.build_vocabulary(examples, numeric_cols, attribute_count)
+    packed = PackedForest.pack_forest(trees, numeric_cols, labels=[positive_label], vocabulary=vocabulary)
+    encoded = PackedForest.encode_examples(packed, examples, missing_identifier, attribute_count)
+    leaf_labels = packed.value[PackedForest.apply_forest(packed, encoded)]
+    return numpy.where(leaf_labels.T == 0, 1, -1).astype(numpy.int8)
+
+
+def bias_variance(predictions, true_labels):
+    """
+    Decomposes the squared error of +/-1 predictions across replicates.
+    :param predictions: numpy array of shape (replicates, examples) of +/-1 predictions.
+    :param true_labels: numpy array of +/-1 true labels, one per example.
+    :return: bias and variance, each averaged over examples.
+    """
+    average = predictions.mean(axis=0)
+    bias = numpy.mean((average - true_labels) ** 2)
+    variance = numpy.mean(predictions.var(axis=0))
+    return float(bias), float(variance)
+
+
+def bias_variance_experiment(ensemble_type, examples, eval_examples, replicates, replicate_size, iterations,
+                             sample_size, numeric_cols, missing_identifier, feature_size=-1, positive_label="yes",
+                             processes=None, seed=None, start_method=None):
+    """
+    Trains replicate ensembles and computes bias and variance of both the ensembles and of their first trees. The
+    single tree statistics reuse the replicates, so no extra training is needed.
+    :param ensemble_type: "bagged" for bagged trees, or "forest" for a random forest.
+    :param examples: Training data as a list of examples, each with a label and weight.
+    :param eval_examples: Examples to compute bias and variance on.
+    :param positive_label: Label mapped to +1.
+    Remaining parameters are passed to train_replicates.
+    :return: tree bias, tree variance, ensemble bias, ensemble variance
+    """
+    hypotheses = train_replicates(ensemble_type, examples, replicates, replicate_size, iterations, sample_size,
+                                  numeric_cols, missing_identifier, feature_size, processes, seed, start_method)
+
+    label_index = len(eval_examples[0]) - 2
+    true_labels = numpy.array([1 if instance[label_index] == positive_label else -1 for instance in eval_examples])
+
+    trees = tree_predictions([hypothesis[0][0] for hypothesis in hypotheses], eval_examples, numeric_cols,
+                             missing_identifier, positive_label)
+    ensembles = ensemble_predictions(hypotheses, eval_examples, numeric_cols, missing_identifier, positive_label,
+                                     weighted=(ensemble_type == "bagged"))
+
+    tree_bias, tree_variance = bias_variance(trees, true_labels)
+    ensemble_bias, ensemble_variance = bias_variance(ensembles, true_labels)
+    return tree_bias, tree_variance, ensemble_bias, ensemble_variance
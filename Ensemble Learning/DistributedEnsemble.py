@@ -0,0 +1,291 @@
+"""
+Author: John Jacobson (u1201441)
+Created: 2019-04-28
+
+This is a coordinator/worker mode for training bagged trees and random forests across several processes or machines.
+
+The coordinator listens on a TCP socket and hands out one seed per tree. Workers load the data set themselves, either
+from a shared file path or from the list sent by the coordinator, build one tree per seed, and send the pickled tree
+back. Seeds that are not returned within the timeout are re-issued to an idle worker, and seeds held by a worker that
+disconnects are re-queued, so the forest finishes as long as one worker is alive. Every tree depends only on its seed,
+so the hypothesis is the same no matter which worker built which tree.
+
+Workers on other machines are started with:
+    python DistributedEnsemble.py <coordinator host> <coordinator port>
+
+Messages are pickled, so only connect workers and coordinators that trust each other.
+
+"""
+import multiprocessing
+import pickle
+import random
+import selectors
+import socket
+import struct
+import sys
+import time
+
+import BaggedTrees
+import ID3
+import RandomForest
+
+
+HEADER = struct.Struct(">Q")
+
+
+def send_message(sock, message):
+    """
+    Sends a pickled object prefixed with its length.
+    :param sock: Connected socket.
+    :param message: Object to send.
+    :return: None
+    """
+    payload = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+    sock.sendall(HEADER.pack(len(payload)) + payload)
+
+
+def receive_exactly(sock, size):
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise ConnectionError("Connection closed.")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def receive_message(sock):
+    """
+    Receives one object sent by send_message.
+    :param sock: Connected socket.
+    :return: Unpickled object.
+    """
+    size = HEADER.unpack(receive_exactly(sock, HEADER.size))[0]
+    return pickle.loads(receive_exactly(sock, size))
+
+
+def build_tree(config, examples, seed):
+    """
+    Builds the single hypothesis entry for one seed.
+    :param config: Dict of training parameters sent by the coordinator.
+    :param examples: Training data.
+    :param seed: Seed for this tree.
+    :return: (tree, accuracy) for bagged trees, or (tree, results) for random forests.
+    """
+    if config["ensemble_type"] == "bagged":
+        ensemble = BaggedTrees.BaggedTreesEnsemble(examples, config["sample_size"], config["numeric_cols"],
+                                                   config["missing_identifier"], seed=seed)
+    else:
+        ensemble = RandomForest.RandomForestEnsemble(examples, config["sample_size"], config["numeric_cols"],
+                                                     config["missing_identifier"], config["feature_size"], seed=seed,
+                                                     extra_trees=config["extra_trees"])
+    return ensemble.continue_training(1)[0]
+
+
+def run_worker(host, port):
+    """
+    Connects to a coordinator and builds trees until told to stop.
+    :param host: Coordinator host name.
+    :param port: Coordinator port.
+    :return: Number of trees built.
+    """
+    built = 0
+    with socket.create_connection((host, port)) as sock:
+        config = receive_message(sock)
+        if isinstance(config["example_param"], str):
+            examples = ID3.data_parsing(config["example_param"], config["numeric_cols"])
+        else:
+            examples = config["example_param"]
+        # ID3 reads these globals. data_parsing sets them for file paths, but examples sent by the coordinator
+        # arrive without them in a spawned or remote worker.
+        ID3.LABEL_INDEX = len(examples[0]) - 2
+        ID3.WEIGHT_INDEX = len(examples[0]) - 1
+
+        send_message(sock, ("ready", len(examples[0])))
+        try:
+            while True:
+                message = receive_message(sock)
+                if message[0] == "stop":
+                    break
+                index, seed = message[1], message[2]
+                send_message(sock, ("result", index, build_tree(config, examples, seed)))
+                built += 1
+        except (ConnectionError, OSError):
+            # The coordinator finishes without waiting for duplicate work still in progress.
+            pass
+    return built
+
+
+def start_local_workers(host, port, workers):
+    """
+    Starts worker processes on this machine.
+    :return: List of multiprocessing.Process objects.
+    """
+    processes = []
+    for w in range(workers):
+        process = multiprocessing.Process(target=run_worker, args=(host, port), daemon=True)
+        process.start()
+        processes.append(process)
+    return processes
+
+
+def distributed_ensemble(ensemble_type, example_param, iterations, sample_size, numeric_cols, missing_identifier,
+                         feature_size=-1, extra_trees=False, local_workers=2, host="localhost", port=0, timeout=60,
+                         seed=None):
+    """
+    Trains a bagged trees or random forest hypothesis with a pool of socket workers.
+    :param ensemble_type: "bagged" for bagged trees, or "forest" for a random forest.
+    :param example_param: Shared file path every worker can read, or list of examples to send to the workers.
+    :param iterations: Number of trees.
+    :param sample_size: integer size of bagged sample for each tree construction.
+    :param numeric_cols: List of indices indicating which columns are numeric
+    :param missing_identifier: Data within examples indicating a missing value.
+    :param feature_size: Number of features sampled per split, for random forests.
+    :param extra_trees: True to draw random splits, for random forests.
+    :param local_workers: Number of worker processes to start on this machine; 0 waits for remote workers only.
+    :param host: Interface to listen on.
+    :param port: Port to listen on; 0 picks a free port.
+    :param timeout: Seconds before an unfinished seed is re-issued to an idle worker, and before giving up when no
+        worker is connected.
+    :param seed: Seed for the tree seeds, or None to draw one from the random module.
+    :return: Hypothesis list in the same format as bagged_trees or random_forest.
+    """
+    if ensemble_type not in ("bagged", "forest"):
+        raise ValueError("Unknown ensemble type: " + str(ensemble_type))
+    if not isinstance(example_param, (str, list)):
+        raise AttributeError("Invalid data type: Please pass either file path or list of examples to train.")
+
+    config = {
+        "ensemble_type": ensemble_type,
+        "example_param": example_param,
+        "sample_size": sample_size,
+        "numeric_cols": numeric_cols,
+        "missing_identifier": missing_identifier,
+        "feature_size": feature_size,
+        "extra_trees": extra_trees,
+    }
+
+    rng = random.Random(random.getrandbits(64) if seed is None else seed)
+    seeds = [rng.getrandbits(64) for t in range(iterations)]
+
+    results = [None] * iterations
+    queue = list(range(iterations - 1, -1, -1))
+    issued = {}     # tree index -> time it was last issued
+    assigned = {}   # ready worker socket -> tree index, or None while idle
+    remaining = iterations
+    width = None
+
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind((host, port))
+    server.listen()
+    host, port = server.getsockname()[:2]
+
+    selector = selectors.DefaultSelector()
+    selector.register(server, selectors.EVENT_READ)
+    processes = start_local_workers(host, port, local_workers)
+
+    def next_index():
+        while queue:
+            index = queue.pop()
+            if results[index] is None:
+                return index
+        # Nothing queued: re-issue the oldest seed that has been out longer than the timeout.
+        now = time.monotonic()
+        overdue = [index for index in issued if results[index] is None and now - issued[index] > timeout]
+        if overdue:
+            return min(overdue, key=issued.get)
+        return None
+
+    def dispatch(conn):
+        index = next_index()
+        assigned[conn] = index
+        if index is not None:
+            issued[index] = time.monotonic()
+            send_message(conn, ("task", index, seeds[index]))
+
+    def drop(conn):
+        index = assigned.pop(conn, None)
+        if index is not None and results[index] is None:
+            queue.append(index)
+        selector.unregister(conn)
+        conn.close()
+
+    last_connected = time.monotonic()
+    try:
+        while remaining > 0:
+            for key, events in selector.select(timeout=min(timeout, 1.0)):
+                if key.fileobj is server:
+                    conn = server.accept()[0]
+                    conn.setblocking(True)
+                    send_message(conn, config)
+                    selector.register(conn, selectors.EVENT_READ)
+                    continue
+
+                conn = key.fileobj
+                try:
+                    message = receive_message(conn)
+                except (ConnectionError, OSError, EOFError, pickle.UnpicklingError):
+                    drop(conn)
+                    continue
+
+                if message[0] == "ready":
+                    width = message[1]
+                elif message[0] == "result" and results[message[1]] is None:
+                    results[message[1]] = message[2]
+                    remaining -= 1
+                if remaining > 0:
+                    dispatch(conn)
+
+            # Hand overdue seeds to idle workers.
+            if remaining > 0:
+                for conn in [conn for conn, index in assigned.items() if index is None]:
+                    dispatch(conn)
+
+            # The server socket is always registered; anything else is a worker.
+            if len(selector.get_map()) > 1:
+                last_connected = time.monotonic()
+            elif time.monotonic() - last_connected > timeout:
+                raise RuntimeError("No workers connected within " + str(timeout) + " seconds.")
+    finally:
+        for key in list(selector.get_map().values()):
+            conn = key.fileobj
+            if conn is server:
+                continue
+            try:
+                send_message(conn, ("stop",))
+            except OSError:
+                pass
+            selector.unregister(conn)
+            conn.close()
+        selector.unregister(server)
+        server.close()
+        selector.close()
+        for process in processes:
+            process.join(timeout)
+
+    # The test and label functions read these, as if the ensemble had been trained in this process.
+    module = BaggedTrees if ensemble_type == "bagged" else RandomForest
+    module.LABEL_INDEX = width - 2
+    module.WEIGHT_INDEX = width - 1
+
+    return results
+
+
+def distributed_bagged_trees(example_param, iterations, sample_size, numeric_cols, missing_identifier, **kwargs):
+    return distributed_ensemble("bagged", example_param, iterations, sample_size, numeric_cols, missing_identifier,
+                                **kwargs)
+
+
+def distributed_random_forest(example_param, iterations, sample_size, numeric_cols, missing_identifier, feature_size,
+                              extra_trees=False, **kwargs):
+    return distributed_ensemble("forest", example_param, iterations, sample_size, numeric_cols, missing_identifier,
+                                feature_size, extra_trees, **kwargs)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("usage: python DistributedEnsemble.py <coordinator host> <coordinator port>")
+        sys.exit(1)
+    run_worker(sys.argv[1], int(sys.argv[2]))
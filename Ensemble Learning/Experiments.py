@@ -14,6 +14,7 @@ import ID3
 import AdaBoost
 import BaggedTrees
 import RandomForest
+import BiasVariance
 import LeastMeanSquares
 import GraphUtility
 import IOUtilities
@@ -232,55 +233,12 @@ def bagged_trees_experiment():
     GraphUtility.graph(bag_graph, "Bagged Tree Data", "Num Trees", "Error")
 
 
-    # Bias/Variance calculations.
+    # Bias/Variance calculations, from 100 replicates of 100 trees trained in parallel.
     iterations = 100
-    bagged_trees = []
-    trees = []
     sample_size = 100
 
-    for t in range(iterations):
-        data = random.sample(examples, 1000)
-        bagged_trees.append(BaggedTrees.bagged_trees(data, iterations, sample_size, numeric_cols, missing_identifier))
-        trees.append(bagged_trees[t][0][0])
-
-    # Bias/Variance of individual trees.
-    labels = []
-    biases = []
-    variances = []
-    for instance in examples:
-        for tree in trees:
-            label = ID3.get_label(tree, instance, numeric_cols, missing_identifier)
-            labels.append(1 if label == "yes" else -1)
-
-        if instance[LABEL_INDEX] == "yes":
-            true_label = 1
-        else:
-            true_label = -1
-
-        avg = numpy.average(labels)
-        biases.append((avg - true_label)**2)
-        variances.append(numpy.var(labels))
-
-    tree_bias = numpy.average(biases)
-    tree_variance = numpy.average(variances)
-
-    # Bias/Variance of bagged trees.
-    labels = []
-    biases = []
-    variances = []
-    for instance in examples:
-        for tree in bagged_trees:
-            label = BaggedTrees.get_label(tree, instance, numeric_cols, missing_identifier)
-            labels.append(1 if label == "yes" else -1)
-
-        true_label = 1 if instance[LABEL_INDEX] == "yes" else -1
-
-        avg = numpy.average(labels)
-        biases.append((avg - true_label)**2)
-        variances.append(numpy.var(labels))
-
-    bag_bias = numpy.average(biases)
-    bag_variance = numpy.average(variances)
+    tree_bias, tree_variance, bag_bias, bag_variance = BiasVariance.bias_variance_experiment(
+        "bagged", examples, examples, 100, 1000, iterations, sample_size, numeric_cols, missing_identifier)
 
     print("Tree Bias:", "{0:.3}".format(tree_bias), "Tree Variance:", "{0:.3}".format(tree_variance))
     print("Bagged Bias:", "{0:.3}".format(bag_bias), "Bagged Variance:", "{0:.3}".format(bag_variance))
@@ -320,56 +278,14 @@ def random_forest_experiment():
                         tuple([forest_test, "Forest Test - " + str(feature_size) + " features"])]
         GraphUtility.graph(forest_graph, "Random Forest Data", "Num Trees", "Error")
 
-    # Bias/Variance
+    # Bias/Variance, from 100 replicates of 100 trees trained in parallel.
     iterations = 100
-    forest = []
-    trees = []
     sample_size = 100
     feature_size = 2
 
-    for t in range(iterations):
-        data = random.sample(examples, 1000)
-        forest.append(RandomForest.random_forest(data, iterations, sample_size, numeric_cols, missing_identifier, feature_size))
-        trees.append(forest[t][0][0])
-
-    # Bias/Variance of individual trees.
-    labels = []
-    biases = []
-    variances = []
-    for instance in examples:
-        for tree in trees:
-            label = ID3.get_label(tree, instance, numeric_cols, missing_identifier)
-            labels.append(1 if label == "yes" else -1)
-
-        if instance[LABEL_INDEX] == "yes":
-            true_label = 1
-        else:
-            true_label = -1
-
-        avg = numpy.average(labels)
-        biases.append((avg - true_label)**2)
-        variances.append(numpy.var(labels))
-
-    tree_bias = numpy.average(biases)
-    tree_variance = numpy.average(variances)
-
-    # Bias/Variance of bagged trees.
-    labels = []
-    biases = []
-    variances = []
-    for instance in examples:
-        for tree in forest:
-            label = RandomForest.get_label(tree, instance, numeric_cols, missing_identifier)
-            labels.append(1 if label == "yes" else -1)
-
-        true_label = 1 if instance[LABEL_INDEX] == "yes" else -1
-
-        avg = numpy.average(labels)
-        biases.append((avg - true_label)**2)
-        variances.append(numpy.var(labels))
-
-    forest_bias = numpy.average(biases)
-    forest_variance = numpy.average(variances)
+    tree_bias, tree_variance, forest_bias, forest_variance = BiasVariance.bias_variance_experiment(
+        "forest", examples, examples, 100, 1000, iterations, sample_size, numeric_cols, missing_identifier,
+        feature_size)
 
     print("Tree Bias:", "{0:.3}".format(tree_bias), "Tree Variance:", "{0:.3}".format(tree_variance))
     print("Forest Bias:", "{0:.3}".format(forest_bias), "Forest Variance:", "{0:.3}".format(forest_variance))
@@ -389,38 +305,28 @@ def lms_experiment():
     iterations = 1000
     learning_constant = 1
 
-    plot_iter = 1000
+    # Parse the test set once; loss_curve scores every recorded weight in one matrix product.
+    test_x, test_labels = LeastMeanSquares.get_arrays(file_path_test)
 
-    results = []
-
-    for t in range(plot_iter):
-        hypothesis = LeastMeanSquares.least_mean_squares(file_path_train, batch_size, iterations, learning_constant)
-        if hypothesis[2]:
-            break
-        learning_constant = learning_constant/2
+    # Backtracking picks the step size within this one run, so there is no need to retry with smaller constants.
+    hypothesis = LeastMeanSquares.least_mean_squares(file_path_train, batch_size, iterations, learning_constant,
+                                                     step_rule="backtracking")
 
     r = hypothesis[0]
     hypotheses = hypothesis[1]
 
-    for hyp in hypotheses:
-        results.append(LeastMeanSquares.test_lms(hyp, file_path_test))
+    results = list(LeastMeanSquares.loss_curve(hypotheses, test_x, test_labels))
 
     print("Gradient Descent - r:", r, "Weight:", hypotheses[-1],"Losses:", results)
 
     batch_size = 1  # -1 for full batch descent, or a small batch size for stochastic descent.
-    results_stoch = []
-
-    for t in range(plot_iter):
-        hypothesis = LeastMeanSquares.least_mean_squares(file_path_train, batch_size, iterations, learning_constant)
-        if hypothesis[2]:
-            break
-        learning_constant = learning_constant/2
+    hypothesis = LeastMeanSquares.least_mean_squares(file_path_train, batch_size, iterations, learning_constant,
+                                                     step_rule="lipschitz")
 
     r = hypothesis[0]
     hypotheses = hypothesis[1]
 
-    for hyp in hypotheses:
-        results_stoch.append(LeastMeanSquares.test_lms(hyp, file_path_test))
+    results_stoch = list(LeastMeanSquares.loss_curve(hypotheses, test_x, test_labels))
 
     print("Stochastic Gradient Descent - r:", r, "Weight:", hypotheses[-1],"Losses:", results_stoch)
 
@@ -428,6 +334,18 @@ def lms_experiment():
 
     GraphUtility.graph(lms_graph, "LMS_Test", "Loss", "Gradient Descent Iterations")
 
+    # Passes over the training data each solver needs to get within 0.1% of the closed form training loss.
+    train_x, train_labels = LeastMeanSquares.get_arrays(file_path_train)
+    optimum = LeastMeanSquares.loss_curve([LeastMeanSquares.closed_form_lms(file_path_train)], train_x, train_labels)
+    target_loss = 1.001 * optimum[0]
+
+    for solver, batch_size, iterations in [("gd", -1, iterations), ("gd", 1, iterations), ("svrg", 1, 100),
+                                           ("saga", 1, 100)]:
+        hypothesis = LeastMeanSquares.least_mean_squares(file_path_train, batch_size, iterations, None,
+                                                         step_rule="lipschitz", solver=solver,
+                                                         target_loss=target_loss, report_passes=True)
+        print(solver, "batch size", batch_size, "- passes to target loss:", hypothesis[3])
+
 
 ########################################################################################################
 ##########                             Credit Experiments                                     ##########
@@ -539,26 +457,11 @@ def credit_experiment():
 def manual_lms():
 
     file_path_train = "/home/john/PycharmProjects/u1201441_Private_Repository/CS6350_Files/HW2/concrete/train.csv"
+    file_path_test = "/home/john/PycharmProjects/u1201441_Private_Repository/CS6350_Files/HW2/concrete/test.csv"
 
-    examples = LeastMeanSquares.data_parsing(file_path_train)
-
-    labels = []
-
-    for instance in examples:
-        instance.pop(-1)
-        labels.append(instance.pop(-1))
-
-    ex = numpy.array(examples)
-    x = ex.transpose()
-    lbl = numpy.array(labels)
-    y = lbl.reshape((53,1))
-
-    xtrans = x.transpose()
-    xprod = x @ xtrans
-    xinv_x = numpy.linalg.inv(xprod) @ x
-    weight = xinv_x @ y
+    weight = LeastMeanSquares.closed_form_lms(file_path_train)
 
-    print(weight)
+    print("Closed form - Weight:", weight, "Loss:", LeastMeanSquares.test_lms(weight, file_path_test))
 
 
 ########################################################################################################
@@ -604,18 +507,14 @@ def perceptron_experiment():
 
     # Average Perceptron Results
 
-    average = numpy.zeros(len(weights[1][0]))
-    for predictor in weights:
-        if isinstance(predictor, dict):
-            continue
-        average += predictor[0]
-    print("Learned vector - ", average)
+    averaged = Perceptron.averaged_perceptron(FILE_PATH_TRAIN, 10, missing_identifier)
+    print("Learned vector - ", averaged[-1][0])
     # Training
-    results = Perceptron.test_perceptron(weights, FILE_PATH_TRAIN,missing_identifier, 3)
+    results = Perceptron.test_perceptron(averaged, FILE_PATH_TRAIN,missing_identifier, 1)
     print("BankNote Data; Test; Average Perceptron", "Correct -", results[0], "Total -",
           results[1], "Err -", "{0:.2%}".format(1-results[0]/results[1]))
     # Test
-    results = Perceptron.test_perceptron(weights, FILE_PATH_TEST,missing_identifier, 3)
+    results = Perceptron.test_perceptron(averaged, FILE_PATH_TEST,missing_identifier, 1)
     print("BankNote Data; Test; Average Perceptron", "Correct -", results[0], "Total -",
           results[1], "Err -", "{0:.2%}".format(1-results[0]/results[1]))
 
@@ -0,0 +1,219 @@
+"""
+Author: John Jacobson (u1201441)
+Created: 2019-04-28
+
+This is a set of ensemble compression tools for bagged trees and random forests, to reduce the cost of serving them.
+    1. Pruning: greedy forward selection of a small subset of trees that matches the full ensemble's validation
+       accuracy within a tolerance, using a precomputed (examples x trees) prediction matrix.
+    2. Distillation: a single ID3 tree trained on the ensemble's soft labels, using weighted copies of each example
+       in the same way ID3 handles weighted examples.
+Both report the latency and memory of the compressed model against the full ensemble, measured on the packed forest
+predictor.
+
+"""
+import time
+import numpy
+
+import ID3
+import PackedForest
+
+
+# get_label of bagged trees and random forests resolves tied votes to this label, so it is packed first, which is the
+# label PackedForest and the argmax votes below give ties to.
+TIE_LABEL = "yes"
+
+
+def prediction_matrix(packed, encoded):
+    """
+    Label index predicted by every tree for every example.
+    :param packed: PackedForest of the ensemble.
+    :param encoded: Examples encoded by PackedForest.encode_examples.
+    :return: numpy int32 array of shape (examples, trees).
+    """
+    return packed.value[PackedForest.apply_forest(packed, encoded)]
+
+
+def vote_accuracy(votes, true_labels, weights):
+    """
+    Weighted accuracy of the argmax of a vote matrix. Ties go to the lowest label code, TIE_LABEL when packed first.
+    """
+    return weights[numpy.argmax(votes, axis=1) == true_labels].sum() / weights.sum()
+
+
+def greedy_tree_selection(predictions, true_labels, label_count, tolerance, tree_weights=None, example_weights=None):
+    """
+    Greedy forward selection of trees. Each step adds the tree that most improves validation accuracy of the
+    selected subset's vote, until it is within tolerance of the full ensemble's accuracy.
+    :param predictions: numpy array of shape (examples, trees) of predicted label indices.
+    :param true_labels: numpy array of true label indices; -1 for labels the ensemble never predicts.
+    :param label_count: Number of labels.
+    :param tolerance: Allowed drop in accuracy from the full ensemble.
+    :param tree_weights: Optional vote weight per tree.
+    :param example_weights: Optional weight per example.
+    :return: List of selected tree indices in selection order, subset accuracy, and full ensemble accuracy.
+    """
+    n_examples, n_trees = predictions.shape
+    if tree_weights is None:
+        tree_weights = numpy.ones(n_trees)
+    tree_weights = numpy.asarray(tree_weights, dtype=numpy.float64)
+    if example_weights is None:
+        example_weights = numpy.ones(n_examples)
+
+    rows = numpy.arange(n_examples)
+    one_hot = numpy.zeros((n_examples, n_trees, label_count))
+    one_hot[rows[:, None], numpy.arange(n_trees), predictions] = 1
+    one_hot *= tree_weights[None, :, None]
+
+    full_accuracy = vote_accuracy(one_hot.sum(axis=1), true_labels, example_weights)
+
+    votes = numpy.zeros((n_examples, label_count))
+    selected = []
+    available = numpy.ones(n_trees, dtype=bool)
+    accuracy = 0.0
+    while available.any():
+        # Accuracy of the vote after adding each candidate tree, for all candidates at once.
+        candidate_votes = votes[:, None, :] + one_hot
+        correct = numpy.argmax(candidate_votes, axis=2) == true_labels[:, None]
+        candidate_accuracy = example_weights.dot(correct) / example_weights.sum()
+        candidate_accuracy[~available] = -1
+
+        best = int(numpy.argmax(candidate_accuracy))
+        selected.append(best)
+        available[best] = False
+        votes += one_hot[:, best, :]
+        accuracy = candidate_accuracy[best]
+        if accuracy >= full_accuracy - tolerance:
+            break
+
+    return selected, accuracy, full_accuracy
+
+
+def measure_latency(packed, encoded, tree_weights=None, repeats=5):
+    """
+    Best of several timings of batch prediction, in seconds per example.
+    """
+    best = float("inf")
+    for r in range(repeats):
+        start = time.perf_counter()
+        PackedForest.predict_votes(packed, encoded, tree_weights)
+        best = min(best, time.perf_counter() - start)
+    return best / max(len(encoded), 1)
+
+
+def compression_report(full_packed, full_weights, compressed_packed, compressed_weights, encoded, full_accuracy,
+                       compressed_accuracy):
+    """
+    Compares the serving cost of a compressed model with the full ensemble.
+    :return: Dict of accuracies, trees, nodes, bytes, and seconds per example for both models, plus the speedup and
+        memory reduction factors.
+    """
+    full_latency = measure_latency(full_packed, encoded, full_weights)
+    compressed_latency = measure_latency(compressed_packed, encoded, compressed_weights)
+    return {
+        "full_accuracy": float(full_accuracy),
+        "compressed_accuracy": float(compressed_accuracy),
+        "full_trees": full_packed.n_trees,
+        "compressed_trees": compressed_packed.n_trees,
+        "full_nodes": full_packed.n_nodes,
+        "compressed_nodes": compressed_packed.n_nodes,
+        "full_bytes": full_packed.nbytes,
+        "compressed_bytes": compressed_packed.nbytes,
+        "full_latency": full_latency,
+        "compressed_latency": compressed_latency,
+        "speedup": full_latency / compressed_latency,
+        "memory_reduction": full_packed.nbytes / compressed_packed.nbytes,
+    }
+
+
+def encode_validation(hypothesis, examples, numeric_cols, missing_identifier):
+    label_index = len(examples[0]) - 2
+    weight_index = len(examples[0]) - 1
+    vocabulary = PackedForest.build_vocabulary(examples, numeric_cols, label_index)
+    packed = PackedForest.pack_forest(hypothesis, numeric_cols, labels=[TIE_LABEL], vocabulary=vocabulary)
+    encoded = PackedForest.encode_examples(packed, examples, missing_identifier, label_index)
+    label_codes = {label: code for code, label in enumerate(packed.labels)}
+    true_labels = numpy.array([label_codes.get(instance[label_index], -1) for instance in examples])
+    example_weights = numpy.array([instance[weight_index] for instance in examples], dtype=numpy.float64)
+    return packed, encoded, true_labels, example_weights
+
+
+def prune_ensemble(hypothesis, validation_examples, numeric_cols, missing_identifier, tolerance=0.005,
+                   weighted=False):
+    """
+    Selects a small subset of an ensemble's trees that matches its validation accuracy within a tolerance.
+    :param hypothesis: Hypothesis as returned by bagged_trees or random_forest.
+    :param validation_examples: List of examples to select trees on.
+    :param numeric_cols: List of indices indicating which columns are numeric
+    :param missing_identifier: Data within examples indicating a missing value.
+    :param tolerance: Allowed drop in validation accuracy.
+    :param weighted: True to weight votes by the accuracy stored with each tree (bagged trees).
+    :return: Pruned hypothesis (a sub-list of hypothesis, in selection order), and a compression report.
+    """
+    packed, encoded, true_labels, example_weights = encode_validation(hypothesis, validation_examples, numeric_cols,
+                                                                      missing_identifier)
+    tree_weights = [operand[1] for operand in hypothesis] if weighted else None
+
+    selected, accuracy, full_accuracy = greedy_tree_selection(prediction_matrix(packed, encoded), true_labels,
+                                                              len(packed.labels), tolerance, tree_weights,
+                                                              example_weights)
+    pruned = [hypothesis[t] for t in selected]
+    pruned_packed = PackedForest.pack_forest(pruned, numeric_cols, packed.labels, packed.vocabulary)
+    pruned_weights = [operand[1] for operand in pruned] if weighted else None
+
+    report = compression_report(packed, tree_weights, pruned_packed, pruned_weights, encoded, full_accuracy,
+                                accuracy)
+    return pruned, report
+
+
+def distill_ensemble(hypothesis, transfer_examples, validation_examples, numeric_cols, missing_identifier,
+                     max_depth=-1, info_gain_type=1, weighted=False):
+    """
+    Distills an ensemble into one ID3 tree trained on the ensemble's soft labels. Every transfer example is copied
+    once per label the ensemble votes for, weighted by that label's share of the vote.
+    :param hypothesis: Hypothesis as returned by bagged_trees or random_forest.
+    :param transfer_examples: Examples to label with the ensemble and train the tree on, e.g. the training data.
+    :param validation_examples: Examples to report accuracy and latency on.
+    :param numeric_cols: List of indices indicating which columns are numeric
+    :param missing_identifier: Data within examples indicating a missing value.
+    :param max_depth: Maximum depth of the distilled tree.
+    :param info_gain_type: integer to identify preferred method of gain.
+        1 - Entropy
+        2 - Majority Error
+        3 - Gini Index
+    :param weighted: True to weight votes by the accuracy stored with each tree (bagged trees).
+    :return: Distilled DefaultDict decision tree, and a compression report.
+    """
+    label_index = len(transfer_examples[0]) - 2
+    weight_index = len(transfer_examples[0]) - 1
+    tree_weights = [operand[1] for operand in hypothesis] if weighted else None
+
+    vocabulary = PackedForest.build_vocabulary(transfer_examples, numeric_cols, label_index)
+    packed = PackedForest.pack_forest(hypothesis, numeric_cols, labels=[TIE_LABEL], vocabulary=vocabulary)
+    encoded = PackedForest.encode_examples(packed, transfer_examples, missing_identifier, label_index)
+    votes = PackedForest.predict_votes(packed, encoded, tree_weights).astype(numpy.float64)
+    soft_labels = votes / votes.sum(axis=1, keepdims=True)
+
+    copies = []
+    for instance, shares in zip(transfer_examples, soft_labels):
+        for code in numpy.flatnonzero(shares):
+            copy = list(instance[:label_index])
+            copy.append(packed.labels[code])
+            copy.append(instance[weight_index] * shares[code])
+            copies.append(copy)
+
+    ID3.LABEL_INDEX = label_index
+    ID3.WEIGHT_INDEX = weight_index
+    distilled = ID3.build_decision_tree(copies, max_depth, info_gain_type, numeric_cols, missing_identifier)
+
+    full_packed, validation, true_labels, example_weights = encode_validation(hypothesis, validation_examples,
+                                                                              numeric_cols, missing_identifier)
+    distilled_packed = PackedForest.pack_forest([distilled], numeric_cols, full_packed.labels,
+                                                full_packed.vocabulary)
+    full_accuracy = vote_accuracy(PackedForest.predict_votes(full_packed, validation, tree_weights), true_labels,
+                                  example_weights)
+    distilled_accuracy = vote_accuracy(PackedForest.predict_votes(distilled_packed, validation), true_labels,
+                                       example_weights)
+
+    report = compression_report(full_packed, tree_weights, distilled_packed, None, validation, full_accuracy,
+                                distilled_accuracy)
+    return distilled, report
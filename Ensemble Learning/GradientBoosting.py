@@ -0,0 +1,368 @@
+"""
+Author: John Jacobson (u1201441)
+Created: 2019-04-28
+
+This is an implementation of histogram based gradient boosted trees with logistic loss, for binary classification.
+Data is read and missing values are filled using the ID3 conventions. Every column is binned once into at most 256
+uint8 bins (quantiles for numeric columns, one bin per value for categorical columns), and each round grows a shallow
+tree from gradient/hessian histograms of those bins.
+
+"""
+import math
+import numpy
+
+import ID3
+
+
+class Binner:
+    """
+    Maps the attribute columns of ID3 style examples to uint8 bin indices.
+    Numeric columns are cut at quantiles of the training values; value <= edges[b] falls in bin b or lower.
+    Categorical columns get one bin per value, with the least common values sharing the last bin if there are more
+    than max_bins. Missing and unseen values are mapped like the most common training value, as in ID3.get_label.
+    """
+
+    def __init__(self, numeric_cols, max_bins=256):
+        if not 2 <= max_bins <= 256:
+            raise ValueError("max_bins must be between 2 and 256.")
+        self.numeric_cols = list(numeric_cols)
+        self.max_bins = max_bins
+        self.attribute_count = 0
+        self.edges = {}
+        self.codes = {}
+        self.fill_values = {}
+
+    def fit(self, examples, attribute_count):
+        """
+        Learns bin edges and categorical codes from training examples.
+        :param examples: List of examples, each of which is a list of values.
+        :param attribute_count: Number of attribute columns, i.e. the label index.
+        :return: self
+        """
+        self.attribute_count = attribute_count
+        for col in range(attribute_count):
+            counts = ID3.get_attribute_values(examples, col)
+            self.fill_values[col] = ID3.get_key_by_max_value(counts)
+            if col in self.numeric_cols:
+                column = numpy.array([instance[col] for instance in examples], dtype=numpy.float64)
+                values = numpy.unique(column)
+                if len(values) <= self.max_bins:
+                    self.edges[col] = (values[:-1] + values[1:]) / 2
+                else:
+                    # Quantiles of the raw column, so frequent values get bins in proportion to their count.
+                    quantiles = numpy.linspace(0, 1, self.max_bins + 1)[1:-1]
+                    self.edges[col] = numpy.unique(numpy.quantile(column, quantiles))
+            else:
+                ordered = sorted(counts, key=lambda value: -counts[value])
+                self.codes[col] = {value: min(code, self.max_bins - 1) for code, value in enumerate(ordered)}
+        return self
+
+    def transform(self, examples, missing_identifier):
+        """
+        Bins examples with the learned edges and codes.
+        :param examples: List of examples, each of which is a list of values.
+        :param missing_identifier: Data within examples indicating a missing value.
+        :return: numpy uint8 array of shape (examples, attributes).
+        """
+        binned = numpy.empty((len(examples), self.attribute_count), dtype=numpy.uint8)
+        for col in range(self.attribute_count):
+            fill = self.fill_values[col]
+            if col in self.numeric_cols:
+                values = numpy.array([fill if instance[col] == missing_identifier else float(instance[col])
+                                      for instance in examples], dtype=numpy.float64)
+                binned[:, col] = numpy.searchsorted(self.edges[col], values, side='left')
+            else:
+                codes = self.codes[col]
+                binned[:, col] = [codes.get(instance[col], codes[fill]) for instance in examples]
+        return binned
+
+
+class BoostedTree:
+    """
+    A single regression tree over binned data. Node i splits on feature[i], sending examples whose bin is set in
+    left_mask[i] to left[i] and the rest to right[i]; leaves have feature -1 and a raw score in value.
+    """
+
+    def __init__(self, max_bins):
+        self.max_bins = max_bins
+        self.feature = []
+        self.left_mask = []
+        self.left = []
+        self.right = []
+        self.value = []
+
+    def add_node(self, value):
+        self.feature.append(-1)
+        self.left_mask.append(numpy.zeros(self.max_bins, dtype=bool))
+        self.left.append(-1)
+        self.right.append(-1)
+        self.value.append(value)
+        return len(self.feature) - 1
+
+    def finalize(self):
+        """
+        Converts node lists to numpy arrays for prediction.
+        """
+        self.feature = numpy.array(self.feature, dtype=numpy.int32)
+        self.left_mask = numpy.array(self.left_mask, dtype=bool)
+        self.left = numpy.array(self.left, dtype=numpy.int32)
+        self.right = numpy.array(self.right, dtype=numpy.int32)
+        self.value = numpy.array(self.value, dtype=numpy.float64)
+
+    def predict(self, binned):
+        """
+        Raw scores for every row of binned data; all rows advance one level per step.
+        :param binned: uint8 array from Binner.transform.
+        :return: numpy float64 array of scores.
+        """
+        nodes = numpy.zeros(len(binned), dtype=numpy.int32)
+        rows = numpy.arange(len(binned))
+        active = rows[self.feature[nodes] >= 0]
+        while active.size > 0:
+            current = nodes[active]
+            features = self.feature[current]
+            goes_left = self.left_mask[current, binned[active, features]]
+            nodes[active] = numpy.where(goes_left, self.left[current], self.right[current])
+            active = active[self.feature[nodes[active]] >= 0]
+        return self.value[nodes]
+
+
+class GradientBoostedTrees:
+    """
+    Learned gradient boosting model: the binner, a prior log-odds score, and the list of trees.
+    """
+
+    def __init__(self, binner, labels, base_score, learning_rate):
+        self.binner = binner
+        self.labels = labels
+        self.base_score = base_score
+        self.learning_rate = learning_rate
+        self.trees = []
+
+
+def sigmoid(z):
+    """
+    Logistic function, computed without overflow for large negative inputs.
+    """
+    return numpy.exp(-numpy.logaddexp(0, -z))
+
+
+def build_histograms(binned, gradients, hessians, indices, max_bins):
+    """
+    Sums gradients and hessians per bin of every feature, for the examples in indices.
+    :return: Two numpy arrays of shape (features, bins).
+    """
+    n_features = binned.shape[1]
+    offsets = numpy.arange(n_features) * max_bins
+    flat = (binned[indices].astype(numpy.int64) + offsets).ravel()
+    size = n_features * max_bins
+    grad_hist = numpy.bincount(flat, weights=numpy.repeat(gradients[indices], n_features), minlength=size)
+    hess_hist = numpy.bincount(flat, weights=numpy.repeat(hessians[indices], n_features), minlength=size)
+    return grad_hist.reshape((n_features, max_bins)), hess_hist.reshape((n_features, max_bins))
+
+
+def find_best_split(grad_hist, hess_hist, categorical, l2_regularization, min_child_weight):
+    """
+    Finds the split with the highest gain from gradient/hessian histograms. Numeric features are split on bin order;
+    categorical features are split on bins sorted by gradient/hessian ratio, which finds the best two-way partition.
+    :param grad_hist: Gradient histogram of shape (features, bins).
+    :param hess_hist: Hessian histogram of shape (features, bins).
+    :param categorical: Boolean array marking categorical features.
+    :param l2_regularization: L2 penalty on leaf values.
+    :param min_child_weight: Minimum hessian sum in each child.
+    :return: (gain, feature, left bin mask), or None if no split improves the loss.
+    """
+    n_features, max_bins = grad_hist.shape
+    order = numpy.tile(numpy.arange(max_bins), (n_features, 1))
+    if categorical.any():
+        ratio = numpy.where(hess_hist > 0, grad_hist / numpy.maximum(hess_hist, 1e-300), numpy.inf)
+        order[categorical] = numpy.argsort(ratio[categorical], axis=1, kind='stable')
+
+    grad_left = numpy.cumsum(numpy.take_along_axis(grad_hist, order, axis=1), axis=1)[:, :-1]
+    hess_left = numpy.cumsum(numpy.take_along_axis(hess_hist, order, axis=1), axis=1)[:, :-1]
+    grad_total = grad_hist.sum(axis=1, keepdims=True)
+    hess_total = hess_hist.sum(axis=1, keepdims=True)
+    grad_right = grad_total - grad_left
+    hess_right = hess_total - hess_left
+
+    gain = (grad_left ** 2 / (hess_left + l2_regularization) + grad_right ** 2 / (hess_right + l2_regularization)
+            - grad_total ** 2 / (hess_total + l2_regularization))
+    gain[(hess_left < min_child_weight) | (hess_right < min_child_weight)] = -numpy.inf
+
+    best = numpy.argmax(gain)
+    feature, position = numpy.unravel_index(best, gain.shape)
+    if not gain[feature, position] > 0:
+        return None
+
+    left_mask = numpy.zeros(max_bins, dtype=bool)
+    left_mask[order[feature, :position + 1]] = True
+    return gain[feature, position], feature, left_mask
+
+
+def build_tree(binned, gradients, hessians, categorical, max_depth, max_bins, l2_regularization, min_child_weight):
+    """
+    Grows one regression tree on the negative gradient, using histogram subtraction for the larger child.
+    :return: BoostedTree
+    """
+    boosted_tree = BoostedTree(max_bins)
+
+    def grow(indices, grad_hist, hess_hist, depth):
+        grad_sum = grad_hist[0].sum()
+        hess_sum = hess_hist[0].sum()
+        node = boosted_tree.add_node(-grad_sum / (hess_sum + l2_regularization))
+        if depth == max_depth or len(indices) < 2:
+            return node
+
+        split = find_best_split(grad_hist, hess_hist, categorical, l2_regularization, min_child_weight)
+        if split is None:
+            return node
+        gain, feature, left_mask = split
+
+        goes_left = left_mask[binned[indices, feature]]
+        left_indices = indices[goes_left]
+        right_indices = indices[~goes_left]
+
+        # Only build the histogram of the smaller child; the other is the parent minus it.
+        if len(left_indices) <= len(right_indices):
+            left_grad, left_hess = build_histograms(binned, gradients, hessians, left_indices, max_bins)
+            right_grad, right_hess = grad_hist - left_grad, hess_hist - left_hess
+        else:
+            right_grad, right_hess = build_histograms(binned, gradients, hessians, right_indices, max_bins)
+            left_grad, left_hess = grad_hist - right_grad, hess_hist - right_hess
+
+        boosted_tree.feature[node] = feature
+        boosted_tree.left_mask[node] = left_mask
+        boosted_tree.left[node] = grow(left_indices, left_grad, left_hess, depth + 1)
+        boosted_tree.right[node] = grow(right_indices, right_grad, right_hess, depth + 1)
+        return node
+
+    indices = numpy.arange(len(binned))
+    grad_hist, hess_hist = build_histograms(binned, gradients, hessians, indices, max_bins)
+    grow(indices, grad_hist, hess_hist, 0)
+    boosted_tree.finalize()
+    return boosted_tree
+
+
+def gradient_boosting(example_param, iterations, max_depth, learning_rate, numeric_cols, missing_identifier,
+                      max_bins=256, l2_regularization=1.0, min_child_weight=1e-3):
+    """
+    Trains gradient boosted trees with logistic loss.
+    :param example_param: Data, or file path to data, in the format read by ID3.data_parsing.
+    :param iterations: Number of boosting rounds (trees).
+    :param max_depth: Maximum depth of each tree.
+    :param learning_rate: Shrinkage applied to every tree.
+    :param numeric_cols: List of indices indicating which columns are numeric
+    :param missing_identifier: Data within examples indicating a missing value.
+    :param max_bins: Number of bins per column, at most 256.
+    :param l2_regularization: L2 penalty on leaf values.
+    :param min_child_weight: Minimum hessian sum allowed in a child.
+    :return: GradientBoostedTrees
+    """
+    if isinstance(example_param, str):
+        examples = ID3.data_parsing(example_param, numeric_cols)
+    elif isinstance(example_param, list):
+        examples = example_param
+    else:
+        raise AttributeError("Invalid data type: Please pass either file path or list of examples to build tree.")
+
+    label_index = len(examples[0]) - 2
+    weight_index = len(examples[0]) - 1
+    ID3.LABEL_INDEX = label_index
+    ID3.WEIGHT_INDEX = weight_index
+
+    if missing_identifier is not None:
+        ID3.fill_missing_values(examples, missing_identifier)
+
+    labels = sorted(ID3.get_attribute_values(examples, label_index))
+    if len(labels) != 2:
+        raise ValueError("Gradient boosting with logistic loss requires exactly two labels.")
+
+    binner = Binner(numeric_cols, max_bins).fit(examples, label_index)
+    binned = binner.transform(examples, missing_identifier)
+    categorical = numpy.array([col not in numeric_cols for col in range(label_index)], dtype=bool)
+
+    targets = numpy.array([1.0 if instance[label_index] == labels[1] else 0.0 for instance in examples])
+    sample_weights = numpy.array([instance[weight_index] for instance in examples], dtype=numpy.float64)
+
+    positive_rate = numpy.clip(targets.dot(sample_weights) / sample_weights.sum(), 1e-12, 1 - 1e-12)
+    base_score = math.log(positive_rate / (1 - positive_rate))
+    model = GradientBoostedTrees(binner, labels, base_score, learning_rate)
+
+    scores = numpy.full(len(examples), base_score)
+    for t in range(iterations):
+        probabilities = sigmoid(scores)
+        gradients = sample_weights * (probabilities - targets)
+        hessians = sample_weights * probabilities * (1 - probabilities)
+        boosted_tree = build_tree(binned, gradients, hessians, categorical, max_depth, binner.max_bins,
+                                  l2_regularization, min_child_weight)
+        model.trees.append(boosted_tree)
+        scores += learning_rate * boosted_tree.predict(binned)
+
+    return model
+
+
+def get_binned(model, example_param, missing_identifier):
+    if isinstance(example_param, str):
+        examples = ID3.data_parsing(example_param, model.binner.numeric_cols)
+    elif isinstance(example_param, list):
+        examples = example_param
+    else:
+        raise AttributeError("Invalid data type: Please pass either file path or list of examples to build tree.")
+    return examples, model.binner.transform(examples, missing_identifier)
+
+
+def staged_scores(model, binned):
+    """
+    Yields the raw log-odds of every example after each boosting round.
+    """
+    scores = numpy.full(len(binned), model.base_score)
+    for boosted_tree in model.trees:
+        scores += model.learning_rate * boosted_tree.predict(binned)
+        yield scores.copy()
+
+
+def predict_proba(model, example_param, missing_identifier):
+    """
+    Probability of the positive label (model.labels[1]) for every example.
+    :param model: GradientBoostedTrees
+    :param example_param: Data, or file path to data
+    :param missing_identifier: Data within examples indicating a missing value.
+    :return: numpy float64 array of probabilities.
+    """
+    examples, binned = get_binned(model, example_param, missing_identifier)
+    scores = numpy.full(len(binned), model.base_score)
+    for scores in staged_scores(model, binned):
+        pass
+    return sigmoid(scores)
+
+
+def get_labels(model, example_param, missing_identifier):
+    """
+    Labels assigned to every example by the model.
+    :return: List of labels.
+    """
+    probabilities = predict_proba(model, example_param, missing_identifier)
+    return [model.labels[1] if p >= 0.5 else model.labels[0] for p in probabilities]
+
+
+def test_gradient_boosting(model, example_param, missing_identifier):
+    """
+    Tests data against a gradient boosting model after every round.
+    :param model: GradientBoostedTrees
+    :param example_param: Data, or file path to data
+    :param missing_identifier: Data within examples indicating a missing value.
+    :return: List of tuples, where each tuple is of the form (matches_i, total_i) for the first i+1 trees.
+    """
+    examples, binned = get_binned(model, example_param, missing_identifier)
+    label_index = len(examples[0]) - 2
+    weight_index = len(examples[0]) - 1
+
+    positive = numpy.array([instance[label_index] == model.labels[1] for instance in examples])
+    weights = numpy.array([instance[weight_index] for instance in examples], dtype=numpy.float64)
+    total = float(weights.sum())
+
+    results = []
+    for scores in staged_scores(model, binned):
+        matches = float(weights[(scores >= 0) == positive].sum())
+        results.append(tuple([matches, total]))
+    return results
@@ -0,0 +1,378 @@
+"""
+Author: John Jacobson (u1201441)
+Created: 2019-04-28
+
+This is a packed representation of a forest of ID3 decision trees, for fast batch prediction with bagged trees and
+random forests. All trees' nodes are stored in shared contiguous numpy arrays, and prediction advances every
+(example, tree) pair one level per vectorized step instead of walking each DefaultDict tree recursively.
+
+Packed node arrays, one entry per node:
+    feature: Index of attribute split on at this node, or -1 for a leaf.
+    numeric: True if the split is numeric (compare to threshold), False if categorical (look up category_table).
+    threshold: Numeric split value; values greater than threshold go right, others go left.
+    left, right: Children of numeric splits.
+    table_offset: Start of this node's children in category_table, one entry per code of the attribute vocabulary.
+    default: Child used for categorical values never seen at this node (a leaf with the node's majority label).
+    missing: Child used for missing values (the branch of the most common training value at this node).
+    value: Index into labels for leaves.
+
+"""
+import collections
+import math
+import numpy
+
+import ID3
+
+
+class PackedForest:
+    """
+    Contiguous array representation of a list of ID3 decision trees.
+    """
+
+    def __init__(self, labels, vocabulary, numeric_cols):
+        self.labels = list(labels)
+        self.vocabulary = vocabulary
+        self.numeric_cols = list(numeric_cols)
+        self.roots = None
+        self.feature = None
+        self.numeric = None
+        self.threshold = None
+        self.left = None
+        self.right = None
+        self.table_offset = None
+        self.default = None
+        self.missing = None
+        self.value = None
+        self.category_table = None
+        self.n_features = 0
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    @property
+    def n_nodes(self):
+        return len(self.feature)
+
+    @property
+    def nbytes(self):
+        """
+        Memory used by the node arrays, in bytes.
+        """
+        arrays = [self.roots, self.feature, self.numeric, self.threshold, self.left, self.right, self.table_offset,
+                  self.default, self.missing, self.value, self.category_table]
+        return sum(array.nbytes for array in arrays)
+
+
+def is_internal(node):
+    return isinstance(node, collections.defaultdict) and math.inf in node
+
+
+def get_trees(hypothesis):
+    """
+    Extracts decision trees from a hypothesis.
+    :param hypothesis: List of trees, or list of tuples with a tree in the first index, as returned by bagged_trees,
+        random_forest or ada_boost.
+    :return: List of trees.
+    """
+    return [operand[0] if isinstance(operand, tuple) else operand for operand in hypothesis]
+
+
+def branch_values(node):
+    """
+    Returns the branch values of a categorical node, skipping the bookkeeping keys ID3 stores in every node.
+    """
+    return [key for key in node.keys() if key is not None and key != math.inf and key != -math.inf]
+
+
+def build_vocabulary(examples, numeric_cols, attribute_count=None, vocabulary=None):
+    """
+    Assigns integer codes to every categorical value in a data set.
+    :param examples: List of examples, each of which is a list of values.
+    :param numeric_cols: List of indices indicating which columns are numeric
+    :param attribute_count: Number of attribute columns; defaults to ID3.LABEL_INDEX.
+    :param vocabulary: Existing vocabulary to extend, or None.
+    :return: Dict {column: {value: code}} for every categorical column.
+    """
+    if vocabulary is None:
+        vocabulary = {}
+    if attribute_count is None:
+        attribute_count = ID3.LABEL_INDEX
+    for col in range(attribute_count):
+        if col in numeric_cols:
+            continue
+        codes = vocabulary.setdefault(col, {})
+        for instance in examples:
+            if instance[col] not in codes:
+                codes[instance[col]] = len(codes)
+    return vocabulary
+
+
+def pack_forest(hypothesis, numeric_cols, labels=None, vocabulary=None, unique_leaves=False):
+    """
+    Packs a list of ID3 decision trees into shared contiguous node arrays.
+    :param hypothesis: List of trees, or list of tuples with a tree in the first index.
+    :param numeric_cols: List of indices indicating which columns are numeric
+    :param labels: Optional list fixing the order of labels; ties in voting go to the label listed first.
+    :param vocabulary: Optional {column: {value: code}} dict, e.g. from build_vocabulary; extended with any
+        categorical values found in the trees.
+    :param unique_leaves: If True, every leaf gets its own node instead of sharing one node per label, so callers can
+        attach per-leaf statistics. Nodes are numbered tree by tree, so packing trees together gives the same node
+        indices as packing them one at a time, offset by the node count of the earlier trees.
+    :return: PackedForest
+    """
+    trees = get_trees(hypothesis)
+    label_list = list(labels) if labels is not None else []
+    vocabulary = {} if vocabulary is None else vocabulary
+
+    # First pass: collect every categorical value and label so the tables can be sized.
+    max_feature = -1
+    seen = set()
+    stack = list(trees)
+    while stack:
+        node = stack.pop()
+        if not isinstance(node, collections.defaultdict):
+            if node not in label_list:
+                label_list.append(node)
+            continue
+        if id(node) in seen or not is_internal(node):
+            continue
+        seen.add(id(node))
+        attribute_index = node[math.inf]
+        max_feature = max(max_feature, attribute_index)
+        if node[-math.inf] not in label_list:
+            label_list.append(node[-math.inf])
+        if attribute_index in numeric_cols:
+            stack.append(node.get(-1))
+            stack.append(node.get(1))
+        else:
+            codes = vocabulary.setdefault(attribute_index, {})
+            for value in branch_values(node):
+                if value not in codes:
+                    codes[value] = len(codes)
+                stack.append(node[value])
+
+    packed = PackedForest(label_list, vocabulary, numeric_cols)
+    label_codes = {label: code for code, label in enumerate(label_list)}
+
+    feature = []
+    numeric = []
+    threshold = []
+    left = []
+    right = []
+    table_offset = []
+    default = []
+    missing = []
+    value = []
+    category_table = []
+    leaves = {}
+    packed_nodes = {}
+
+    def add_node():
+        feature.append(-1)
+        numeric.append(False)
+        threshold.append(0.0)
+        left.append(-1)
+        right.append(-1)
+        table_offset.append(0)
+        default.append(-1)
+        missing.append(-1)
+        value.append(-1)
+        return len(feature) - 1
+
+    def add_leaf(label):
+        # Leaves are shared by every tree, one per label, unless unique leaves were requested.
+        if unique_leaves or label not in leaves:
+            index = add_node()
+            value[index] = label_codes[label]
+            leaves[label] = index
+        return leaves[label]
+
+    def pack_child(child, fallback):
+        if is_internal(child):
+            return pack_node(child)
+        if isinstance(child, collections.defaultdict) or child is None:
+            # Empty subtrees mirror ID3.get_label, which falls back to the parent's majority label.
+            return fallback
+        return add_leaf(child)
+
+    def pack_node(node):
+        if id(node) in packed_nodes:
+            return packed_nodes[id(node)]
+        index = add_node()
+        packed_nodes[id(node)] = index
+        attribute_index = node[math.inf]
+        majority = add_leaf(node[-math.inf])
+        feature[index] = attribute_index
+        default[index] = majority
+        if attribute_index in numeric_cols:
+            numeric[index] = True
+            threshold[index] = node[0]
+            left[index] = pack_child(node.get(-1), majority)
+            right[index] = pack_child(node.get(1), majority)
+            missing[index] = right[index] if node.get(None) > node[0] else left[index]
+        else:
+            codes = vocabulary[attribute_index]
+            offset = len(category_table)
+            table_offset[index] = offset
+            category_table.extend([majority] * len(codes))
+            for branch in branch_values(node):
+                category_table[offset + codes[branch]] = pack_child(node[branch], majority)
+            if node.get(None) in codes:
+                missing[index] = category_table[offset + codes[node.get(None)]]
+            else:
+                missing[index] = majority
+        return index
+
+    roots = []
+    for learned_tree in trees:
+        if is_internal(learned_tree):
+            roots.append(pack_node(learned_tree))
+        else:
+            roots.append(add_leaf(learned_tree))
+
+    packed.roots = numpy.array(roots, dtype=numpy.int32)
+    packed.feature = numpy.array(feature, dtype=numpy.int32)
+    packed.numeric = numpy.array(numeric, dtype=bool)
+    packed.threshold = numpy.array(threshold, dtype=numpy.float64)
+    packed.left = numpy.array(left, dtype=numpy.int32)
+    packed.right = numpy.array(right, dtype=numpy.int32)
+    packed.table_offset = numpy.array(table_offset, dtype=numpy.int64)
+    packed.default = numpy.array(default, dtype=numpy.int32)
+    packed.missing = numpy.array(missing, dtype=numpy.int32)
+    packed.value = numpy.array(value, dtype=numpy.int32)
+    packed.category_table = numpy.array(category_table, dtype=numpy.int32)
+    packed.n_features = max_feature + 1
+
+    return packed
+
+
+def encode_examples(packed, examples, missing_identifier, n_features=None):
+    """
+    Converts examples to a float matrix the packed forest can index. Numeric columns hold their values, categorical
+    columns hold vocabulary codes (-1 for values the trees never saw), and missing values are NaN.
+    :param packed: PackedForest
+    :param examples: List of examples, each of which is a list of values.
+    :param missing_identifier: Data within examples indicating a missing value.
+    :param n_features: Number of columns to encode; defaults to the columns used by the packed trees.
+    :return: numpy float64 array of shape (examples, features).
+    """
+    if n_features is None:
+        n_features = packed.n_features
+    encoded = numpy.empty((len(examples), n_features), dtype=numpy.float64)
+    for col in range(n_features):
+        if col in packed.numeric_cols:
+            column = [numpy.nan if instance[col] == missing_identifier else float(instance[col])
+                      for instance in examples]
+        else:
+            codes = packed.vocabulary.get(col, {})
+            column = [numpy.nan if instance[col] == missing_identifier else codes.get(instance[col], -1)
+                      for instance in examples]
+        encoded[:, col] = column
+    return encoded
+
+
+def apply_forest(packed, encoded):
+    """
+    Finds the leaf each example reaches in each tree. Every (example, tree) pair still inside a tree advances one
+    level per vectorized step; pairs that reach a leaf drop out of the active set.
+    :param packed: PackedForest
+    :param encoded: Examples encoded by encode_examples.
+    :return: numpy int32 array of shape (examples, trees) containing leaf node indices.
+    """
+    n_examples = encoded.shape[0]
+    n_trees = packed.n_trees
+    current = numpy.tile(packed.roots, n_examples)
+    rows = numpy.repeat(numpy.arange(n_examples), n_trees)
+    active = numpy.flatnonzero(packed.feature[current] >= 0)
+
+    while active.size > 0:
+        nodes = current[active]
+        values = encoded[rows[active], packed.feature[nodes]]
+        children = numpy.empty_like(nodes)
+
+        is_missing = numpy.isnan(values)
+        is_numeric = packed.numeric[nodes]
+
+        split = is_numeric & ~is_missing
+        split_nodes = nodes[split]
+        children[split] = numpy.where(values[split] > packed.threshold[split_nodes],
+                                      packed.right[split_nodes], packed.left[split_nodes])
+
+        split = ~is_numeric & ~is_missing
+        split_nodes = nodes[split]
+        codes = values[split].astype(numpy.int64)
+        lookup = packed.default[split_nodes]
+        known = codes >= 0
+        lookup[known] = packed.category_table[packed.table_offset[split_nodes[known]] + codes[known]]
+        children[split] = lookup
+
+        children[is_missing] = packed.missing[nodes[is_missing]]
+
+        current[active] = children
+        active = active[packed.feature[children] >= 0]
+
+    return current.reshape((n_examples, n_trees))
+
+
+def predict_votes(packed, encoded, tree_weights=None):
+    """
+    Accumulates the votes of every tree for every example.
+    :param packed: PackedForest
+    :param encoded: Examples encoded by encode_examples.
+    :param tree_weights: Optional weight per tree, e.g. the accuracies stored by bagged_trees. Unweighted votes are
+        counted as integers.
+    :return: numpy array of shape (examples, labels) containing the votes for each label.
+    """
+    leaf_labels = packed.value[apply_forest(packed, encoded)]
+    n_examples, n_trees = leaf_labels.shape
+    n_labels = len(packed.labels)
+    flat = (numpy.arange(n_examples)[:, None] * n_labels + leaf_labels).ravel()
+    if tree_weights is None:
+        votes = numpy.bincount(flat, minlength=n_examples * n_labels)
+    else:
+        weights = numpy.tile(numpy.asarray(tree_weights, dtype=numpy.float64), n_examples)
+        votes = numpy.bincount(flat, weights=weights, minlength=n_examples * n_labels)
+    return votes.reshape((n_examples, n_labels))
+
+
+def predict(packed, encoded, tree_weights=None):
+    """
+    Predicts the majority vote label for every example.
+    :param packed: PackedForest
+    :param encoded: Examples encoded by encode_examples.
+    :param tree_weights: Optional weight per tree.
+    :return: List of labels, one per example.
+    """
+    winners = numpy.argmax(predict_votes(packed, encoded, tree_weights), axis=1)
+    return [packed.labels[index] for index in winners]
+
+
+def test_packed_forest(packed, example_param, missing_identifier, tree_weights=None):
+    """
+    Tests data against a packed forest and reports the weighted matches of the final (all tree) vote.
+    :param packed: PackedForest
+    :param example_param: data, or file path to data
+    :param missing_identifier: Data within examples indicating a missing value.
+    :param tree_weights: Optional weight per tree.
+    :return: matches, total
+    """
+    if isinstance(example_param, str):
+        examples = ID3.data_parsing(example_param, packed.numeric_cols)
+    elif isinstance(example_param, list):
+        examples = example_param
+    else:
+        raise AttributeError("Invalid data type: Please pass either file path or list of examples to build tree.")
+
+    label_index = len(examples[0]) - 2
+    weight_index = len(examples[0]) - 1
+
+    predictions = predict(packed, encode_examples(packed, examples, missing_identifier), tree_weights)
+
+    matches = 0
+    total = 0
+    for instance, label in zip(examples, predictions):
+        if instance[label_index] == label:
+            matches += instance[weight_index]
+        total += instance[weight_index]
+    return matches, total
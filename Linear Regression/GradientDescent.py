@@ -5,49 +5,477 @@ Created: 2019-02-17
 This is an implementation of Gradient Descent algorithms for use in linear regression learning for CS6350 at
 University of Utah in Spring 2019.
 
-    Coming soon
+Gradients of the squared loss are computed with numpy as X^T(Xw - y), using buffers allocated once per run.
 
 """
 import random
-import math
-import decimal
+import numpy
+import scipy.sparse
 
 
-def gradient_descent(examples, labels, weight, batch_size, iterations, learning_constant):
+class WeightHistory:
+    """
+    Weight vectors recorded every stride steps, kept in a ring buffer that holds the most recent size of them.
+    """
 
-    calc_weight = list(weight)
+    def __init__(self, dimension, size, stride=1):
+        """
+        :param dimension: Length of the weight vectors.
+        :param size: Number of weight vectors kept.
+        :param stride: Record every stride-th step, or 0 to record only forced weights (e.g. once per epoch in
+            minibatch_sgd). The initial and final weights are always recorded.
+        """
+        self.buffer = numpy.empty((size, dimension), dtype=numpy.float64)
+        self.step_buffer = numpy.empty(size, dtype=numpy.int64)
+        self.stride = stride
+        self.count = 0
+        self.last_step = -1
+
+    def record(self, step, weight, force=False):
+        """
+        Records weight if step is a multiple of stride, or if force is True.
+        :param step: Number of steps taken to reach weight.
+        :param weight: Weight vector, copied into the buffer.
+        :param force: True to record regardless of stride.
+        :return: None
+        """
+        if step == self.last_step or not (force or (self.stride > 0 and step % self.stride == 0)):
+            return
+        position = self.count % len(self.buffer)
+        self.buffer[position] = weight
+        self.step_buffer[position] = step
+        self.count += 1
+        self.last_step = step
+
+    def ordered(self, array):
+        if self.count <= len(array):
+            return array[:self.count]
+        return numpy.roll(array, -(self.count % len(array)), axis=0)
+
+    @property
+    def weights(self):
+        """
+        float64 array of recorded weights, oldest first, one per row.
+        """
+        return self.ordered(self.buffer)
+
+    @property
+    def steps(self):
+        """
+        int array of the step at which each row of weights was recorded.
+        """
+        return self.ordered(self.step_buffer)
+
+    def __len__(self):
+        return min(self.count, len(self.buffer))
+
+
+def gradient_descent(examples, labels, weight, batch_size, iterations, learning_constant, threshold=0.000001,
+                     step_rule=None, history=None):
+    """
+    Batch or stochastic gradient descent on the squared loss. Full batch descent stops as soon as a step is shorter
+    than threshold; stochastic descent records that it converged but runs every iteration.
+    :param examples: float64 array (or list of lists) of examples, one per row.
+    :param labels: float64 array (or list) of labels.
+    :param weight: Initial weight vector.
+    :param batch_size: Number of examples sampled per step, or -1 for full batch descent.
+    :param iterations: Maximum number of steps.
+    :param learning_constant: Step size r. With backtracking, the largest step tried.
+    :param threshold: The run has converged once the norm of a step falls below this.
+    :param step_rule: How to pick the step size.
+        None - Constant learning_constant.
+        "backtracking" - Armijo backtracking line search on the loss of each batch.
+        "lipschitz" - 1/L, where L is the largest eigenvalue of X^T X found by power iteration. For stochastic
+            descent L is the smaller of that and batch_size * max ||x_i||^2, which bounds every batch.
+    :param history: WeightHistory to record weights in, to set a stride or bound memory. By default every step is
+        kept.
+    :return: r (the step size of the last step), float64 array holding the recorded weights starting with the
+        initial weight, and True if the run converged.
+    """
+    sparse = scipy.sparse.issparse(examples)
+    x = examples.tocsr().astype(numpy.float64) if sparse else numpy.asarray(examples, dtype=numpy.float64)
+    y = numpy.asarray(labels, dtype=numpy.float64)
     r = learning_constant
-    weights = [list(weight)]
-    threshold = 0.000001
     converge = False
 
+    n, d = x.shape
+    if history is None:
+        history = WeightHistory(d, iterations + 1)
+    calc_weight = numpy.array(weight, dtype=numpy.float64)
+    history.record(0, calc_weight, force=True)
+
+    stochastic = 0 < batch_size < n
+    rows = batch_size if stochastic else n
+    batch = numpy.empty((rows, d), dtype=numpy.float64) if stochastic and not sparse else x
+    batch_labels = numpy.empty(rows, dtype=numpy.float64) if stochastic else y
+    residual = numpy.empty(rows, dtype=numpy.float64)
+    gradient = numpy.empty(d, dtype=numpy.float64)
+    step = numpy.empty(d, dtype=numpy.float64)
+    candidate = numpy.empty(d, dtype=numpy.float64)
+
+    if step_rule == "lipschitz":
+        # Any batch's X^T X is bounded by the full X^T X, and by batch_size times the largest squared row norm.
+        r = 1.0 / min(largest_eigenvalue(x), rows * row_norms(x).max())
+    elif step_rule not in (None, "backtracking"):
+        raise ValueError("Unknown step rule: " + str(step_rule))
+
+    # A learning constant that is too large diverges to inf/nan; that is reported by converge, not by warnings.
+    with numpy.errstate(over="ignore", invalid="ignore"):
+        for i in range(iterations):
+            if stochastic:
+                indices = random.sample(range(n), batch_size)
+                if sparse:
+                    batch = x[indices]
+                else:
+                    numpy.take(x, indices, axis=0, out=batch)
+                numpy.take(y, indices, out=batch_labels)
+
+            get_gradient(batch, batch_labels, calc_weight, residual, gradient)
+            if step_rule == "backtracking":
+                # Residual still holds Xw - y for this batch, so the current loss is free.
+                r = backtracking_step(batch, batch_labels, calc_weight, gradient, 0.5 * residual.dot(residual),
+                                      min(learning_constant, 2 * r), residual, candidate)
+            numpy.multiply(gradient, r, out=step)
+            calc_weight -= step
+            history.record(i + 1, calc_weight)
+
+            if numpy.linalg.norm(step) < threshold:
+                converge = True
+                # One short stochastic step only means one well fit batch, so only full batch descent stops here.
+                if not stochastic:
+                    break
+
+    history.record(i + 1 if iterations > 0 else 0, calc_weight, force=True)
+    return r, history.weights, converge
+
+
+def squared_loss(examples, labels, weight, residual=None):
+    """
+    Squared loss 0.5 * ||Xw - y||^2.
+    """
+    if scipy.sparse.issparse(examples):
+        residual = examples @ weight - labels
+        return 0.5 * residual.dot(residual)
+    residual = numpy.dot(examples, weight, out=residual)
+    residual -= labels
+    return 0.5 * residual.dot(residual)
+
+
+def backtracking_step(examples, labels, weight, gradient, loss, initial_step, residual=None, candidate=None,
+                      shrink=0.5, sufficient_decrease=0.5):
+    """
+    Armijo backtracking line search along the negative gradient.
+    :param loss: Squared loss at weight.
+    :param initial_step: First step size tried.
+    :param residual: Optional buffer of shape (n,).
+    :param candidate: Optional buffer of shape (d,).
+    :return: Largest step initial_step * shrink^k that decreases the loss by at least
+        sufficient_decrease * step * ||gradient||^2.
+    """
+    if candidate is None:
+        candidate = numpy.empty_like(weight)
+    gradient_norm = gradient.dot(gradient)
+    step = initial_step
+    # Stop shrinking once the step can no longer change the weight.
+    while step * gradient_norm > 0 and step > 1e-20:
+        numpy.multiply(gradient, -step, out=candidate)
+        candidate += weight
+        if squared_loss(examples, labels, candidate, residual) <= loss - sufficient_decrease * step * gradient_norm:
+            break
+        step *= shrink
+    return step
+
+
+def largest_eigenvalue(examples, iterations=1000, tolerance=1e-10):
+    """
+    Largest eigenvalue of X^T X by power iteration, without forming X^T X.
+    :param examples: float64 array of shape (n, d).
+    :param iterations: Maximum number of iterations.
+    :param tolerance: Relative change in the estimate to stop at.
+    :return: float estimate of the largest eigenvalue.
+    """
+    vector = numpy.random.default_rng(0).standard_normal(examples.shape[1])
+    vector /= numpy.linalg.norm(vector)
+    estimate = 0.0
     for i in range(iterations):
-        gradient = get_gradient(examples, labels, calc_weight, batch_size)
-        prev_weight = list(calc_weight)
-        for j in range(len(calc_weight)):
-            calc_weight[j] = calc_weight[j] - r * gradient[j]
+        product = examples.T @ (examples @ vector)
+        previous, estimate = estimate, numpy.linalg.norm(product)
+        if estimate == 0:
+            break
+        vector = product / estimate
+        if abs(estimate - previous) <= tolerance * estimate:
+            break
+    return estimate
+
+
+def shuffle_in_unison(a, b):
+    rng_state = numpy.random.get_state()
+    numpy.random.shuffle(a)
+    numpy.random.set_state(rng_state)
+    numpy.random.shuffle(b)
+
+
+def in_memory_chunks(examples, labels):
+    """
+    Epoch source for minibatch_sgd over in-memory arrays. Each epoch shuffles a copy of the data in place.
+    :param examples: float64 array of examples, one per row.
+    :param labels: float64 array of labels.
+    :return: Function returning a list holding one (examples, labels) pair, shuffled for this epoch.
+    """
+    x = numpy.array(examples, dtype=numpy.float64)
+    y = numpy.array(labels, dtype=numpy.float64)
+
+    def epoch():
+        shuffle_in_unison(x, y)
+        return [(x, y)]
+
+    return epoch
+
+
+def minibatch_sgd(epoch_chunks, weight, batch_size, epochs, learning_constant, threshold=0.000001, history=None):
+    """
+    Epoch based mini-batch stochastic gradient descent on the squared loss. Every epoch visits each example once, in
+    contiguous batches sliced from the shuffled chunks without copying.
+    :param epoch_chunks: Function called once per epoch, returning an iterable of (examples, labels) array pairs in
+        the order to train on, e.g. in_memory_chunks(examples, labels).
+    :param weight: Initial weight vector.
+    :param batch_size: Number of examples per step.
+    :param epochs: Maximum number of passes over the data.
+    :param learning_constant: Step size r.
+    :param threshold: The run has converged once the weight moves less than this over an epoch.
+    :param history: WeightHistory to record weights in. By default the weight after every epoch is kept.
+    :return: r, float64 array holding the recorded weights starting with the initial weight, and True if the run
+        converged.
+    """
+    r = learning_constant
+    converge = False
+
+    calc_weight = numpy.array(weight, dtype=numpy.float64)
+    d = len(calc_weight)
+    if history is None:
+        history = WeightHistory(d, epochs + 1, stride=0)
+    history.record(0, calc_weight, force=True)
+
+    residual = numpy.empty(batch_size, dtype=numpy.float64)
+    gradient = numpy.empty(d, dtype=numpy.float64)
+    epoch_start = calc_weight.copy()
+    steps = 0
+
+    with numpy.errstate(over="ignore", invalid="ignore"):
+        for epoch in range(epochs):
+            for x, y in epoch_chunks():
+                for start in range(0, len(x), batch_size):
+                    batch = x[start:start + batch_size]
+                    get_gradient(batch, y[start:start + batch_size], calc_weight, residual[:len(batch)], gradient)
+                    gradient *= r
+                    calc_weight -= gradient
+                    steps += 1
+                    if history.stride > 0:
+                        history.record(steps, calc_weight)
+
+            if history.stride == 0:
+                history.record(steps, calc_weight, force=True)
+
+            epoch_start -= calc_weight
+            if numpy.linalg.norm(epoch_start) < threshold:
+                converge = True
+                break
+            epoch_start[:] = calc_weight
+
+    history.record(steps, calc_weight, force=True)
+    return r, history.weights, converge
+
+
+def row_norms(examples):
+    """
+    Squared norm of every row, for dense or sparse examples.
+    """
+    if scipy.sparse.issparse(examples):
+        return numpy.asarray(examples.multiply(examples).sum(axis=1)).ravel()
+    return numpy.einsum("ij,ij->i", examples, examples)
+
+
+def variance_reduced_step(examples):
+    """
+    Default SVRG/SAGA step size 1 / (3 * L_max), where L_max = max ||x_i||^2 bounds every single example's loss.
+    """
+    return 1.0 / (3.0 * row_norms(examples).max())
+
+
+def svrg(examples, labels, weight, batch_size, epochs, learning_constant, threshold=0.000001, history=None,
+         target_loss=None, inner_steps=None):
+    """
+    Stochastic variance reduced gradient on the mean squared loss. Every epoch takes a snapshot and its full gradient,
+    then takes inner steps along batch gradients corrected by the snapshot.
+    :param examples: float64 array of examples, one per row.
+    :param labels: float64 array of labels.
+    :param weight: Initial weight vector.
+    :param batch_size: Number of examples per inner step.
+    :param epochs: Maximum number of snapshots.
+    :param learning_constant: Step size, or None for 1 / (3 * max ||x_i||^2).
+    :param threshold: The run has converged once the weight moves less than this over an epoch.
+    :param history: WeightHistory to record weights in. By default the weight after every epoch is kept.
+    :param target_loss: Stop once the loss 0.5 * ||Xw - y||^2 is at most this; checked after every epoch.
+    :param inner_steps: Inner steps per epoch; defaults to one pass, n / batch_size.
+    :return: r, float64 array of recorded weights, True if the run converged, and passes over the data (gradient
+        evaluations / n) taken to reach target_loss, None if it was not reached, or in total without a target.
+    """
+    x = numpy.asarray(examples, dtype=numpy.float64)
+    y = numpy.asarray(labels, dtype=numpy.float64)
+    n, d = x.shape
+    batch_size = max(1, min(batch_size, n))
+    r = variance_reduced_step(x) if learning_constant is None else learning_constant
+    if inner_steps is None:
+        inner_steps = max(1, n // batch_size)
+
+    calc_weight = numpy.array(weight, dtype=numpy.float64)
+    if history is None:
+        history = WeightHistory(d, epochs + 1, stride=0)
+    history.record(0, calc_weight, force=True)
+
+    residual = numpy.empty(n, dtype=numpy.float64)
+    batch_residual = numpy.empty(batch_size, dtype=numpy.float64)
+    full_gradient = numpy.empty(d, dtype=numpy.float64)
+    gradient = numpy.empty(d, dtype=numpy.float64)
+    difference = numpy.empty(d, dtype=numpy.float64)
+    snapshot = calc_weight.copy()
+    converge = False
+    passes = 0.0
+    steps = 0
+
+    with numpy.errstate(over="ignore", invalid="ignore"):
+        for epoch in range(epochs):
+            snapshot[:] = calc_weight
+            get_gradient(x, y, snapshot, residual, full_gradient)
+            full_gradient /= n
+            passes += 1
+
+            for t in range(inner_steps):
+                indices = numpy.random.randint(n, size=batch_size)
+                batch = x[indices]
+                # Gradient at w minus gradient at the snapshot is X_b^T X_b (w - snapshot) for squared loss.
+                numpy.subtract(calc_weight, snapshot, out=difference)
+                numpy.dot(batch, difference, out=batch_residual)
+                numpy.dot(batch.T, batch_residual, out=gradient)
+                gradient /= batch_size
+                gradient += full_gradient
+                gradient *= r
+                calc_weight -= gradient
+                steps += 1
+                if history.stride > 0:
+                    history.record(steps, calc_weight)
+            passes += 2.0 * inner_steps * batch_size / n
+
+            if history.stride == 0:
+                history.record(steps, calc_weight, force=True)
+
+            snapshot -= calc_weight
+            converge = numpy.linalg.norm(snapshot) < threshold
+            reached = target_loss is not None and squared_loss(x, y, calc_weight, residual) <= target_loss
+            if converge or reached:
+                break
+
+    if target_loss is not None and squared_loss(x, y, calc_weight, residual) > target_loss:
+        passes = None
+
+    history.record(steps, calc_weight, force=True)
+    return r, history.weights, converge, passes
+
+
+def saga(examples, labels, weight, batch_size, epochs, learning_constant, threshold=0.000001, history=None,
+         target_loss=None):
+    """
+    SAGA on the mean squared loss. For a linear model each stored gradient is a residual times its example, so the
+    gradient table only needs one float per example.
+    Parameters and return value are the same as svrg; an epoch is n / batch_size steps.
+    """
+    x = numpy.asarray(examples, dtype=numpy.float64)
+    y = numpy.asarray(labels, dtype=numpy.float64)
+    n, d = x.shape
+    batch_size = max(1, min(batch_size, n))
+    r = variance_reduced_step(x) if learning_constant is None else learning_constant
+    steps_per_epoch = max(1, n // batch_size)
+
+    calc_weight = numpy.array(weight, dtype=numpy.float64)
+    if history is None:
+        history = WeightHistory(d, epochs + 1, stride=0)
+    history.record(0, calc_weight, force=True)
+
+    # Stored residuals x_i.w - y_i and the mean of the stored gradients, both from the initial weight.
+    table = numpy.empty(n, dtype=numpy.float64)
+    average = get_gradient(x, y, calc_weight, table) / n
+    gradient = numpy.empty(d, dtype=numpy.float64)
+    correction = numpy.empty(d, dtype=numpy.float64)
+    epoch_start = calc_weight.copy()
+    converge = False
+    passes = 1.0
+    steps = 0
+
+    with numpy.errstate(over="ignore", invalid="ignore"):
+        for epoch in range(epochs):
+            # One permutation per epoch, sliced into batches: batches need distinct rows for the table update, and
+            # numpy.random.choice without replacement would build an O(n) permutation on every step.
+            order = numpy.random.permutation(n)
+            for t in range(steps_per_epoch):
+                indices = order[t * batch_size:(t + 1) * batch_size]
+                batch = x[indices]
+                new_residual = batch @ calc_weight
+                new_residual -= y[indices]
+                change = new_residual - table[indices]
+                numpy.dot(batch.T, change, out=correction)
+
+                numpy.divide(correction, batch_size, out=gradient)
+                gradient += average
+                gradient *= r
+                calc_weight -= gradient
 
-        weights.append(list(calc_weight))
+                correction /= n
+                average += correction
+                table[indices] = new_residual
+                steps += 1
+                if history.stride > 0:
+                    history.record(steps, calc_weight)
+            passes += steps_per_epoch * batch_size / n
 
-        if math.sqrt(sum((decimal.Decimal(x-y))**2 for x,y in zip(prev_weight,calc_weight))) < threshold:
-            converge = True
+            if history.stride == 0:
+                history.record(steps, calc_weight, force=True)
 
-    return r, weights, converge
+            epoch_start -= calc_weight
+            converge = numpy.linalg.norm(epoch_start) < threshold
+            epoch_start[:] = calc_weight
+            reached = target_loss is not None and squared_loss(x, y, calc_weight) <= target_loss
+            if converge or reached:
+                break
 
+    if target_loss is not None and squared_loss(x, y, calc_weight) > target_loss:
+        passes = None
 
-def get_gradient(examples, labels, weight, batch_size):
-    dj = list(weight)
+    history.record(steps, calc_weight, force=True)
+    return r, history.weights, converge, passes
 
-    if batch_size > 0:
-        indices = random.sample(range(len(examples)), batch_size)
-        batch = list([examples[i] for i in indices])
-        batch_labels = list([labels[i] for i in indices])
-    else:
-        batch = list(examples)
-        batch_labels = list(labels)
 
-    for j in range(len(dj)):
-        for i in range(len(batch)):
-            dj[j] -= batch[i][j] * (batch_labels[i] - sum(x*y for x,y in zip(weight, batch[i])))
+def get_gradient(examples, labels, weight, residual=None, out=None):
+    """
+    Gradient of the squared loss, X^T(Xw - y). Sparse examples cost O(non-zeros).
+    :param examples: float64 array or scipy.sparse matrix of shape (n, d).
+    :param labels: float64 array of shape (n,).
+    :param weight: float64 array of shape (d,).
+    :param residual: Optional buffer of shape (n,) for Xw - y.
+    :param out: Optional buffer of shape (d,) for the gradient.
+    :return: float64 array of shape (d,).
+    """
+    if scipy.sparse.issparse(examples):
+        if residual is None:
+            residual = examples @ weight
+        else:
+            residual[:] = examples @ weight
+        residual -= labels
+        gradient = examples.T @ residual
+        if out is None:
+            return gradient
+        out[:] = gradient
+        return out
 
-    return dj
+    residual = numpy.dot(examples, weight, out=residual)
+    residual -= labels
+    return numpy.dot(examples.T, residual, out=out)
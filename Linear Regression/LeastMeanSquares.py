@@ -8,25 +8,259 @@ This is an implementation of the Least Mean Squares (LMS) algorithm for CS6350 a
 
 """
 
+import concurrent.futures
+import functools
+import os
+import numpy
+import scipy.sparse
+from scipy.linalg import cho_factor, cho_solve, LinAlgError
+
 import GradientDescent
+import IOUtilities
 
 LABEL_INDEX = -1
 AUGMENT_INDEX = -1
 
 
-def least_mean_squares(example_param, batch_size, iterations, learning_constant):
+def least_mean_squares(example_param, batch_size, iterations, learning_constant, step_rule=None, history=None,
+                       solver="gd", target_loss=None, report_passes=False):
+    """
+    Learns an LMS weight vector.
+    :param example_param: String containing file path, or list of examples as read by data_parsing.
+    :param batch_size: Number of examples per step, or -1 for full batch descent.
+    :param iterations: Maximum number of steps for "gd", or epochs for "svrg" and "saga".
+    :param learning_constant: float learning constant. For "svrg" and "saga", None picks 1 / (3 * max ||x_i||^2).
+    :param step_rule: Step size rule for "gd"; see GradientDescent.gradient_descent.
+    :param history: Optional GradientDescent.WeightHistory.
+    :param solver: "gd" for gradient descent, or "svrg" / "saga" for variance reduced stochastic solvers, which
+        converge with a constant learning constant.
+    :param target_loss: Training loss 0.5 * ||Xw - y||^2 to report passes over the data for. "svrg" and "saga" stop
+        as soon as it is reached.
+    :param report_passes: True to also return passes over the data.
+    :return: (learning constant, weight vectors, bool convergence variable), followed by the passes over the data
+        taken to reach target_loss (None if not reached, or in total without a target) if report_passes is True.
+    """
+    x, labels = get_arrays(example_param)
+    weight = numpy.zeros(x.shape[1])
 
-    if isinstance(example_param, str):
+    if solver == "gd":
+        if history is None:
+            history = GradientDescent.WeightHistory(x.shape[1], iterations + 1)
+        hypothesis = GradientDescent.gradient_descent(x, labels, weight, batch_size, iterations, learning_constant,
+                                                      step_rule=step_rule, history=history)
+        n = x.shape[0]
+        rows = batch_size if 0 < batch_size < n else n
+        if target_loss is None:
+            passes = history.steps[-1] * rows / n
+        else:
+            reached = numpy.flatnonzero(loss_curve(history, x, labels) <= target_loss)
+            passes = history.steps[reached[0]] * rows / n if len(reached) else None
+        hypothesis = hypothesis + (passes,)
+    elif solver in ("svrg", "saga"):
+        if scipy.sparse.issparse(x):
+            raise ValueError("The svrg and saga solvers need dense examples.")
+        train = GradientDescent.svrg if solver == "svrg" else GradientDescent.saga
+        batch_size = max(batch_size, 1)
+        hypothesis = train(x, labels, weight, batch_size, iterations, learning_constant, history=history,
+                           target_loss=target_loss)
+    else:
+        raise ValueError("Unknown solver: " + str(solver))
+
+    return hypothesis if report_passes else hypothesis[:3]
+
+
+def least_mean_squares_sgd(example_param, batch_size, epochs, learning_constant, chunk_size=65536, history=None):
+    """
+    Epoch based mini-batch SGD for LMS. A .npy file is streamed from disk in shuffled chunks, so data sets larger
+    than memory can be used; convert a csv file with IOUtilities.csv_to_npy(csv_file, npy_file, augment=True).
+    :param example_param: String containing a csv or .npy file path, or list of examples as read by data_parsing.
+    :param batch_size: Number of examples per step.
+    :param epochs: Maximum number of passes over the data.
+    :param learning_constant: float learning constant for calculating weight vectors.
+    :param chunk_size: Number of rows read from a .npy file at a time.
+    :param history: Optional GradientDescent.WeightHistory.
+    :return: (learning constant, weight vectors, bool convergence variable) as from least_mean_squares.
+    """
+    if isinstance(example_param, str) and example_param.endswith('.npy'):
+        dimension = numpy.load(example_param, mmap_mode='r').shape[1] - 1
+
+        def epoch_chunks():
+            for chunk in IOUtilities.npy_chunks(example_param, chunk_size):
+                yield numpy.ascontiguousarray(chunk[:, :-1]), chunk[:, -1]
+    else:
+        x, labels = get_arrays(example_param)
+        dimension = x.shape[1]
+        epoch_chunks = GradientDescent.in_memory_chunks(x, labels)
+
+    return GradientDescent.minibatch_sgd(epoch_chunks, numpy.zeros(dimension), batch_size, epochs, learning_constant,
+                                         history=history)
+
+
+def get_arrays(example_param):
+    """
+    Reads examples into numpy arrays.
+    :param example_param: String containing file path, list of examples as read by data_parsing, or an
+        (examples, labels) tuple, e.g. a scipy.sparse matrix and float targets from
+        IOUtilities.data_parsing_svmlight(..., raw_labels=True).
+    :return: float64 array (or sparse matrix) of augmented examples, one per row, and float64 array of labels.
+    """
+    if isinstance(example_param, tuple):
+        if len(example_param) > 2 and example_param[2] is not None:
+            # A label map means the targets were mapped to +/-1 for classification.
+            raise ValueError("Labels were mapped to +/-1; load regression data with raw_labels=True.")
+        return example_param[0], numpy.asarray(example_param[1], dtype=numpy.float64)
+    elif isinstance(example_param, str):
         examples = data_parsing(example_param)
     elif isinstance(example_param, list):
         examples = example_param
     else:
         raise AttributeError("Invalid data type: Please pass either file path or list of examples to build tree.")
 
-    labels = [ex[LABEL_INDEX] for ex in examples]
-    x = [ex[0:len(ex)-1] for ex in examples]
+    data = numpy.array(examples, dtype=numpy.float64)
+    return numpy.ascontiguousarray(data[:, :LABEL_INDEX]), data[:, LABEL_INDEX]
+
+
+def loss_curve(history, x, labels, chunk_size=65536):
+    """
+    Loss of every recorded weight vector, as computed by test_lms, from one matrix product per chunk of examples.
+    :param history: 2-D array of weight vectors, one per row, or a GradientDescent.WeightHistory.
+    :param x: float64 array of augmented examples, as returned by get_arrays.
+    :param labels: float64 array of labels.
+    :param chunk_size: Number of examples scored at a time, to bound the size of the prediction matrix.
+    :return: float64 array with one loss per weight vector.
+    """
+    weights = history.weights if isinstance(history, GradientDescent.WeightHistory) else numpy.asarray(history)
+    losses = numpy.zeros(len(weights))
+    for start in range(0, x.shape[0], chunk_size):
+        residual = x[start:start + chunk_size] @ weights.T
+        residual -= labels[start:start + chunk_size, None]
+        losses += 0.5 * numpy.einsum("ij,ij->j", residual, residual)
+    return losses
+
+
+def closed_form_lms(example_param, ridge=0.0, chunk_size=10000, processes=1):
+    """
+    Solves least squares from the normal equations (X^T X + ridge * I) w = X^T y. Files are streamed in chunks, so
+    only the d x d sufficient statistics are held in memory.
+    :param example_param: String containing file path, or list of examples as read by data_parsing.
+    :param ridge: L2 regularization strength. The augmented bias weight is not regularized.
+    :param chunk_size: Number of lines parsed at a time.
+    :param processes: Number of worker processes, each reading its own byte range of the file.
+    :return: float64 weight vector, with the bias weight last as in data_parsing.
+    """
+    if isinstance(example_param, str):
+        ranges = split_byte_ranges(example_param, processes)
+        read = functools.partial(normal_equation_statistics, example_param, chunk_size)
+        if processes > 1:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+                statistics = list(executor.map(read, *zip(*ranges)))
+        else:
+            statistics = [read(start, end) for start, end in ranges]
+        # Ranges in which no line starts, e.g. with more processes than lines, have no statistics.
+        statistics = [partial for partial in statistics if partial is not None]
+        if not statistics:
+            raise ValueError("No examples in file: " + example_param)
+        statistics = functools.reduce(merge_statistics, statistics)
+    elif isinstance(example_param, list):
+        statistics = chunk_statistics(numpy.array(example_param, dtype=numpy.float64))
+    else:
+        raise AttributeError("Invalid data type: Please pass either file path or list of examples to build tree.")
+
+    return solve_normal_equations(statistics, ridge)
+
+
+def chunk_statistics(data):
+    """
+    Sufficient statistics of one chunk of augmented examples.
+    :param data: float64 array of shape (n, d + 1) holding examples with their label in the last column.
+    :return: (X^T X, X^T y, n)
+    """
+    x = data[:, :-1]
+    y = data[:, -1]
+    return x.T @ x, x.T @ y, len(data)
+
+
+def merge_statistics(first, second):
+    """
+    Combines the sufficient statistics of two disjoint sets of examples.
+    :return: (X^T X, X^T y, n)
+    """
+    return first[0] + second[0], first[1] + second[1], first[2] + second[2]
+
+
+def parse_chunk(lines):
+    data = numpy.array([line.split(b',') for line in lines], dtype=numpy.float64)
+    # Augment with 1 before the label, as data_parsing does.
+    return numpy.insert(data, data.shape[1] - 1, 1.0, axis=1)
+
+
+def normal_equation_statistics(csv_file, chunk_size=10000, start=0, end=None):
+    """
+    Streams the lines of a csv file that start within [start, end) and accumulates their sufficient statistics.
+    :param csv_file: File to be read.
+    :param chunk_size: Number of lines parsed at a time.
+    :param start: Byte offset to start at.
+    :param end: Byte offset to stop at, or None for the end of the file.
+    :return: (X^T X, X^T y, n), or None if the range holds no lines.
+    """
+    statistics = None
+    with open(csv_file, 'rb') as f:
+        if start > 0:
+            # Skip the rest of a line that started in the previous range.
+            f.seek(start - 1)
+            f.readline()
+        position = f.tell()
+
+        lines = []
+        while end is None or position < end:
+            line = f.readline()
+            if not line:
+                break
+            position += len(line)
+            if line.strip():
+                lines.append(line)
+            if len(lines) == chunk_size:
+                statistics = merge_or_first(statistics, chunk_statistics(parse_chunk(lines)))
+                lines = []
+        if lines:
+            statistics = merge_or_first(statistics, chunk_statistics(parse_chunk(lines)))
+
+    return statistics
+
+
+def merge_or_first(statistics, chunk):
+    return chunk if statistics is None else merge_statistics(statistics, chunk)
+
+
+def split_byte_ranges(csv_file, parts):
+    """
+    Splits a file into byte ranges of about equal size, one per worker.
+    :return: List of (start, end) tuples.
+    """
+    size = os.path.getsize(csv_file)
+    bounds = [size * p // parts for p in range(parts + 1)]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def solve_normal_equations(statistics, ridge=0.0):
+    """
+    Solves (X^T X + ridge * I) w = X^T y with a Cholesky factorization. Singular systems fall back to the minimum
+    norm least-squares solution.
+    :param statistics: (X^T X, X^T y, n) as returned by normal_equation_statistics or merge_statistics.
+    :param ridge: L2 regularization strength. The augmented bias weight, second to last column of the data and last
+        column of X, is not regularized.
+    :return: float64 weight vector.
+    """
+    xtx, xty = numpy.array(statistics[0], dtype=numpy.float64), statistics[1]
+    if ridge > 0:
+        penalty = numpy.full(len(xty), float(ridge))
+        penalty[-1] = 0.0
+        xtx[numpy.diag_indices_from(xtx)] += penalty
 
-    return GradientDescent.gradient_descent(x, labels, [0]*(len(x[0])), batch_size, iterations, learning_constant)
+    try:
+        return cho_solve(cho_factor(xtx), xty)
+    except LinAlgError:
+        return numpy.linalg.lstsq(xtx, xty, rcond=None)[0]
 
 
 def data_parsing(csv_file):
@@ -0,0 +1,317 @@
+"""
+Author: John Jacobson (u1201441)
+Created: 2019-04-28
+
+This is an implementation of logistic regression for binary classification. Three solvers share one loss and
+gradient routine:
+    sgd - Mini-batch stochastic gradient descent with a learning rate schedule.
+    newton - Newton's method (iteratively reweighted least squares) with a backtracking line search, for data with
+        few features. With many features the Newton system is solved by conjugate gradient on Hessian-vector products.
+    lbfgs - Limited memory BFGS through scipy, for data with many features.
+
+Objectives are averaged over the training examples, which does not change their minimizer:
+    Maximum likelihood:  mean(log(1 + exp(-y w.x)))
+    MAP (Gaussian prior with the given variance):  the above + ||w||^2 / (2 * variance * n)
+
+"""
+import time
+import numpy
+from scipy.optimize import minimize
+from scipy.sparse.linalg import LinearOperator, cg
+
+import IOUtilities
+
+
+def shuffle_in_unison(a, b):
+    rng_state = numpy.random.get_state()
+    numpy.random.shuffle(a)
+    numpy.random.set_state(rng_state)
+    numpy.random.shuffle(b)
+
+
+def log_sigmoid(z):
+    """
+    log(sigmoid(z)), computed without overflow for large |z|.
+    """
+    return -numpy.logaddexp(0, -z)
+
+
+def sigmoid(z):
+    """
+    Sigmoid computed without overflow for large |z|.
+    """
+    return numpy.exp(log_sigmoid(z))
+
+
+def get_arrays(file_path):
+    """
+    Reads a numeric csv file with IOUtilities, augmented with a trailing 1 before the label.
+    :param file_path: Path of the data file.
+    :return: float64 examples array, float64 array of +/-1 labels, and label map {label: +/-1}.
+    """
+    data = IOUtilities.data_parsing_numeric(file_path)
+    examples, labels, label_map = IOUtilities.data_to_array(data)
+    return numpy.array(examples, dtype=numpy.float64), numpy.array(labels, dtype=numpy.float64), label_map
+
+
+def objective(weight, examples, labels, variance=None, n=None):
+    """
+    Mean logistic loss, plus the Gaussian prior term for MAP estimation.
+    :param weight: Weight vector.
+    :param examples: float64 array of examples, one per row.
+    :param labels: float64 array of +/-1 labels.
+    :param variance: Prior variance for MAP estimation, or None for maximum likelihood.
+    :param n: Number of training examples the prior is spread over; defaults to len(examples).
+    :return: float objective value.
+    """
+    if n is None:
+        n = len(examples)
+    loss = -numpy.mean(log_sigmoid(labels * (examples @ weight)))
+    if variance is not None:
+        loss += weight.dot(weight) / (2 * variance * n)
+    return loss
+
+
+def loss_and_gradient(weight, examples, labels, variance=None, n=None):
+    """
+    Objective and its gradient from a single pass over the examples.
+    Parameters are the same as objective.
+    :return: float objective value, and float64 gradient vector.
+    """
+    if n is None:
+        n = len(examples)
+    margins = labels * (examples @ weight)
+    loss = -numpy.mean(log_sigmoid(margins))
+    # d/dz log(1 + exp(-z)) = -sigmoid(-z)
+    coefficients = -labels * sigmoid(-margins)
+    gradient = examples.T @ coefficients
+    gradient /= len(examples)
+    if variance is not None:
+        loss += weight.dot(weight) / (2 * variance * n)
+        gradient += weight / (variance * n)
+    return loss, gradient
+
+
+def hessian_vector(weight, examples, labels, vector, variance=None, n=None):
+    """
+    Product of the objective's Hessian with a vector, X^T D X v / m + v / (variance * n), without forming the Hessian.
+    Parameters are the same as objective.
+    :param vector: Vector to multiply.
+    :return: float64 vector.
+    """
+    if n is None:
+        n = len(examples)
+    probabilities = sigmoid(examples @ weight)
+    product = examples.T @ (probabilities * (1 - probabilities) * (examples @ vector))
+    product /= len(examples)
+    if variance is not None:
+        product += vector / (variance * n)
+    return product
+
+
+def hessian(weight, examples, labels, variance=None, n=None):
+    """
+    The objective's Hessian, X^T D X / m + I / (variance * n). Only practical for data with few features.
+    Parameters are the same as objective.
+    :return: float64 array of shape (d, d).
+    """
+    if n is None:
+        n = len(examples)
+    probabilities = sigmoid(examples @ weight)
+    result = (examples * (probabilities * (1 - probabilities))[:, None]).T @ examples
+    result /= len(examples)
+    if variance is not None:
+        result[numpy.diag_indices_from(result)] += 1 / (variance * n)
+    return result
+
+
+def sgd(examples, labels, epochs, rate_schedule, learning_rate, variance, batch_size, callback=None):
+    n = len(examples)
+    weight = numpy.zeros(examples.shape[1])
+
+    for t in range(epochs):
+        shuffle_in_unison(examples, labels)
+        for start in range(0, n, batch_size):
+            # Slices of the shuffled arrays are views; the prior is spread over all n examples.
+            gradient = loss_and_gradient(weight, examples[start:start + batch_size], labels[start:start + batch_size],
+                                         variance, n)[1]
+            weight -= learning_rate * gradient
+        if rate_schedule is not None:
+            learning_rate = rate_schedule(learning_rate, t)
+        if callback is not None and callback(weight):
+            break
+
+    return weight
+
+
+def newton_direction(weight, examples, labels, gradient, variance, max_dense_features=500):
+    """
+    Solves H d = gradient. Small problems form the Hessian (IRLS); larger ones run conjugate gradient on Hessian-vector
+    products, so the d x d Hessian is never formed.
+    """
+    d = len(weight)
+    if d <= max_dense_features:
+        matrix = hessian(weight, examples, labels, variance)
+        try:
+            return numpy.linalg.solve(matrix, gradient)
+        except numpy.linalg.LinAlgError:
+            return numpy.linalg.lstsq(matrix, gradient, rcond=None)[0]
+
+    operator = LinearOperator((d, d), matvec=lambda v: hessian_vector(weight, examples, labels, v, variance),
+                              dtype=numpy.float64)
+    return cg(operator, gradient, maxiter=50)[0]
+
+
+def newton(examples, labels, iterations, variance, tolerance=1e-8, callback=None):
+    weight = numpy.zeros(examples.shape[1])
+    loss, gradient = loss_and_gradient(weight, examples, labels, variance)
+
+    for t in range(iterations):
+        direction = newton_direction(weight, examples, labels, gradient, variance)
+
+        # Backtrack from the full Newton step; without a prior, separable data would otherwise diverge.
+        decrease = gradient.dot(direction)
+        step = 1.0
+        while step > 1e-10:
+            candidate = weight - step * direction
+            candidate_loss, candidate_gradient = loss_and_gradient(candidate, examples, labels, variance)
+            if candidate_loss <= loss - 0.25 * step * decrease:
+                break
+            step *= 0.5
+        else:
+            break
+
+        weight, loss, gradient = candidate, candidate_loss, candidate_gradient
+        if callback is not None and callback(weight):
+            break
+        if 0.5 * decrease < tolerance:
+            break
+
+    return weight
+
+
+def lbfgs(examples, labels, iterations, variance, tolerance=1e-8, callback=None):
+    last = [numpy.zeros(examples.shape[1])]
+
+    def stop(weight):
+        last[0] = weight
+        if callback is not None and callback(weight):
+            raise StopIteration
+
+    try:
+        result = minimize(loss_and_gradient, last[0], args=(examples, labels, variance), jac=True, method="L-BFGS-B",
+                          callback=stop, options={"maxiter": iterations, "gtol": tolerance})
+        return result.x
+    except StopIteration:
+        # Versions of scipy that do not handle StopIteration themselves.
+        return last[0]
+
+
+def fit(examples, labels, epochs, rate_schedule=None, learning_rate=0.1, variance=None, batch_size=1, solver="sgd",
+        tolerance=1e-8, callback=None):
+    """
+    Learns a weight vector from arrays.
+    :param examples: float64 array of augmented examples, one per row. Shuffled in place by the sgd solver.
+    :param labels: float64 array of +/-1 labels.
+    :param callback: Optional function called with the weight after every epoch or iteration; returning True stops
+        training.
+    Remaining parameters are the same as logistic_regression.
+    :return: float64 weight vector.
+    """
+    if solver == "sgd":
+        return sgd(examples, labels, epochs, rate_schedule, learning_rate, variance, batch_size, callback)
+    elif solver == "newton":
+        return newton(examples, labels, epochs, variance, tolerance, callback)
+    elif solver == "lbfgs":
+        return lbfgs(examples, labels, epochs, variance, tolerance, callback)
+    raise ValueError("Unknown solver: " + str(solver))
+
+
+def logistic_regression(file_path, epochs, rate_schedule, learning_rate=0.1, variance=None, batch_size=1,
+                        solver="sgd", tolerance=1e-8):
+    """
+    Learns a logistic regression weight vector.
+    :param file_path: Path of the training data; all numeric, with the label last.
+    :param epochs: Number of passes over the shuffled training data for sgd, or maximum iterations for newton and
+        lbfgs.
+    :param rate_schedule: Function (learning_rate, t) -> learning rate for the next epoch, or None for a constant rate.
+    :param learning_rate: Initial learning rate.
+    :param variance: Prior variance for MAP estimation, or None for maximum likelihood.
+    :param batch_size: Number of examples per step.
+    :param solver: "sgd", "newton", or "lbfgs".
+    :param tolerance: Convergence tolerance for newton (Newton decrement) and lbfgs (gradient size).
+    :return: label map {label: +/-1}, and float64 weight vector (bias weight last).
+    """
+    examples, labels, label_map = get_arrays(file_path)
+    return label_map, fit(examples, labels, epochs, rate_schedule, learning_rate, variance, batch_size, solver,
+                          tolerance)
+
+
+def solver_benchmark(file_path, target_loss=None, variance=None, epochs=100, rate_schedule=None, learning_rate=0.1,
+                     batch_size=10):
+    """
+    Wall time each solver takes to reach a target objective value.
+    :param file_path: Path of the training data.
+    :param target_loss: Objective value to reach, or None for 1.0001 times the optimum found by Newton's method.
+    :param variance: Prior variance for MAP estimation, or None for maximum likelihood.
+    :param epochs: Maximum epochs or iterations per solver.
+    Remaining parameters configure the sgd solver.
+    :return: target loss, and dict {solver: seconds to reach it, or None if it was not reached}.
+    """
+    examples, labels, label_map = get_arrays(file_path)
+    if target_loss is None:
+        optimum = fit(examples, labels, epochs, variance=variance, solver="newton", tolerance=1e-14)
+        target_loss = 1.0001 * objective(optimum, examples, labels, variance)
+
+    results = {}
+    for solver in ("sgd", "newton", "lbfgs"):
+        reached = []
+        start = time.perf_counter()
+
+        def callback(weight):
+            if objective(weight, examples, labels, variance) <= target_loss:
+                reached.append(time.perf_counter() - start)
+                return True
+            return False
+
+        fit(examples, labels, epochs, rate_schedule, learning_rate, variance, batch_size, solver, 0.0, callback)
+        results[solver] = reached[0] if reached else None
+
+    return target_loss, results
+
+
+def predict_proba(hypothesis, examples):
+    """
+    Probability of the label mapped to +1, for every example at once.
+    :param hypothesis: (label map, weight) as returned by logistic_regression.
+    :param examples: float64 array of augmented examples, one per row.
+    :return: float64 array of probabilities.
+    """
+    return sigmoid(numpy.asarray(examples, dtype=numpy.float64) @ hypothesis[1])
+
+
+def get_label(hypothesis, example):
+    """
+    :param hypothesis: (label map, weight) as returned by logistic_regression.
+    :param example: A single augmented example.
+    :return: The original label assigned to this example.
+    """
+    result = 1 if predict_proba(hypothesis, [example])[0] >= 0.5 else -1
+    for label, value in hypothesis[0].items():
+        if value == result:
+            return label
+
+
+def test_logistic_regression(hypothesis, test_file_path):
+    """
+    :param hypothesis: (label map, weight) as returned by logistic_regression.
+    :param test_file_path: Path of the test data.
+    :return: Number of correct predictions, and number of examples.
+    """
+    data = IOUtilities.data_parsing_numeric(test_file_path)
+    array_data = numpy.array(data, dtype=numpy.float64)
+    # Map test labels with the training label map, since data_to_array maps labels in order of appearance.
+    labels = numpy.array([hypothesis[0].get(label, 0) for label in array_data[:, -1]])
+
+    predictions = numpy.where(predict_proba(hypothesis, array_data[:, :-1]) >= 0.5, 1, -1)
+    return int(numpy.sum(predictions == labels)), len(labels)
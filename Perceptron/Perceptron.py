@@ -2,19 +2,47 @@
 Author: John Jacobson (u1201441)
 Created: 2019-03-02
 
-This is an implementation of the Perceptron algorithm, including standard, voted, and averaged output.
+This is an implementation of the Perceptron algorithm, including standard, voted, and averaged output, and a kernel
+perceptron in dual form.
 
 
 """
 import numpy
+import scipy.sparse
 import IOUtilities
+from scipy.spatial.distance import cdist, pdist, squareform
+
+
+def load_examples(example_param):
+    """
+    :param example_param: File path of numeric csv data, or (instances, labels, label_map) as returned by
+        IOUtilities.data_to_array or the sparse loaders.
+    :return: instances, labels, label_map
+    """
+    if isinstance(example_param, str):
+        data = IOUtilities.data_parsing_numeric(example_param)
+        return IOUtilities.data_to_array(data)
+    elif isinstance(example_param, tuple):
+        return example_param[0], example_param[1], example_param[2]
+    raise AttributeError("Invalid data type: Please pass either file path or (instances, labels, label_map).")
+
+
+def dot(weight, example):
+    """
+    weight . example for a dense example, or a 1 x d sparse row.
+    """
+    if scipy.sparse.issparse(example):
+        return (example @ weight)[0]
+    return numpy.transpose(weight) @ example
 
 
 # Forgot to include augmentation to vectors! Need to add 1 to the end of all examples to account for translation (bias).
 def perceptron(file_path, epochs, missing_identifier):
 
-    data = IOUtilities.data_parsing_numeric(file_path)
-    examples, labels, label_map = IOUtilities.data_to_array(data)
+    examples, labels, label_map = load_examples(file_path)
+
+    if scipy.sparse.issparse(examples):
+        return perceptron_sparse(examples.tocsr(), labels, label_map, epochs)
 
     weight = numpy.zeros(len(examples[0, :]))
     weights = [label_map]
@@ -37,6 +65,351 @@ def perceptron(file_path, epochs, missing_identifier):
     return weights
 
 
+def perceptron_sparse(examples, labels, label_map, epochs):
+    """
+    Perceptron over a CSR matrix. Predictions and updates only touch each example's non-zero features.
+    The returned (weight, count) history still copies the weight on each mistake, as voted prediction needs it.
+    """
+    weight = numpy.zeros(examples.shape[1])
+    weights = [label_map]
+    learning_rate = 1 / (10**3)
+    correct_count = 0
+
+    for t in range(epochs):
+        for i in range(examples.shape[0]):
+            start, end = examples.indptr[i], examples.indptr[i + 1]
+            indices = examples.indices[start:end]
+            values = examples.data[start:end]
+            prediction = sgn(weight[indices] @ values)
+            if prediction != labels[i]:
+                weights.append(tuple([weight.copy(), correct_count]))
+                weight[indices] += learning_rate * labels[i] * values
+                correct_count = 0
+            else:
+                correct_count += 1
+    # Append final weight
+    weights.append(tuple([weight, correct_count]))
+
+    return weights
+
+
+def averaged_perceptron(file_path, epochs, missing_identifier):
+    """
+    Averaged perceptron in O(d) memory. Rather than storing every intermediate weight, keeps the current weight w and
+    an accumulator u of each update scaled by the step c it happened at, so the average is recovered from w and u
+    at the end.
+    :param file_path: File path, or (instances, labels, label_map) tuple as accepted by perceptron.
+    :param epochs: Number of passes over the training data.
+    :param missing_identifier: Data within examples indicating a missing value.
+    :return: [label_map, (averaged weight, steps)]. get_label and test_perceptron with perceptron_type 1 use the
+        averaged weight directly, so averaged prediction is one dot product.
+    """
+    examples, labels, label_map = load_examples(file_path)
+    sparse = scipy.sparse.issparse(examples)
+    if sparse:
+        examples = examples.tocsr()
+
+    weight = numpy.zeros(examples.shape[1])
+    accumulator = numpy.zeros(examples.shape[1])
+    learning_rate = 1 / (10**3)
+    count = 1
+
+    for t in range(epochs):
+        for i in range(examples.shape[0]):
+            if sparse:
+                start, end = examples.indptr[i], examples.indptr[i + 1]
+                indices = examples.indices[start:end]
+                values = examples.data[start:end]
+            else:
+                indices = slice(None)
+                values = examples[i, :]
+
+            if sgn(weight[indices] @ values) != labels[i]:
+                update = learning_rate * labels[i] * values
+                weight[indices] += update
+                accumulator[indices] += count * update
+            count += 1
+
+    # weight - accumulator / count is the sum of the weights after every step divided by count; rescale to the mean.
+    steps = count - 1
+    return [label_map, tuple([(count * weight - accumulator) / max(steps, 1), steps])]
+
+
+def kernel_matrix(a, b, gamma):
+    """
+    Kernel values between every row of a and every row of b.
+    :param a: Array or scipy.sparse matrix of examples.
+    :param b: Array or scipy.sparse matrix of examples.
+    :param gamma: Gaussian kernel width, exp(-||x - z||^2 / gamma), or None for the linear kernel x . z.
+    :return: numpy array of shape (len(a), len(b)).
+    """
+    if gamma is None:
+        product = a @ b.T
+        return product.toarray() if scipy.sparse.issparse(product) else numpy.asarray(product)
+    if scipy.sparse.issparse(a) or scipy.sparse.issparse(b):
+        a_norms = numpy.asarray(a.multiply(a).sum(axis=1)).ravel() if scipy.sparse.issparse(a) else (a * a).sum(axis=1)
+        b_norms = numpy.asarray(b.multiply(b).sum(axis=1)).ravel() if scipy.sparse.issparse(b) else (b * b).sum(axis=1)
+        product = a @ b.T
+        product = product.toarray() if scipy.sparse.issparse(product) else numpy.asarray(product)
+        distances = numpy.maximum(a_norms[:, None] + b_norms[None, :] - 2 * product, 0)
+    else:
+        distances = cdist(a, b, 'sqeuclidean')
+    return numpy.exp(-distances / gamma)
+
+
+class KernelRowCache:
+    """
+    Kernel values between the training examples and the support set of a kernel perceptron. Only support vectors
+    (examples with a mistake) enter a score, so nothing is computed against the rest of the training set.
+    When the whole Gram matrix fits in max_rows rows, it is computed up front with pdist, as dual_svm does. Otherwise
+    the full kernel row of each of the first max_rows support vectors is stored when it joins the support set, and
+    later support vectors are evaluated against each example on demand. Every support vector takes part in every
+    score, so keeping the earliest rows is as good as any eviction order, and rows are never recomputed.
+    """
+
+    def __init__(self, examples, gamma, max_rows=1024):
+        """
+        :param examples: Training examples.
+        :param gamma: Gaussian kernel width, or None for the linear kernel.
+        :param max_rows: Maximum number of kernel rows held in memory.
+        """
+        self.examples = examples
+        self.gamma = gamma
+        self.gram_matrix = None
+        self.columns = None
+        self.cached = 0
+
+        n = examples.shape[0]
+        if max_rows >= n and not scipy.sparse.issparse(examples):
+            if gamma is None:
+                self.gram_matrix = examples @ examples.T
+            else:
+                self.gram_matrix = numpy.exp(-squareform(pdist(examples, 'sqeuclidean')) / gamma)
+        else:
+            # Column k holds the kernel row of the k-th support vector, so an example's cached values are contiguous.
+            self.columns = numpy.empty((n, min(max_rows, n)))
+
+    def add_support(self, j):
+        """
+        Called when example j joins the support set.
+        """
+        if self.columns is not None and self.cached < self.columns.shape[1]:
+            self.columns[:, self.cached] = kernel_matrix(self.examples[j:j + 1], self.examples, self.gamma)[0]
+            self.cached += 1
+
+    def score(self, i, support, coefficients):
+        """
+        :param i: Index of the example to score.
+        :param support: Indices of the support set, in the order they were added.
+        :param coefficients: Coefficient of every training example.
+        :return: sum over support vectors j of coefficients[j] * K(x_j, x_i).
+        """
+        if self.gram_matrix is not None:
+            return self.gram_matrix[i, support] @ coefficients[support]
+        score = self.columns[i, :self.cached] @ coefficients[support[:self.cached]]
+        if len(support) > self.cached:
+            rest = support[self.cached:]
+            score += kernel_matrix(self.examples[i:i + 1], self.examples[rest], self.gamma)[0] @ coefficients[rest]
+        return score
+
+
+def kernel_perceptron(file_path, epochs, gamma, missing_identifier, cache_rows=1024):
+    """
+    Kernel perceptron in dual form. Instead of a weight vector, keeps a mistake count per training example; the score
+    of example i is sum_j count_j * y_j * K(x_j, x_i) over the support set, the examples with a mistake.
+    :param file_path: File path, or (instances, labels, label_map) tuple as accepted by perceptron.
+    :param epochs: Number of passes over the training data.
+    :param gamma: Gaussian kernel width, or None for the linear kernel.
+    :param missing_identifier: Data within examples indicating a missing value.
+    :param cache_rows: Maximum number of kernel rows held in memory. With at least as many rows as examples, the full
+        Gram matrix is computed once; otherwise rows of the first cache_rows support vectors are kept, and the kernel
+        against later support vectors is computed per example.
+    :return: [label_map, support examples, support coefficients (count * label), gamma]. Only examples with a
+        mistake are kept.
+    """
+    examples, labels, label_map = load_examples(file_path)
+    if scipy.sparse.issparse(examples):
+        examples = examples.tocsr()
+    else:
+        examples = numpy.asarray(examples, dtype=numpy.float64)
+    labels = numpy.asarray(labels, dtype=numpy.float64)
+
+    n = examples.shape[0]
+    cache = KernelRowCache(examples, gamma, cache_rows)
+    coefficients = numpy.zeros(n)
+    support = numpy.empty(n, dtype=numpy.intp)
+    size = 0
+
+    for t in range(epochs):
+        for i in range(n):
+            score = cache.score(i, support[:size], coefficients) if size > 0 else 0.0
+            if sgn(score) != labels[i]:
+                # Coefficients only move in the direction of their label, so they never return to zero.
+                if coefficients[i] == 0:
+                    support[size] = i
+                    size += 1
+                    cache.add_support(i)
+                coefficients[i] += labels[i]
+
+    support = numpy.sort(support[:size])
+    return [label_map, examples[support], coefficients[support], gamma]
+
+
+def predict_kernel_batch(hypothesis, examples, chunk_size=4096):
+    """
+    Predicts +/-1 labels for a matrix of examples, one (chunk x support) kernel block at a time.
+    :param hypothesis: List as returned by kernel_perceptron.
+    :param examples: Array or scipy.sparse matrix of augmented examples.
+    :param chunk_size: Rows scored at a time.
+    :return: numpy array of +/-1 predictions.
+    """
+    support, coefficients, gamma = hypothesis[1], hypothesis[2], hypothesis[3]
+    predictions = numpy.ones(examples.shape[0], dtype=numpy.int64)
+    if len(coefficients) == 0:
+        return predictions
+    for start in range(0, examples.shape[0], chunk_size):
+        scores = kernel_matrix(examples[start:start + chunk_size], support, gamma) @ coefficients
+        predictions[start:start + chunk_size] = sign(scores)
+    return predictions
+
+
+class StreamingPerceptron:
+    """
+    Perceptron trained incrementally with partial_fit, one batch of examples at a time, for data that arrives as a
+    stream. Only O(d) state is kept for the standard and averaged variants; the voted variant keeps at most
+    max_vectors past weight vectors, dropping the one with the fewest votes when full.
+    """
+
+    def __init__(self, perceptron_type=1, max_vectors=1000, learning_rate=1 / (10**3)):
+        """
+        :param perceptron_type: Variant to train, as in get_label.
+            1 - Standard Perceptron
+            2 - Voted Perceptron
+            3 - Averaged Perceptron
+        :param max_vectors: Maximum number of past weight vectors kept by the voted perceptron.
+        :param learning_rate: Step size of each update.
+        """
+        if perceptron_type not in (1, 2, 3):
+            raise ValueError("Unknown perceptron type: " + str(perceptron_type))
+        self.perceptron_type = perceptron_type
+        self.max_vectors = max_vectors
+        self.learning_rate = learning_rate
+        self.label_map = {}
+        self.weight = None
+        self.accumulator = None
+        self.history = []
+        self.correct_count = 0
+        self.count = 1
+
+    def map_labels(self, raw_labels):
+        """
+        Maps raw labels with the label map built from earlier batches, so a label keeps its sign across batches.
+        """
+        for label in dict.fromkeys(raw_labels):
+            if label not in self.label_map:
+                if len(self.label_map) == 2:
+                    raise ValueError("More than two labels in stream: " + str(label))
+                self.label_map[label] = -1 if len(self.label_map) == 0 else 1
+        return numpy.array([self.label_map[label] for label in raw_labels], dtype=numpy.float64)
+
+    def partial_fit(self, batch):
+        """
+        Makes one pass over a batch of examples.
+        :param batch: Array of augmented examples with the raw label in the last column, as yielded by
+            IOUtilities.csv_chunks, or an (instances, raw labels) tuple.
+        :return: self
+        """
+        if isinstance(batch, tuple):
+            examples, raw_labels = numpy.asarray(batch[0], dtype=numpy.float64), list(batch[1])
+        else:
+            batch = numpy.asarray(batch, dtype=numpy.float64)
+            examples, raw_labels = batch[:, :-1], batch[:, -1].tolist()
+        labels = self.map_labels(raw_labels)
+
+        if self.weight is None:
+            self.weight = numpy.zeros(examples.shape[1])
+            self.accumulator = numpy.zeros(examples.shape[1])
+
+        for i in range(len(examples)):
+            if sgn(self.weight @ examples[i]) != labels[i]:
+                update = self.learning_rate * labels[i] * examples[i]
+                if self.perceptron_type == 2:
+                    self.retain(self.weight.copy(), self.correct_count)
+                elif self.perceptron_type == 3:
+                    self.accumulator += self.count * update
+                self.weight += update
+                self.correct_count = 0
+            else:
+                self.correct_count += 1
+            self.count += 1
+
+        return self
+
+    def retain(self, weight, correct_count):
+        self.history.append(tuple([weight, correct_count]))
+        if len(self.history) > self.max_vectors:
+            self.history.pop(min(range(len(self.history)), key=lambda k: self.history[k][1]))
+
+    def hypothesis(self):
+        """
+        :return: List in the format returned by perceptron: a label map followed by (weight, count) tuples. The
+            averaged variant returns its averaged weight, as averaged_perceptron does.
+        """
+        if self.weight is None:
+            raise ValueError("No examples have been seen.")
+        if self.perceptron_type == 3:
+            steps = self.count - 1
+            return [dict(self.label_map),
+                    tuple([(self.count * self.weight - self.accumulator) / max(steps, 1), steps])]
+        current = tuple([self.weight.copy(), self.correct_count])
+        if self.perceptron_type == 2:
+            return [dict(self.label_map)] + self.history + [current]
+        return [dict(self.label_map), current]
+
+    def predict(self, examples):
+        """
+        :param examples: Array of augmented examples.
+        :return: numpy array of +/-1 predictions.
+        """
+        return predict_batch(self.hypothesis(), examples, 2 if self.perceptron_type == 2 else 1)
+
+    def save_checkpoint(self, file_path):
+        """
+        Saves the learner's state so training can resume from the next batch.
+        :param file_path: Path of the checkpoint file.
+        :return: None
+        """
+        IOUtilities.save_model(self, file_path)
+
+
+def load_checkpoint(file_path):
+    """
+    Loads a StreamingPerceptron saved by save_checkpoint.
+    :param file_path: Path of the checkpoint file.
+    :return: StreamingPerceptron ready for partial_fit.
+    """
+    return IOUtilities.load_model(file_path)
+
+
+def streaming_perceptron(source, perceptron_type=1, chunk_size=1000, model=None, checkpoint_path=None):
+    """
+    Trains a StreamingPerceptron on a csv stream, one chunk at a time.
+    :param source: File path, open text file, or "-" for standard input, of all numeric csv data with the label last.
+    :param perceptron_type: Variant to train when model is None, as in StreamingPerceptron.
+    :param chunk_size: Number of lines per batch.
+    :param model: StreamingPerceptron to continue training, e.g. from load_checkpoint.
+    :param checkpoint_path: If given, the model is checkpointed here after every batch.
+    :return: The StreamingPerceptron.
+    """
+    if model is None:
+        model = StreamingPerceptron(perceptron_type)
+    for batch in IOUtilities.csv_chunks(source, chunk_size):
+        model.partial_fit(batch)
+        if checkpoint_path is not None:
+            model.save_checkpoint(checkpoint_path)
+    return model
+
+
 def sgn(x):
     if x < 0:
         return -1
@@ -59,19 +432,17 @@ def get_label(perceptron, example, missing_identifier, perceptron_type):
     label_map = perceptron.pop(0)
 
     if perceptron_type == 1:
-        predictor = numpy.transpose(numpy.array(perceptron[-1][0]))
-        return sgn(predictor @ example)
+        return sgn(dot(numpy.array(perceptron[-1][0]), example))
     elif perceptron_type == 2:
         result = 0
         for predictor in perceptron:
-            weight = numpy.transpose(predictor[0])
-            result += predictor[1] * (weight @ example)
+            result += predictor[1] * sgn(dot(predictor[0], example))
         return sgn(result)
     elif perceptron_type == 3:
         average = numpy.zeros(len(perceptron[0][0]))
         for predictor in perceptron:
             average += predictor[0]
-        result = numpy.transpose(average) @ example
+        result = dot(average, example)
 
         if label_map[0] == sgn(result):
             return label_map[0]
@@ -79,19 +450,87 @@ def get_label(perceptron, example, missing_identifier, perceptron_type):
             return label_map[1]
 
 
+class CompiledPerceptron:
+    """
+    Perceptron hypothesis stacked into arrays for batch prediction.
+        weights - (k x d) matrix of the stored weight vectors.
+        counts - Number of correct predictions each weight vector survived, its vote in voted prediction.
+        average - Sum of the stored weight vectors, as used by averaged prediction.
+    """
+
+    def __init__(self, perceptron):
+        """
+        :param perceptron: List as returned by perceptron or averaged_perceptron: a label map followed by
+            (weight, count) tuples.
+        """
+        self.label_map = perceptron[0]
+        self.weights = numpy.array([predictor[0] for predictor in perceptron[1:]], dtype=numpy.float64)
+        self.counts = numpy.array([predictor[1] for predictor in perceptron[1:]], dtype=numpy.float64)
+        self.average = self.weights.sum(axis=0)
+
+
+def compile_perceptron(perceptron):
+    return perceptron if isinstance(perceptron, CompiledPerceptron) else CompiledPerceptron(perceptron)
+
+
+def sign(scores):
+    # Same convention as sgn: 0 maps to +1.
+    return numpy.where(scores < 0, -1, 1)
+
+
+def predict_batch(perceptron, examples, perceptron_type, chunk_size=65536):
+    """
+    Predicts +/-1 labels for a whole matrix of examples with matrix products.
+        1 - Standard: sign(X w_k)
+        2 - Voted: sign(sign(X W^T) c)
+        3 - Averaged: sign(X w_avg)
+    :param perceptron: CompiledPerceptron, or list as returned by perceptron.
+    :param examples: Dense array or scipy.sparse matrix of augmented examples.
+    :param perceptron_type: Calculation method, as in get_label.
+    :param chunk_size: Rows scored at a time, bounding the (rows x k) voted score matrix.
+    :return: numpy array of +/-1 predictions.
+    """
+    model = compile_perceptron(perceptron)
+
+    if perceptron_type == 1:
+        return sign(examples @ model.weights[-1])
+    elif perceptron_type == 2:
+        predictions = numpy.empty(examples.shape[0], dtype=numpy.int64)
+        for start in range(0, examples.shape[0], chunk_size):
+            votes = sign(examples[start:start + chunk_size] @ model.weights.T)
+            predictions[start:start + chunk_size] = sign(votes @ model.counts)
+        return predictions
+    elif perceptron_type == 3:
+        return sign(examples @ model.average)
+    raise ValueError("Unknown perceptron type: " + str(perceptron_type))
+
+
 def test_perceptron(perceptron, test_file_path, missing_identifier, perceptron_type):
 
-    data = IOUtilities.data_parsing_numeric(test_file_path)
-    examples, labels, label_map = IOUtilities.data_to_array(data)
+    model = compile_perceptron(perceptron)
+    examples, labels, label_map = load_examples(test_file_path)
+
+    # data_to_array maps labels in order of appearance, so map test labels with the training label map.
+    original = {value: label for label, value in label_map.items()}
+    labels = numpy.array([model.label_map.get(original.get(label), 0) for label in labels])
+
+    predictions = predict_batch(model, examples, perceptron_type)
+    correct = int(numpy.sum(labels * predictions > 0))
+
+    return tuple([correct, len(labels)])
+
+
+def test_kernel_perceptron(hypothesis, test_file_path):
 
-    predictions = []
+    examples, labels, label_map = load_examples(test_file_path)
+    if not scipy.sparse.issparse(examples):
+        examples = numpy.asarray(examples, dtype=numpy.float64)
 
-    for example in examples:
-        predictions.append(get_label(list(perceptron), example, missing_identifier, perceptron_type))
+    # data_to_array maps labels in order of appearance, so map test labels with the training label map.
+    original = {value: label for label, value in label_map.items()}
+    labels = numpy.array([hypothesis[0].get(original.get(label), 0) for label in labels])
 
-    correct = 0
-    for i in range(len(labels)):
-        if labels[i] * predictions[i] > 0:
-            correct += 1
+    predictions = predict_kernel_batch(hypothesis, examples)
+    correct = int(numpy.sum(labels * predictions > 0))
 
     return tuple([correct, len(labels)])
@@ -0,0 +1,90 @@
+"""
+Author: John Jacobson (u1201441)
+Created: 2019-04-28
+
+This file contains kernel matrix utilities for the dual SVM. Gram matrices are computed one block of rows and columns
+at a time, with squared distances expanded as ||x||^2 + ||z||^2 - 2 x.z so the work is a BLAS matrix product, and
+every operation after the product is done in place on the block. The label outer product y_i * y_j can be folded
+into each block as it is written, so the dual problem's Q matrix is the only n x n array. Storage can be float32 to
+halve memory, and can be a .npy file on disk opened as a memory map for problems larger than memory.
+
+"""
+import numpy
+
+
+def square_norms(examples):
+    """
+    :param examples: Array of examples, one per row.
+    :return: float64 array of the squared norm of every example.
+    """
+    return numpy.einsum('ij,ij->i', examples, examples)
+
+
+def kernel_block(a, b, gamma, a_norms=None, b_norms=None, out=None):
+    """
+    Kernel values between every row of a and every row of b.
+    :param a: Array of examples.
+    :param b: Array of examples.
+    :param gamma: Gaussian kernel width, exp(-||x - z||^2 / gamma), or None for the linear kernel.
+    :param a_norms: Squared norms of a, if already known.
+    :param b_norms: Squared norms of b, if already known.
+    :param out: Optional array of shape (len(a), len(b)) to write into.
+    :return: Array of shape (len(a), len(b)).
+    """
+    block = numpy.dot(a, b.T, out=out)
+    if gamma is None:
+        return block
+
+    if a_norms is None:
+        a_norms = square_norms(a)
+    if b_norms is None:
+        b_norms = square_norms(b)
+    # block = exp(-(||a||^2 + ||b||^2 - 2 a.b) / gamma), without temporaries the size of the block.
+    block *= -2
+    block += a_norms[:, None]
+    block += b_norms[None, :]
+    numpy.maximum(block, 0, out=block)
+    block *= -1 / gamma
+    numpy.exp(block, out=block)
+    return block
+
+
+def kernel_matrix(examples, gamma, labels=None, dtype=numpy.float64, block_size=2048, memmap_path=None):
+    """
+    Gram matrix of a set of examples, computed in square blocks. Only blocks on or above the diagonal are computed;
+    the rest are copied from their transpose.
+    :param examples: Array of examples, one per row.
+    :param gamma: Gaussian kernel width, or None for the linear kernel.
+    :param labels: Optional array of +/-1 labels. If given, returns Q with Q_ij = y_i * y_j * K(x_i, x_j), as used
+        by the dual SVM, folded into each block in place.
+    :param dtype: Storage type, numpy.float64 or numpy.float32.
+    :param block_size: Rows and columns per block.
+    :param memmap_path: If given, the matrix is written to a .npy file at this path and returned as a memory map.
+    :return: Array of shape (n, n).
+    """
+    examples = numpy.asarray(examples, dtype=numpy.float64)
+    n = len(examples)
+    norms = square_norms(examples)
+    if labels is not None:
+        labels = numpy.asarray(labels, dtype=numpy.float64)
+
+    if memmap_path is None:
+        result = numpy.empty((n, n), dtype=dtype)
+    else:
+        result = numpy.lib.format.open_memmap(memmap_path, mode='w+', dtype=dtype, shape=(n, n))
+
+    for start in range(0, n, block_size):
+        rows = slice(start, min(start + block_size, n))
+        for column_start in range(start, n, block_size):
+            columns = slice(column_start, min(column_start + block_size, n))
+            block = kernel_block(examples[rows], examples[columns], gamma, norms[rows], norms[columns])
+            if labels is not None:
+                block *= labels[rows, None]
+                block *= labels[None, columns]
+            result[rows, columns] = block
+            if column_start != start:
+                result[columns, rows] = block.T
+
+    if memmap_path is not None:
+        result.flush()
+    return result
@@ -0,0 +1,294 @@
+"""
+Author: John Jacobson (u1201441)
+Created: 2019-04-28
+
+This is a Sequential Minimal Optimization solver for the dual SVM, following the decomposition method of LIBSVM
+(Fan, Chen, and Lin, 2005). Each iteration updates two alphas analytically:
+    Working set selection - i is the maximal violating alpha, and j the alpha giving the largest decrease of the
+        dual objective under a second order model.
+    Shrinking - alphas stuck at a bound are periodically removed from the active set. When the active problem
+        converges, the full gradient is rebuilt from the support vectors and training resumes on all alphas if any
+        shrunk alpha still violates the optimality conditions.
+    Kernel cache - rows of the Gram matrix are computed on demand and kept in a least recently used cache of a
+        configurable size in MB, so memory does not grow with n^2.
+
+"""
+from collections import OrderedDict
+import numpy
+import IOUtilities
+import KernelMatrix
+
+
+TAU = 1e-12
+
+
+class KernelCache:
+    """
+    Rows of the Gram matrix for a Gaussian or linear kernel, held in a least recently used cache.
+    """
+
+    def __init__(self, examples, gamma, cache_size=200, dtype=numpy.float64):
+        """
+        :param examples: float64 array of training examples.
+        :param gamma: Gaussian kernel width, exp(-||x - z||^2 / gamma), or None for the linear kernel.
+        :param cache_size: Cache size in MB.
+        :param dtype: Storage type of cached rows; numpy.float32 fits twice as many rows.
+        """
+        self.examples = examples
+        self.gamma = gamma
+        self.dtype = dtype
+        self.square_norms = KernelMatrix.square_norms(examples)
+        self.max_rows = max(2, int(cache_size * 2**20) // (numpy.dtype(dtype).itemsize * len(examples)))
+        self.rows = OrderedDict()
+        self.misses = 0
+
+    def diagonal(self):
+        if self.gamma is None:
+            return self.square_norms.copy()
+        return numpy.ones(len(self.examples))
+
+    def row(self, i):
+        row = self.rows.get(i)
+        if row is not None:
+            self.rows.move_to_end(i)
+            return row
+
+        self.misses += 1
+        row = KernelMatrix.kernel_block(self.examples[i:i + 1], self.examples, self.gamma, self.square_norms[i:i + 1],
+                                        self.square_norms)[0].astype(self.dtype, copy=False)
+        self.rows[i] = row
+        if len(self.rows) > self.max_rows:
+            self.rows.popitem(last=False)
+        return row
+
+    def block(self, rows, columns):
+        """
+        Kernel values between the examples in rows (a slice) and the examples in columns, as one matrix product.
+        :return: numpy array of shape (rows, len(columns)).
+        """
+        return KernelMatrix.kernel_block(self.examples[rows], self.examples[columns], self.gamma,
+                                         self.square_norms[rows], self.square_norms[columns])
+
+
+def full_gradient(cache, alphas, labels, block_elements=2**22):
+    """
+    Gradient of the dual objective, Q alpha - 1, from the support vectors only. Rows are processed in blocks of at
+    most block_elements kernel values, so the rebuild needs no n x support vectors array.
+    """
+    support = numpy.flatnonzero(alphas)
+    gradient = -numpy.ones(len(alphas))
+    if len(support) > 0:
+        coefficients = alphas[support] * labels[support]
+        block_rows = max(1, block_elements // len(support))
+        for start in range(0, len(alphas), block_rows):
+            rows = slice(start, start + block_rows)
+            gradient[rows] += labels[rows] * (cache.block(rows, support) @ coefficients)
+    return gradient
+
+
+def bound_masks(alphas, labels, weight_constant):
+    """
+    :return: Boolean masks of the alphas that can move up (I_up) and down (I_low) in the direction of y.
+    """
+    below_upper = alphas < weight_constant
+    above_lower = alphas > 0
+    positive = labels > 0
+    return (positive & below_upper) | (~positive & above_lower), (positive & above_lower) | (~positive & below_upper)
+
+
+def select_working_set(cache, active, alphas, labels, gradient, diagonal, weight_constant):
+    """
+    Second order working set selection (WSS2) over the active alphas.
+    :return: (i, j, gap), where i or j is -1 when no pair violates the optimality conditions, and gap is the maximal
+        violation m(alpha) - M(alpha).
+    """
+    y_gradient = labels[active] * gradient[active]
+    up, low = bound_masks(alphas[active], labels[active], weight_constant)
+    if not up.any() or not low.any():
+        return -1, -1, 0.0
+
+    candidates = numpy.where(up, -y_gradient, -numpy.inf)
+    best = int(numpy.argmax(candidates))
+    g_max = candidates[best]
+    i = active[best]
+    g_max2 = numpy.max(numpy.where(low, y_gradient, -numpy.inf))
+
+    gain = g_max + y_gradient
+    eligible = low & (gain > 0)
+    if not eligible.any():
+        return i, -1, g_max + g_max2
+
+    curvature = diagonal[i] + diagonal[active] - 2 * cache.row(i)[active]
+    curvature = numpy.where(curvature > 0, curvature, TAU)
+    decrease = numpy.where(eligible, -gain ** 2 / curvature, numpy.inf)
+    j = active[int(numpy.argmin(decrease))]
+    return i, j, g_max + g_max2
+
+
+def update_pair(i, j, alphas, labels, gradient, q_ij, diagonal, weight_constant):
+    """
+    Analytic solution of the two variable subproblem, clipped to the box [0, C].
+    :param q_ij: y_i * y_j * K(x_i, x_j).
+    :return: New values of alphas[i] and alphas[j].
+    """
+    c = weight_constant
+    alpha_i, alpha_j = alphas[i], alphas[j]
+
+    if labels[i] != labels[j]:
+        quad = diagonal[i] + diagonal[j] + 2 * q_ij
+        delta = (-gradient[i] - gradient[j]) / max(quad, TAU)
+        diff = alpha_i - alpha_j
+        alpha_i += delta
+        alpha_j += delta
+        if diff > 0:
+            if alpha_j < 0:
+                alpha_j, alpha_i = 0.0, diff
+        elif alpha_i < 0:
+            alpha_i, alpha_j = 0.0, -diff
+        if diff > 0:
+            if alpha_i > c:
+                alpha_i, alpha_j = c, c - diff
+        elif alpha_j > c:
+            alpha_j, alpha_i = c, c + diff
+    else:
+        quad = diagonal[i] + diagonal[j] - 2 * q_ij
+        delta = (gradient[i] - gradient[j]) / max(quad, TAU)
+        total = alpha_i + alpha_j
+        alpha_i -= delta
+        alpha_j += delta
+        if total > c:
+            if alpha_i > c:
+                alpha_i, alpha_j = c, total - c
+            if alpha_j > c:
+                alpha_j, alpha_i = c, total - c
+        else:
+            if alpha_j < 0:
+                alpha_j, alpha_i = 0.0, total
+            if alpha_i < 0:
+                alpha_i, alpha_j = 0.0, total
+
+    return alpha_i, alpha_j
+
+
+def shrink(active, alphas, labels, gradient, weight_constant):
+    """
+    Drops active alphas at a bound whose gradient shows they will stay there, as in LIBSVM's be_shrunk.
+    :return: The new active index array.
+    """
+    y_gradient = labels[active] * gradient[active]
+    up, low = bound_masks(alphas[active], labels[active], weight_constant)
+    g_max1 = numpy.max(numpy.where(up, -y_gradient, -numpy.inf))
+    g_max2 = numpy.max(numpy.where(low, y_gradient, -numpy.inf))
+
+    # An alpha at a bound is in only one of I_up and I_low; shrink it if it cannot be part of a violating pair.
+    shrunk = (~up & (-y_gradient > g_max1)) | (~low & (y_gradient > g_max2))
+    return active[~shrunk]
+
+
+def bias(alphas, labels, gradient, weight_constant):
+    """
+    Bias b of the decision function sum_j alpha_j y_j K(x_j, x) + b, averaged over the free support vectors, or the
+    middle of the feasible interval when there are none.
+    """
+    y_gradient = labels * gradient
+    free = (alphas > 0) & (alphas < weight_constant)
+    if free.any():
+        return -numpy.mean(y_gradient[free])
+    up, low = bound_masks(alphas, labels, weight_constant)
+    upper = numpy.min(y_gradient[up]) if up.any() else numpy.inf
+    lower = numpy.max(y_gradient[low]) if low.any() else -numpy.inf
+    return -0.5 * (upper + lower) if numpy.isfinite(upper + lower) else 0.0
+
+
+def smo(examples, labels, weight_constant, gamma, tolerance=1e-3, cache_size=200, shrinking=True,
+        max_iterations=None, dtype=numpy.float64):
+    """
+    Solves the dual SVM, min 0.5 a^T Q a - sum(a) subject to 0 <= a <= C and y^T a = 0, where Q_ij = y_i y_j K_ij.
+    :param examples: float64 array of training examples.
+    :param labels: float64 array of +/-1 labels.
+    :param weight_constant: C, the upper bound on every alpha.
+    :param gamma: Gaussian kernel width, or None for the linear kernel.
+    :param tolerance: Stopping tolerance on the maximal violation of the optimality conditions.
+    :param cache_size: Kernel cache size in MB.
+    :param shrinking: True to shrink the active set.
+    :param max_iterations: Maximum number of pair updates; defaults to max(10^7, 100 n).
+    :param dtype: Storage type of cached kernel rows.
+    :return: alphas, bias, and number of iterations.
+    """
+    n = len(examples)
+    if max_iterations is None:
+        max_iterations = max(10**7, 100 * n)
+
+    cache = KernelCache(examples, gamma, cache_size, dtype)
+    diagonal = cache.diagonal()
+    alphas = numpy.zeros(n)
+    gradient = -numpy.ones(n)
+    active = numpy.arange(n)
+    shrink_interval = min(n, 1000)
+
+    iterations = 0
+    counter = shrink_interval
+    while iterations < max_iterations:
+        counter -= 1
+        if shrinking and counter == 0:
+            counter = shrink_interval
+            active = shrink(active, alphas, labels, gradient, weight_constant)
+
+        i, j, gap = select_working_set(cache, active, alphas, labels, gradient, diagonal, weight_constant)
+        if j == -1 or gap < tolerance:
+            if len(active) == n:
+                break
+            # The shrunk alphas' gradients are stale: rebuild them and check the whole problem.
+            gradient = full_gradient(cache, alphas, labels)
+            active = numpy.arange(n)
+            counter = shrink_interval
+            continue
+
+        row_i = cache.row(i)
+        row_j = cache.row(j)
+        old_i, old_j = alphas[i], alphas[j]
+        alphas[i], alphas[j] = update_pair(i, j, alphas, labels, gradient, labels[i] * labels[j] * row_i[j],
+                                           diagonal, weight_constant)
+
+        # Q_i = y_i * y * K_i, so the gradient changes by y * (y_i K_i d_i + y_j K_j d_j) over the active set.
+        change = labels[i] * (alphas[i] - old_i) * row_i[active] + labels[j] * (alphas[j] - old_j) * row_j[active]
+        gradient[active] += labels[active] * change
+        iterations += 1
+
+    if len(active) < n:
+        gradient = full_gradient(cache, alphas, labels)
+    return alphas, bias(alphas, labels, gradient, weight_constant), iterations
+
+
+def smo_svm(file_path, weight_constant, gamma, tolerance=1e-3, cache_size=200, shrinking=True, max_iterations=None,
+            dtype=numpy.float64):
+    """
+    Dual SVM trained with SMO, in the same format as dual_svm.
+    :param file_path: Path of the training data, or an (instances, labels, label_map) tuple.
+    :param weight_constant: C, the upper bound on every alpha.
+    :param gamma: Gaussian kernel width, exp(-||x - z||^2 / gamma), or None for the linear kernel.
+    Remaining parameters are the same as smo.
+    :return: [label_map, weight with bias appended, number of support vectors, examples, alphas, labels]. The weight
+        is the primal weight for the linear kernel, and zeros for the Gaussian kernel, which has no finite primal
+        weight; use the alphas to predict.
+    """
+    if isinstance(file_path, tuple):
+        examples, labels, label_map = file_path[0], file_path[1], file_path[2]
+    elif isinstance(file_path, str):
+        data = IOUtilities.data_parsing_numeric(file_path)
+        examples, labels, label_map = IOUtilities.data_to_array(data)
+    else:
+        raise AttributeError("Invalid data type: Please pass either file path or (instances, labels, label_map).")
+
+    examples = numpy.asarray(examples, dtype=numpy.float64)
+    labels = numpy.asarray(labels, dtype=numpy.float64)
+
+    alphas, b, iterations = smo(examples, labels, weight_constant, gamma, tolerance, cache_size, shrinking,
+                                max_iterations, dtype)
+
+    if gamma is None:
+        weight = (alphas * labels) @ examples
+    else:
+        weight = numpy.zeros(examples.shape[1])
+
+    return [label_map, numpy.append(weight, b), int(numpy.count_nonzero(alphas)), examples, alphas, labels]
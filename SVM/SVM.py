@@ -9,9 +9,11 @@ Incomplete
 
 """
 import numpy
+import scipy.sparse
 import IOUtilities
+import KernelMatrix
+import SMO
 from scipy.optimize import minimize as min
-from scipy.spatial.distance import pdist, squareform
 
 
 def shuffle_in_unison(a, b):
@@ -23,8 +25,13 @@ def shuffle_in_unison(a, b):
 
 def primal_svm(file_path, epochs, rate_schedule, weight_constant):
 
-    data = IOUtilities.data_parsing_numeric(file_path)
-    examples, labels, label_map = IOUtilities.data_to_array(data)
+    if isinstance(file_path, tuple):
+        examples, labels, label_map = file_path[0], numpy.array(file_path[1]), file_path[2]
+        if scipy.sparse.issparse(examples):
+            return primal_svm_sparse(examples.tocsr(), labels, label_map, epochs, rate_schedule, weight_constant)
+    else:
+        data = IOUtilities.data_parsing_numeric(file_path)
+        examples, labels, label_map = IOUtilities.data_to_array(data)
 
     examples = numpy.delete(examples,len(examples[0, :])-1,1)
 
@@ -48,6 +55,53 @@ def primal_svm(file_path, epochs, rate_schedule, weight_constant):
     return weights
 
 
+def primal_svm_sparse(examples, labels, label_map, epochs, rate_schedule, weight_constant):
+    """
+    Primal SVM SGD over a CSR matrix whose last column is the augmented 1, e.g. from IOUtilities.data_parsing_svmlight.
+    The weight is kept as scale * vector plus a separate bias, so the (1 - learning_rate) decay is O(1) and each update
+    only touches the example's non-zero features.
+    :return: [label_map, weight], with the bias weight last.
+    """
+    n = examples.shape[0]
+    d = examples.shape[1] - 1
+    vector = numpy.zeros(d)
+    scale = 1.0
+    bias = 0.0
+    learning_rate = 0.9  # gamma
+
+    for t in range(epochs):
+        order = numpy.random.permutation(n)
+        for i in order:
+            start, end = examples.indptr[i], examples.indptr[i + 1]
+            indices = examples.indices[start:end]
+            values = examples.data[start:end]
+            features = indices < d
+            augment = values[~features].sum()
+            indices = indices[features]
+            values = values[features]
+
+            predictor = scale * (vector[indices] @ values) + bias * augment
+            if predictor * labels[i] <= 1:
+                scale *= (1 - learning_rate)
+                bias *= (1 - learning_rate)
+                step = learning_rate * weight_constant * n * labels[i]
+                if scale == 0:
+                    vector[:] = 0
+                    scale = 1.0
+                vector[indices] += step * values / scale
+                bias += step * augment
+            else:
+                scale *= (1 - learning_rate)  # update weight, but not bias parameter.
+
+            if scale < 1e-9:
+                # Fold the scale back in before it underflows.
+                vector *= scale
+                scale = 1.0
+        learning_rate = rate_schedule(learning_rate, t)
+
+    return [label_map, numpy.append(scale * vector, bias)]
+
+
 def dual_objective_function(alphas, subgradient):
     result = -sum(alphas)
 
@@ -65,7 +119,25 @@ def gaussian_kernel(xi, xj, gamma):
     return result
 
 
-def dual_svm(file_path, weight_constant, gamma):
+def dual_svm(file_path, weight_constant, gamma, solver="slsqp", kernel_dtype=numpy.float64, memmap_path=None,
+             **smo_options):
+    """
+    Dual SVM.
+    :param file_path: Path of the training data.
+    :param weight_constant: C, the upper bound on every alpha.
+    :param gamma: Gaussian kernel width, or None for the linear kernel.
+    :param solver: "slsqp" to hand the whole quadratic program to scipy, or "smo" for SMO.smo_svm, which scales to
+        far more examples.
+    :param kernel_dtype: Storage type of the kernel matrix (slsqp) or cached kernel rows (smo); numpy.float32 halves
+        memory.
+    :param memmap_path: For slsqp, a .npy path to hold the kernel matrix on disk instead of in memory.
+    :param smo_options: Keyword arguments for SMO.smo_svm, e.g. tolerance and cache_size (MB).
+    :return: [label_map, weight with bias appended, number of positive alphas, examples, alphas, labels]
+    """
+    if solver == "smo":
+        return SMO.smo_svm(file_path, weight_constant, gamma, dtype=kernel_dtype, **smo_options)
+    elif solver != "slsqp":
+        raise ValueError("Unknown solver: " + str(solver))
 
     data = IOUtilities.data_parsing_numeric(file_path)
     examples, labels, label_map = IOUtilities.data_to_array(data)
@@ -82,17 +154,8 @@ def dual_svm(file_path, weight_constant, gamma):
         bnds.append((0, weight_constant))
     cnst = {'type': 'eq', 'fun': constraint, 'args': (labels,)}
 
-    if gamma is not None:
-        pairwise_dists = squareform(pdist(examples, 'euclidean'))
-        gram_matrix = numpy.exp(-pairwise_dists ** 2 / gamma)  # got this idea for optimization from stack exchange user bayerj
-        #for i in range(len(examples)):
-        #    for j in range(len(examples)):
-        #        gram_matrix[i][j] = gaussian_kernel(examples[i], examples[j], gamma) * labels[i] * labels[j]
-    else:
-        gram_matrix = (examples @ examples.T)
-
-    subgradient = gram_matrix * numpy.tile(labels.T, (len(gram_matrix), 1)).T * numpy.tile(labels,
-                                                                                           (len(gram_matrix), 1))
+    # Q_ij = y_i * y_j * K(x_i, x_j), built block by block with the labels folded in, so no other n x n array exists.
+    subgradient = KernelMatrix.kernel_matrix(examples, gamma, labels, kernel_dtype, memmap_path=memmap_path)
     objective_result = min(dual_objective_function, numpy.zeros(len(examples)), args=subgradient, method='SLSQP', bounds=bnds, constraints=cnst)
 
     dual_result = objective_result.x
@@ -110,10 +173,16 @@ def dual_svm(file_path, weight_constant, gamma):
             positive_alphas += 1
 
 
-    b = labels - (dual_result * labels).dot(gram_matrix)
-
+    # (alpha * y) . K = y * (alpha . Q), since Q = diag(y) K diag(y).
+    b = labels - labels * dual_result.dot(subgradient)
 
-    b = sum(b)/positive_alphas
+    # y_i - f(x_i) is the bias only on the margin, so average it over the free support vectors (0 < alpha < C),
+    # allowing for the solver's round-off, or over all support vectors if none are free.
+    tolerance = 1e-6 * weight_constant
+    margin = (dual_result > tolerance) & (dual_result < weight_constant - tolerance)
+    if not margin.any():
+        margin = dual_result > tolerance
+    b = float(numpy.mean(b[margin])) if margin.any() else 0.0
 
     weights.append(numpy.insert(weight, len(weight), b))
     weights.append(positive_alphas)
@@ -151,69 +220,119 @@ def get_label(hypothesis, example, label_map):
         return label_map[1]
 
 
+def map_test_labels(labels, test_label_map, label_map):
+    """
+    data_to_array maps labels in order of appearance, so re-map test labels with the training label map.
+    """
+    original = {value: label for label, value in test_label_map.items()}
+    return numpy.array([label_map.get(original.get(label), 0) for label in labels])
+
+
 def test_primal_svm(hypothesis, test_file_path):
 
+    if isinstance(test_file_path, tuple) and scipy.sparse.issparse(test_file_path[0]):
+        # Sparse data keeps its augmented column, which primal_svm_sparse learns a bias for.
+        labels = test_file_path[1]
+        scores = test_file_path[0] @ hypothesis[1]
+        correct = int(numpy.sum(numpy.where(scores < 0, -1, 1) * numpy.asarray(labels) > 0))
+        return tuple([correct, len(labels)])
+
     data = IOUtilities.data_parsing_numeric(test_file_path)
     examples, labels, label_map = IOUtilities.data_to_array(data)
 
     examples = numpy.delete(examples, len(examples[0, :])-1,1)
+    labels = map_test_labels(labels, label_map, hypothesis[0])
 
-    predictions = []
-    label_map = hypothesis[0]
-
-    for example in examples:
-        predictions.append(get_label(hypothesis, example, label_map))
-
-    correct = 0
-    for i in range(len(labels)):
-        if labels[i] * predictions[i] > 0:
-            correct += 1
+    predictions = numpy.where(examples @ hypothesis[1] < 0, -1, 1)
+    correct = int(numpy.sum(labels * predictions > 0))
 
     return tuple([correct, len(labels)])
 
 
-def get_label_kernel(hypothesis, example, label_map, gamma):
+class CompiledDualSVM:
+    """
+    Dual SVM hypothesis reduced to its support vectors, for batch prediction.
+        support - Examples with alpha above the tolerance.
+        coefficients - alpha * y of each support vector.
+        square_norms - Squared norm of each support vector, for the Gaussian kernel.
+        bias - Bias stored with the hypothesis weight.
     """
 
-    :param perceptron:
-    :param example:
-    :param perceptron_type: Calculation method
-        1 - Standard Perceptron
-        2 - Voted Perceptron
-        3 - Averaged Perceptron
-    :return:
+    def __init__(self, hypothesis, gamma, tolerance=1e-8):
+        """
+        :param hypothesis: List as returned by dual_svm.
+        :param gamma: Gaussian kernel width the hypothesis was trained with, or None for the linear kernel.
+        :param tolerance: Alphas at or below this are treated as zero.
+        """
+        examples, alphas, labels = hypothesis[-3], numpy.asarray(hypothesis[-2]), numpy.asarray(hypothesis[-1])
+        support = numpy.flatnonzero(alphas > tolerance)
+
+        self.label_map = hypothesis[0]
+        self.gamma = gamma
+        self.support = numpy.ascontiguousarray(numpy.asarray(examples, dtype=numpy.float64)[support])
+        self.coefficients = alphas[support] * labels[support]
+        self.square_norms = KernelMatrix.square_norms(self.support)
+        self.bias = hypothesis[1][-1]
+
+
+def compile_dual_svm(hypothesis, gamma, tolerance=1e-8):
+    if isinstance(hypothesis, CompiledDualSVM):
+        return hypothesis
+    return CompiledDualSVM(hypothesis, gamma, tolerance)
+
+
+def predict_dual_batch(model, examples, chunk_size=4096):
+    """
+    Predicts +/-1 labels with a compiled dual SVM, one (chunk x support vectors) kernel block at a time.
+    :param model: CompiledDualSVM.
+    :param examples: Array of examples in the same (augmented) format as the training data.
+    :param chunk_size: Rows scored at a time, bounding the kernel block to chunk_size x support vectors.
+    :return: numpy array of +/-1 predictions.
     """
+    examples = numpy.asarray(examples, dtype=numpy.float64)
+    predictions = numpy.empty(len(examples), dtype=numpy.int64)
+    for start in range(0, len(examples), chunk_size):
+        chunk = examples[start:start + chunk_size]
+        block = KernelMatrix.kernel_block(chunk, model.support, model.gamma, None, model.square_norms)
+        scores = block @ model.coefficients + model.bias
+        predictions[start:start + chunk_size] = numpy.where(scores < 0, -1, 1)
+    return predictions
 
-    examples = hypothesis[-3]
-    alphas = hypothesis[-2]
-    labels = hypothesis[-1]
-    result = 0
 
-    for i in range(len(hypothesis[-2])):
-        result += alphas[i] * labels[i] * gaussian_kernel(examples[i],example, gamma)
+def get_label_kernel(hypothesis, example, label_map, gamma):
+    """
+    :param hypothesis: List as returned by dual_svm, or a CompiledDualSVM.
+    :param example: A single example in the same format as the training data.
+    :param label_map: Label map of the hypothesis.
+    :param gamma: Gaussian kernel width, or None for the linear kernel.
+    :return: +/-1 label, as mapped by label_map.
+    """
+    result = predict_dual_batch(compile_dual_svm(hypothesis, gamma), [example])[0]
 
-    if label_map[0] == sgn(result):
+    if label_map[0] == result:
         return label_map[0]
     else:
         return label_map[1]
 
 
-def test_dual_svm(hypothesis, test_file_path):
+def test_dual_svm(hypothesis, test_file_path, gamma):
+    """
+    :param hypothesis: List as returned by dual_svm, or a CompiledDualSVM.
+    :param test_file_path: Path of the test data.
+    :param gamma: Gaussian kernel width the hypothesis was trained with, or None for the linear kernel. The list
+        returned by dual_svm does not record it, so it is required; a CompiledDualSVM must have been compiled with
+        the same value.
+    :return: Number of correct predictions, and number of examples.
+    """
+    if isinstance(hypothesis, CompiledDualSVM) and hypothesis.gamma != gamma:
+        raise ValueError("gamma " + str(gamma) + " does not match the compiled model's " + str(hypothesis.gamma))
+    model = compile_dual_svm(hypothesis, gamma)
 
     data = IOUtilities.data_parsing_numeric(test_file_path)
     examples, labels, label_map = IOUtilities.data_to_array(data)
+    labels = map_test_labels(labels, label_map, model.label_map)
 
-    examples = numpy.delete(examples, len(examples[0, :])-1,1)
-
-    predictions = []
-    label_map = hypothesis[0]
-
-    for example in examples:
-        predictions.append(get_label(hypothesis, example, label_map))
-
-    correct = 0
-    for i in range(len(labels)):
-        if labels[i] * predictions[i] > 0:
-            correct += 1
+    predictions = predict_dual_batch(model, examples)
+    correct = int(numpy.sum(labels * predictions > 0))
 
     return tuple([correct, len(labels)])
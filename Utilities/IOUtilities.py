@@ -8,6 +8,9 @@ and processing data for the included machine learning algorithms.
 
 """
 import numpy
+import pickle
+import scipy.sparse
+import sys
 
 
 def data_parsing(csv_file, numeric_cols):
@@ -110,3 +113,247 @@ def data_to_array(data):
     # examples[:, :-1] = instances
 
     return instances, labels, label_map
+
+
+def map_labels(raw_labels, label_map=None):
+    """
+    Maps labels to +/- 1 the way data_to_array does: the first label seen maps to -1, the next to +1.
+    :param raw_labels: Sequence of original labels.
+    :param label_map: Existing {label: +/-1} map to use, e.g. from training data.
+    :return: numpy array of +/-1 labels, and label map.
+    """
+    if label_map is None:
+        label_map = {}
+        label_val = -1
+        for label in raw_labels:
+            if label not in label_map:
+                label_map[label] = label_val
+                label_val += 2
+            if label_val > 1:
+                break
+    return numpy.array([label_map.get(label, 0) for label in raw_labels], dtype=numpy.float64), label_map
+
+
+def data_parsing_svmlight(file_path, n_features=None, label_map=None, raw_labels=False):
+    """
+    Reads a libsvm/svmlight file ("label index:value index:value ..." with 1-based indices) into a sparse matrix.
+    Examples are augmented with a trailing 1 in the last column, as data_parsing_numeric does.
+    :param file_path: File to be read
+    :param n_features: Number of features; defaults to the largest index in the file. Pass the training value when
+        reading test data.
+    :param label_map: Existing {label: +/-1} map, e.g. from training data.
+    :param raw_labels: True to return the labels as float targets, for regression, instead of mapping them to +/-1.
+    :return: scipy.sparse CSR instances, numpy array of +/-1 labels, and label map {label: +/-1}. With raw_labels,
+        the labels are float64 targets and the label map is None.
+    """
+    targets = []
+    indptr = [0]
+    indices = []
+    values = []
+
+    with open(file_path, 'r') as f:
+        for line in f:
+            line = line.split('#', 1)[0].split()
+            if not line:
+                continue
+            targets.append(float(line[0]))
+            for pair in line[1:]:
+                index, value = pair.split(':')
+                indices.append(int(index) - 1)
+                values.append(float(value))
+            indptr.append(len(indices))
+
+    if n_features is None:
+        n_features = max(indices) + 1 if indices else 0
+
+    n = len(targets)
+    instances = scipy.sparse.csr_matrix((values, indices, indptr), shape=(n, n_features), dtype=numpy.float64)
+    augment = scipy.sparse.csr_matrix(numpy.ones((n, 1)))
+    instances = scipy.sparse.hstack([instances, augment], format='csr')
+
+    if raw_labels:
+        return instances, numpy.array(targets, dtype=numpy.float64), None
+    labels, label_map = map_labels(targets, label_map)
+    return instances, labels, label_map
+
+
+def data_parsing_one_hot(csv_file, categorical_cols, vocabulary=None, label_map=None, raw_labels=False):
+    """
+    Reads a csv file into a sparse matrix, one-hot encoding the categorical columns. Every other column except the last
+    (label) column must be numeric. Examples are augmented with a trailing 1 in the last column.
+    :param csv_file: File to be read
+    :param categorical_cols: List of indices of categorical columns.
+    :param vocabulary: {column: {value: output column}} from training data, so test data is encoded the same way.
+        Values not in the vocabulary are left out.
+    :param label_map: Existing {label: +/-1} map, e.g. from training data.
+    :param raw_labels: True to return the labels as float targets, for regression, instead of mapping them to +/-1.
+    :return: scipy.sparse CSR instances, numpy array of +/-1 labels, label map {label: +/-1}, and vocabulary. With
+        raw_labels, the labels are float64 targets and the label map is None.
+    """
+    with open(csv_file, 'r') as f:
+        data = [line.strip().split(',') for line in f if line.strip()]
+
+    attribute_count = len(data[0]) - 1
+    categorical_cols = set(categorical_cols)
+
+    if vocabulary is None:
+        vocabulary = {}
+        width = 0
+        for col in range(attribute_count):
+            if col in categorical_cols:
+                values = sorted(set(instance[col] for instance in data))
+                vocabulary[col] = {value: width + k for k, value in enumerate(values)}
+                width += len(values)
+            else:
+                vocabulary[col] = width
+                width += 1
+    width = max(max(entry.values()) if isinstance(entry, dict) else entry for entry in vocabulary.values()) + 1
+
+    indptr = [0]
+    indices = []
+    values = []
+    for instance in data:
+        for col in range(attribute_count):
+            if col in categorical_cols:
+                index = vocabulary[col].get(instance[col])
+                if index is not None:
+                    indices.append(index)
+                    values.append(1.0)
+            else:
+                value = float(instance[col])
+                if value != 0:
+                    indices.append(vocabulary[col])
+                    values.append(value)
+        indices.append(width)  # Augment with 1
+        values.append(1.0)
+        indptr.append(len(indices))
+
+    instances = scipy.sparse.csr_matrix((values, indices, indptr), shape=(len(data), width + 1), dtype=numpy.float64)
+    if raw_labels:
+        return instances, numpy.array([instance[-1] for instance in data], dtype=numpy.float64), None, vocabulary
+    labels, label_map = map_labels([instance[-1] for instance in data], label_map)
+    return instances, labels, label_map, vocabulary
+
+
+def csv_to_npy(csv_file, npy_file, augment=False, chunk_size=65536):
+    """
+    Converts an all numeric csv file to a binary .npy array on disk, without holding the whole file in memory.
+    :param csv_file: File to be read
+    :param npy_file: Path of the .npy file to write.
+    :param augment: True to insert a column of 1s before the last (label) column, as data_parsing_numeric does.
+    :param chunk_size: Number of lines parsed at a time.
+    :return: Shape of the written array.
+    """
+    rows = 0
+    cols = 0
+    with open(csv_file, 'r') as f:
+        for line in f:
+            if line.strip():
+                if rows == 0:
+                    cols = len(line.split(',')) + (1 if augment else 0)
+                rows += 1
+
+    array = numpy.lib.format.open_memmap(npy_file, mode='w+', dtype=numpy.float64, shape=(rows, cols))
+
+    def write(start, lines):
+        chunk = numpy.array([line.split(',') for line in lines], dtype=numpy.float64)
+        if augment:
+            chunk = numpy.insert(chunk, chunk.shape[1] - 1, 1.0, axis=1)
+        array[start:start + len(chunk)] = chunk
+
+    start = 0
+    lines = []
+    with open(csv_file, 'r') as f:
+        for line in f:
+            if line.strip():
+                lines.append(line)
+            if len(lines) == chunk_size:
+                write(start, lines)
+                start += len(lines)
+                lines = []
+    if lines:
+        write(start, lines)
+
+    array.flush()
+    del array
+    return rows, cols
+
+
+def npy_chunks(npy_file, chunk_size, shuffle=True):
+    """
+    Reads a .npy array in chunks of rows through a memory map, so files larger than memory can be streamed.
+    When shuffling, chunks are visited in random order and the rows within each chunk are shuffled, using numpy's
+    global random state.
+    :param npy_file: Path of a .npy file, e.g. written by csv_to_npy.
+    :param chunk_size: Number of rows per chunk.
+    :param shuffle: True to shuffle chunk order and rows within chunks.
+    :return: Generator of float64 arrays, each an in-memory copy of one chunk.
+    """
+    array = numpy.load(npy_file, mmap_mode='r')
+    starts = numpy.arange(0, len(array), chunk_size)
+    if shuffle:
+        numpy.random.shuffle(starts)
+    for start in starts:
+        chunk = numpy.array(array[start:start + chunk_size], dtype=numpy.float64)
+        if shuffle:
+            numpy.random.shuffle(chunk)
+        yield chunk
+
+
+def csv_chunks(source, chunk_size, augment=True):
+    """
+    Reads an all numeric csv stream in chunks of lines, so unbounded input such as an event stream can be learned
+    from without holding it in memory.
+    :param source: File path, open text file, or "-" for standard input.
+    :param chunk_size: Number of lines per chunk.
+    :param augment: True to insert a column of 1s before the last (label) column, as data_parsing_numeric does.
+    :return: Generator of float64 arrays with the label in the last column.
+    """
+    def parse(lines):
+        chunk = numpy.array([line.split(',') for line in lines], dtype=numpy.float64)
+        if augment:
+            chunk = numpy.insert(chunk, chunk.shape[1] - 1, 1.0, axis=1)
+        return chunk
+
+    if source == '-':
+        f = sys.stdin
+    elif isinstance(source, str):
+        f = open(source, 'r')
+    else:
+        f = source
+
+    try:
+        lines = []
+        for line in f:
+            if line.strip():
+                lines.append(line)
+            if len(lines) == chunk_size:
+                yield parse(lines)
+                lines = []
+        if lines:
+            yield parse(lines)
+    finally:
+        if isinstance(source, str) and source != '-':
+            f.close()
+
+
+def save_model(model, file_path):
+    """
+    Writes a learned model (or any resumable training state) to disk so it can be reloaded later.
+    :param model: Object to be saved; decision trees, ensemble objects, and numpy arrays are all supported.
+    :param file_path: Path of the checkpoint file to write.
+    :return: None
+    """
+    with open(file_path, 'wb') as f:
+        pickle.dump(model, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def load_model(file_path):
+    """
+    Reads a model previously written by save_model.
+    NOTE: Checkpoints are pickled, so only load files from a trusted source.
+    :param file_path: Path of the checkpoint file to read.
+    :return: The saved object.
+    """
+    with open(file_path, 'rb') as f:
+        return pickle.load(f)